@@ -1,36 +1,125 @@
 from django.contrib import admin
+from django.db.models import Q
+from . import busqueda
 from .models import Cliente, Repartidor, Pedido, HistorialEstados, ReporteEntregas
+from .paginacion import PaginadorEstimado
+from .utils import ZONAS_VECINAS
+
+LIMITE_BUSQUEDA_ADMIN = 1000
+
+class ListaRapidaMixin:
+    """
+    Changelists de tablas grandes: total estimado (PaginadorEstimado), sin
+    el segundo COUNT(*) de la tabla completa y orden por llave primaria
+    descendente, que recorre el índice sin ordenar en memoria
+    """
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+    ordering = ['-pk']
+
+class EstadoFilter(admin.SimpleListFilter):
+    # Opciones fijas: AllValuesFieldListFilter haría un SELECT DISTINCT
+    # sobre toda la tabla en cada carga del changelist
+    title = 'estado nuevo'
+    parameter_name = 'estado_nuevo'
+
+    def lookups(self, request, model_admin):
+        return Pedido.ESTADO_CHOICES
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(estado_nuevo=self.value())
+        return queryset
+
+class ZonaEntregaFilter(admin.SimpleListFilter):
+    title = 'zona de entrega'
+    parameter_name = 'zona_entrega'
+
+    def lookups(self, request, model_admin):
+        return [(zona, zona) for zona in ZONAS_VECINAS]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(zona_entrega=self.value())
+        return queryset
+
+class BusquedaIndexadaMixin:
+    """
+    Busca con el índice de términos (busqueda.py) en vez de un icontains
+    por cada campo de search_fields, que solo se conserva para que el
+    admin muestre la caja de búsqueda
+    """
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        ids = busqueda.buscar_ids(self.model, search_term, limite=LIMITE_BUSQUEDA_ADMIN)
+        return queryset.filter(pk__in=ids), False
 
 @admin.register(Cliente)
-class ClienteAdmin(admin.ModelAdmin):
+class ClienteAdmin(BusquedaIndexadaMixin, admin.ModelAdmin):
     list_display = ['cedula', 'nombres', 'apellidos', 'telefono', 'zona', 'discapacidad', 'fecha_registro']
     search_fields = ['cedula', 'nombres', 'apellidos', 'telefono']
     list_filter = ['zona', 'discapacidad', 'fecha_registro']
     readonly_fields = ['fecha_registro']
 
 @admin.register(Repartidor)
-class RepartidorAdmin(admin.ModelAdmin):
+class RepartidorAdmin(BusquedaIndexadaMixin, admin.ModelAdmin):
     list_display = ['cedula', 'nombres', 'apellidos', 'telefono', 'vehiculo', 'disponible', 'zona_asignada']
     list_filter = ['vehiculo', 'disponible', 'activo', 'zona_asignada']
-    search_fields = ['cedula', 'nombres', 'apellidos']
+    search_fields = ['cedula', 'nombres', 'apellidos', 'telefono']
     list_editable = ['disponible']
 
 @admin.register(Pedido)
-class PedidoAdmin(admin.ModelAdmin):
+class PedidoAdmin(ListaRapidaMixin, admin.ModelAdmin):
     list_display = ['pedido_id', 'cliente', 'repartidor', 'estado', 'prioridad', 'zona_entrega', 'fecha_pedido']
-    list_filter = ['estado', 'prioridad', 'zona_entrega', 'fecha_pedido']
-    search_fields = ['cliente__nombres', 'cliente__apellidos', 'pedido_id']
+    list_filter = ['estado', 'prioridad', ZonaEntregaFilter, 'fecha_pedido']
+    list_select_related = ['cliente', 'repartidor']
+    search_fields = ['pedido_id', 'cliente__nombres', 'cliente__apellidos', 'cliente__cedula']
+    sortable_by = ['pedido_id', 'fecha_pedido']
     readonly_fields = ['fecha_pedido']
     raw_id_fields = ['cliente', 'repartidor']
 
+    def get_readonly_fields(self, request, obj=None):
+        # Estado y repartidor de un pedido existente cambian desde la aplicación,
+        # que reserva y libera la capacidad de los repartidores (transiciones.py)
+        if obj is None:
+            return self.readonly_fields
+        return [*self.readonly_fields, 'estado', 'repartidor']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Número de pedido exacto o cliente por el índice de búsqueda, en
+        # vez de icontains sobre CLIENTE unido a PEDIDO
+        termino = search_term.strip()
+        if not termino:
+            return queryset, False
+        filtro = Q(cliente_id__in=busqueda.buscar_ids(Cliente, termino, limite=LIMITE_BUSQUEDA_ADMIN))
+        if termino.isdigit():
+            filtro |= Q(pk=int(termino))
+        return queryset.filter(filtro), False
+
 @admin.register(HistorialEstados)
-class HistorialEstadosAdmin(admin.ModelAdmin):
+class HistorialEstadosAdmin(ListaRapidaMixin, admin.ModelAdmin):
     list_display = ['pedido', 'estado_anterior', 'estado_nuevo', 'fecha_cambio', 'usuario']
+    list_select_related = ['pedido__cliente']
     readonly_fields = ['fecha_cambio']
-    list_filter = ['fecha_cambio', 'estado_nuevo']
+    list_filter = ['fecha_cambio', EstadoFilter]
+    sortable_by = []
+    raw_id_fields = ['pedido']
 
 @admin.register(ReporteEntregas)
-class ReporteEntregasAdmin(admin.ModelAdmin):
+class ReporteEntregasAdmin(ListaRapidaMixin, admin.ModelAdmin):
     list_display = ['reporte_id', 'pedido', 'repartidor', 'estado_entrega', 'fecha_reporte', 'calificacion']
+    list_select_related = ['pedido__cliente', 'repartidor']
     list_filter = ['estado_entrega', 'fecha_reporte']
-    search_fields = ['pedido__pedido_id', 'repartidor__nombres']
\ No newline at end of file
+    search_fields = ['pedido__pedido_id', 'repartidor__nombres']
+    sortable_by = ['reporte_id', 'fecha_reporte']
+    raw_id_fields = ['pedido', 'repartidor']
+
+    def get_search_results(self, request, queryset, search_term):
+        termino = search_term.strip()
+        if not termino:
+            return queryset, False
+        filtro = Q(repartidor_id__in=busqueda.buscar_ids(Repartidor, termino, limite=LIMITE_BUSQUEDA_ADMIN))
+        if termino.isdigit():
+            filtro |= Q(pedido_id=int(termino))
+        return queryset.filter(filtro), False
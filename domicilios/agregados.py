@@ -0,0 +1,113 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, close_old_connections, connection
+
+# Segundos que la página espera por cada agregado antes de usar el último
+# valor conocido
+TIEMPO_LIMITE_AGREGADO = getattr(settings, 'TIEMPO_LIMITE_AGREGADO', 2.0)
+# Cuánto se conserva ese último valor conocido
+TIEMPO_CACHE_RESPALDO = 24 * 3600
+# Hilos (y por lo tanto conexiones) que pueden ocupar los agregados a la vez
+HILOS_AGREGADOS = getattr(settings, 'HILOS_AGREGADOS', 8)
+# Instrucciones de SQLite entre revisiones del tiempo límite
+PASOS_SQLITE = 10000
+
+_pool = ThreadPoolExecutor(max_workers=HILOS_AGREGADOS, thread_name_prefix='agregados')
+
+
+@contextmanager
+def _tiempo_maximo(segundos):
+    """
+    Corta en la base las consultas que pasan de `segundos`: con la página
+    ya servida desde el respaldo no tiene sentido que sigan ocupando el
+    hilo y la conexión. MySQL lo aplica a cada SELECT
+    (MAX_EXECUTION_TIME), PostgreSQL a cada sentencia (statement_timeout)
+    y en SQLite un progress handler interrumpe la consulta al vencer el
+    plazo.
+    """
+    connection.ensure_connection()
+    if connection.vendor == 'sqlite':
+        vence = time.monotonic() + segundos
+        connection.connection.set_progress_handler(lambda: time.monotonic() > vence, PASOS_SQLITE)
+        try:
+            yield
+        finally:
+            connection.connection.set_progress_handler(None, PASOS_SQLITE)
+        return
+    sentencias = {
+        'mysql': ('SET SESSION MAX_EXECUTION_TIME = %s', 'SET SESSION MAX_EXECUTION_TIME = 0'),
+        'postgresql': ('SET statement_timeout = %s', 'RESET statement_timeout'),
+    }
+    if connection.vendor not in sentencias:
+        yield
+        return
+    activar, desactivar = sentencias[connection.vendor]
+    with connection.cursor() as cursor:
+        cursor.execute(activar, [max(int(segundos * 1000), 1)])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(desactivar)
+
+
+def _en_hilo_propio(funcion, limite):
+    """
+    Ejecuta la consulta en un hilo de un pool acotado (HILOS_AGREGADOS) con
+    su propia conexión y un tiempo máximo en la base. El ORM asíncrono de
+    Django 4.2 (acount, aaggregate...) pasa todo por un único hilo, así que
+    no daría concurrencia real entre consultas.
+    """
+    def ejecutar():
+        close_old_connections()
+        try:
+            with _tiempo_maximo(limite):
+                return funcion()
+        finally:
+            close_old_connections()
+    return sync_to_async(ejecutar, thread_sensitive=False, executor=_pool)
+
+
+async def _calcular(nombre, funcion, respaldo, limite):
+    clave = f'agregado:{nombre}'
+    try:
+        valor = await asyncio.wait_for(_en_hilo_propio(funcion, limite)(), limite)
+    except asyncio.TimeoutError:
+        # La base corta la consulta al vencer el mismo plazo; si el pool
+        # está lleno la espera en cola también cuenta
+        return await cache.aget(clave, respaldo), True
+    except DatabaseError:
+        # Corte que le gana al wait_for ("interrupted" en SQLite), bloqueo o
+        # conexión caída: un agregado que falla no tumba la página
+        return await cache.aget(clave, respaldo), True
+    await cache.aset(clave, valor, TIEMPO_CACHE_RESPALDO)
+    return valor, False
+
+
+async def calcular_concurrentes(agregados, limite=None):
+    """
+    Calcula en paralelo los agregados de `agregados` (nombre -> (función
+    síncrona, valor de respaldo)). Cada función debe devolver datos ya
+    evaluados (listas, números), no querysets perezosos.
+
+    Retorna (valores por nombre, lista de nombres que se sirvieron desde el
+    último valor conocido por superar el tiempo límite o fallar en la base).
+    """
+    limite = TIEMPO_LIMITE_AGREGADO if limite is None else limite
+    nombres = list(agregados)
+    resultados = await asyncio.gather(*(
+        _calcular(nombre, *agregados[nombre], limite) for nombre in nombres
+    ))
+    valores = {}
+    obsoletos = []
+    for nombre, (valor, obsoleto) in zip(nombres, resultados):
+        valores[nombre] = valor
+        if obsoleto:
+            obsoletos.append(nombre)
+    return valores, obsoletos
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class DomiciliosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'domicilios'
-    verbose_name = 'Gestión de Domicilios'
\ No newline at end of file
+    verbose_name = 'Gestión de Domicilios'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,105 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import contadores
+from .models import (
+    Pedido, HistorialEstados, ReporteEntregas,
+    PedidoArchivado, HistorialEstadosArchivado, ReporteEntregasArchivado,
+)
+
+ESTADOS_ARCHIVABLES = ('entregado', 'cancelado')
+
+
+def _copiar(origen, modelo_destino, **extra):
+    # Copia los campos que ambos modelos comparten (mismo nombre de columna)
+    valores = {
+        campo.attname: getattr(origen, campo.attname)
+        for campo in modelo_destino._meta.concrete_fields
+        if campo.attname in origen.__dict__
+    }
+    valores.update(extra)
+    return modelo_destino(**valores)
+
+
+def archivar_lote(corte, lote):
+    """
+    Mueve hasta `lote` pedidos entregados o cancelados anteriores a `corte`,
+    con su historial y su reporte, a las tablas *_ARCHIVADO en una sola
+    transacción. Retorna (pedidos, historial, reportes) movidos.
+
+    Los contadores de pedidos se descuentan en la misma transacción: cuentan
+    solo lo que sigue en PEDIDO, igual que las listas que los muestran.
+    """
+    with transaction.atomic():
+        pedidos = list(
+            Pedido.objects.select_for_update()
+            .filter(estado__in=ESTADOS_ARCHIVABLES, fecha_pedido__lt=corte)
+            .order_by('pk')[:lote]
+        )
+        if not pedidos:
+            return 0, 0, 0
+        ids = [pedido.pk for pedido in pedidos]
+        historial = list(HistorialEstados.objects.filter(pedido_id__in=ids))
+        reportes = list(ReporteEntregas.objects.filter(pedido_id__in=ids))
+
+        ahora = timezone.now()
+        PedidoArchivado.objects.bulk_create(
+            [_copiar(pedido, PedidoArchivado, fecha_archivado=ahora) for pedido in pedidos]
+        )
+        HistorialEstadosArchivado.objects.bulk_create(
+            [_copiar(fila, HistorialEstadosArchivado) for fila in historial]
+        )
+        ReporteEntregasArchivado.objects.bulk_create(
+            [_copiar(reporte, ReporteEntregasArchivado) for reporte in reportes]
+        )
+
+        HistorialEstados.objects.filter(pedido_id__in=ids).delete()
+        ReporteEntregas.objects.filter(pedido_id__in=ids).delete()
+        # DELETE directo en vez de Pedido.delete(), que recolectaría las
+        # relaciones y descontaría los contadores pedido por pedido
+        with connection.cursor() as cursor:
+            tabla = connection.ops.quote_name(Pedido._meta.db_table)
+            columna = connection.ops.quote_name(Pedido._meta.pk.column)
+            marcadores = ', '.join(['%s'] * len(ids))
+            cursor.execute(f'DELETE FROM {tabla} WHERE {columna} IN ({marcadores})', ids)
+        contadores.descontar(pedido._valores_contador() for pedido in pedidos)
+    return len(pedidos), len(historial), len(reportes)
+
+
+def buscar_pedido(pedido_id):
+    """
+    Retorna (pedido, historial, archivado) buscando primero en PEDIDO y
+    luego en el archivo; None si no existe en ninguno
+    """
+    pedido = Pedido.objects.select_related('cliente', 'repartidor').filter(pk=pedido_id).first()
+    if pedido is not None:
+        return pedido, HistorialEstados.objects.filter(pedido=pedido).order_by('-fecha_cambio'), False
+    # Las llaves del archivo no tienen restricción en la base: el cliente se
+    # trae aparte (prefetch) para que uno eliminado no esconda el pedido tras
+    # un INNER JOIN; las plantillas lo muestran como eliminado
+    pedido = (
+        PedidoArchivado.objects.select_related('repartidor').prefetch_related('cliente')
+        .filter(pk=pedido_id).first()
+    )
+    if pedido is not None:
+        return pedido, HistorialEstadosArchivado.objects.filter(pedido=pedido).order_by('-fecha_cambio'), True
+    return None
+
+
+def buscar_reporte(reporte_id):
+    """Retorna (reporte, archivado) desde REPORTE_ENTREGAS o su archivo; None si no existe"""
+    reporte = (
+        ReporteEntregas.objects.select_related('pedido', 'pedido__cliente', 'repartidor')
+        .filter(pk=reporte_id).first()
+    )
+    if reporte is not None:
+        return reporte, False
+    # Cliente y repartidor del archivo pueden ya no existir (ver buscar_pedido)
+    reporte = (
+        ReporteEntregasArchivado.objects.select_related('pedido')
+        .prefetch_related('pedido__cliente', 'repartidor')
+        .filter(pk=reporte_id).first()
+    )
+    if reporte is not None:
+        return reporte, True
+    return None
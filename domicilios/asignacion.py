@@ -0,0 +1,160 @@
+import time
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .capacidad import liberar_capacidad, reservar_capacidad
+from .contadores import registrar_transicion
+from .eventos import publicar
+from .models import Pedido, HistorialEstados
+from .utils import ZONAS_VECINAS, normalizar_zona, obtener_repartidores_disponibles
+from .viajes import armar_viajes
+
+TAMANO_LOTE = 500
+
+RANGO_PRIORIDAD = {
+    'urgente': 0,
+    'alta': 1,
+    'normal': 2,
+}
+
+CAMPOS_PEDIDO = ('pedido_id', 'fecha_pedido', 'prioridad', 'zona_entrega', 'direccion_entrega')
+
+# `leidos`: pedidos candidatos; `retrasos`: segundos que esperó cada pedido
+# asignado desde fecha_pedido
+ResultadoAsignacion = namedtuple(
+    'ResultadoAsignacion', ['asignaciones', 'viajes', 'duracion', 'leidos', 'retrasos']
+)
+
+
+def orden_de_atencion(pedido):
+    """
+    Clave de orden: urgente -> alta -> normal y, dentro de cada prioridad,
+    el pedido más antiguo primero
+    """
+    return (
+        RANGO_PRIORIDAD.get(pedido.prioridad, len(RANGO_PRIORIDAD)),
+        pedido.fecha_pedido,
+        pedido.pedido_id,
+    )
+
+
+def zonas_atendibles(repartidores):
+    """Zonas cuyos pedidos puede tomar algún repartidor: el de la zona o uno de una vecina"""
+    con_capacidad = {
+        normalizar_zona(repartidor.zona_asignada) for repartidor in repartidores
+        if repartidor.capacidad_entregas > 0
+    }
+    atendibles = set(con_capacidad)
+    for zona, vecinas in ZONAS_VECINAS.items():
+        if con_capacidad.intersection(vecinas):
+            atendibles.add(zona)
+    return atendibles
+
+
+def pedidos_por_atender(repartidores, limite):
+    """
+    Hasta `limite` pedidos pendientes en orden de atención, leídos por
+    prioridad sobre el índice (estado, prioridad, fecha_pedido).
+
+    Solo se leen zonas que algún repartidor puede atender, para que los
+    pedidos sin capacidad en su zona no tapen la cabeza de la cola. Donde
+    hay SKIP LOCKED los pedidos quedan bloqueados hasta el fin de la
+    transacción y otra instancia lee los siguientes en vez de esperar.
+    """
+    zonas = zonas_atendibles(repartidores)
+    if not zonas:
+        return []
+    pendientes = Pedido.objects.filter(estado='pendiente', repartidor__isnull=True).only(*CAMPOS_PEDIDO)
+    if not zonas.issuperset(ZONAS_VECINAS):
+        filtro = Q()
+        for zona in zonas:
+            filtro |= Q(zona_entrega__iexact=zona)
+        pendientes = pendientes.filter(filtro)
+    if connection.features.has_select_for_update_skip_locked:
+        pendientes = pendientes.select_for_update(skip_locked=True)
+    pedidos = []
+    for prioridad in RANGO_PRIORIDAD:
+        restantes = limite - len(pedidos)
+        if restantes <= 0:
+            break
+        pedidos.extend(pendientes.filter(prioridad=prioridad).order_by('fecha_pedido', 'pk')[:restantes])
+    return pedidos
+
+
+def asignar_pedidos_pendientes(usuario, limite=None):
+    """
+    Asigna en lote los pedidos pendientes a los repartidores disponibles,
+    agrupados en viajes por zona y cercanía (ver viajes.armar_viajes).
+    Con `limite` solo toma los `limite` primeros en orden de atención (ver
+    pedidos_por_atender), para lotes pequeños y frecuentes.
+
+    Los candidatos se cargan una sola vez y el empaquetado se hace en
+    memoria. Por cada viaje la capacidad se reserva con un UPDATE
+    condicional (ver capacidad.py) y sus pedidos se asignan con un único
+    UPDATE que solo toca los que siguen pendientes; el historial va en un
+    bulk_create y todo ocurre en una sola transacción.
+    """
+    inicio = time.perf_counter()
+    with transaction.atomic():
+        repartidores = list(obtener_repartidores_disponibles().filter(
+            capacidad_entregas__gt=0
+        ).only('repartidor_id', 'capacidad_entregas', 'disponible', 'zona_asignada'))
+        if limite is None:
+            pedidos = list(Pedido.objects.filter(
+                estado='pendiente',
+                repartidor__isnull=True
+            ).only(*CAMPOS_PEDIDO))
+        else:
+            pedidos = pedidos_por_atender(repartidores, limite)
+        viajes = armar_viajes(pedidos, repartidores, orden=orden_de_atencion)
+
+        ahora = timezone.now()
+        asignados = []
+        retrasos = []
+        viajes_asignados = 0
+        for repartidor, pedidos_viaje in viajes:
+            # Si otro proceso consumió la capacidad entre la lectura y la
+            # reserva, los pedidos de este viaje quedan pendientes.
+            if not reservar_capacidad(repartidor.repartidor_id, len(pedidos_viaje)):
+                continue
+            ids = [pedido.pedido_id for pedido in pedidos_viaje]
+            actualizados = Pedido.objects.filter(
+                pk__in=ids, estado='pendiente', repartidor__isnull=True
+            ).update(
+                repartidor_id=repartidor.repartidor_id,
+                estado='asignado',
+                fecha_asignacion=ahora,
+                version=F('version') + 1
+            )
+            if actualizados < len(ids):
+                # Otro proceso tomó parte del viaje: se devuelve la capacidad
+                # sobrante y se registra solo lo que sí quedó asignado
+                liberar_capacidad(repartidor.repartidor_id, len(ids) - actualizados)
+                ids = list(Pedido.objects.filter(
+                    pk__in=ids, repartidor_id=repartidor.repartidor_id, fecha_asignacion=ahora
+                ).values_list('pk', flat=True))
+            asignados.extend(ids)
+            viajes_asignados += bool(ids)
+            fechas = {pedido.pedido_id: pedido.fecha_pedido for pedido in pedidos_viaje}
+            retrasos.extend((ahora - fechas[pedido_id]).total_seconds() for pedido_id in ids)
+
+        HistorialEstados.objects.bulk_create([
+            HistorialEstados(
+                pedido_id=pedido_id,
+                estado_anterior='pendiente',
+                estado_nuevo='asignado',
+                fecha_cambio=ahora,
+                usuario=usuario
+            )
+            for pedido_id in asignados
+        ], batch_size=TAMANO_LOTE)
+        registrar_transicion('pendiente', 'asignado', len(asignados))
+        if asignados:
+            # Un solo aviso para el tablero en vez de un evento por pedido
+            publicar({'tipo': 'asignacion_masiva', 'cantidad': len(asignados), 'viajes': viajes_asignados})
+    return ResultadoAsignacion(
+        len(asignados), viajes_asignados, time.perf_counter() - inicio, len(pedidos), retrasos
+    )
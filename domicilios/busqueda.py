@@ -0,0 +1,244 @@
+import re
+import unicodedata
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import Q
+
+# Filas (término, objeto) que se leen por consulta mientras se juntan los
+# resultados pedidos
+FILAS_POR_CONSULTA = 500
+LONGITUD_MINIMA_APROXIMADA = 4
+# Búsqueda aproximada por vecindario de borrados: si una palabra está a
+# distancia k del principio de un término, quitando k letras de los primeros
+# LARGO_CLAVE[k] caracteres de cada uno queda una clave común
+# (VarianteBusqueda). Distancia 1 para palabras de 4 a 6 letras, 2 desde 7.
+LARGO_CLAVE = {1: LONGITUD_MINIMA_APROXIMADA, 2: 7}
+TAMANO_LOTE = 2000
+
+_NO_ALFANUMERICO = re.compile(r'[^0-9a-z]+')
+_NO_DIGITO = re.compile(r'\D+')
+
+
+def plegar(texto):
+    """'  José  Núñez' -> 'jose nunez': sin tildes, minúsculas y espacios simples"""
+    texto = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode().lower()
+    return ' '.join(_NO_ALFANUMERICO.split(texto)).strip()
+
+
+def terminos(nombres, apellidos, cedula, telefono):
+    """Términos indexados de un cliente o repartidor"""
+    encontrados = set(plegar(f'{nombres} {apellidos}').split())
+    for valor in (cedula, telefono):
+        digitos = _NO_DIGITO.sub('', valor or '')
+        if digitos:
+            encontrados.add(digitos)
+        # Cédulas de extranjería con letras ('E-12345') también por su texto
+        plegado = plegar(valor).replace(' ', '')
+        if plegado and plegado != digitos:
+            encontrados.add(plegado)
+    return {termino[:100] for termino in encontrados}
+
+
+def _tipo(modelo):
+    return modelo._meta.model_name
+
+
+def claves(texto, quitar):
+    """Lo que queda de los primeros LARGO_CLAVE[quitar] caracteres al quitarles `quitar` letras"""
+    largo = LARGO_CLAVE[quitar]
+    return {''.join(letras) for letras in combinations(texto[:largo], largo - quitar)}
+
+
+def variantes(termino):
+    """
+    Claves de `termino` para la búsqueda aproximada. Las que tienen dígitos
+    no se guardan: solo se busca aproximado con palabras de letras.
+    """
+    return {clave for quitar in LARGO_CLAVE for clave in claves(termino, quitar) if clave.isalpha()}
+
+
+def indexar(objetos, expandidos=None):
+    """
+    Reescribe los términos de `objetos` (clientes o repartidores del mismo
+    modelo, ya guardados): un DELETE y un bulk_create por lote, más las
+    variantes de los términos que aún no las tengan. Quien indexa muchos
+    lotes seguidos pasa el mismo conjunto `expandidos` para no reescribir
+    las variantes de los términos repetidos.
+    """
+    if expandidos is None:
+        expandidos = set()
+    objetos = list(objetos)
+    if not objetos:
+        return 0
+    from .models import TerminoBusqueda, VarianteBusqueda
+    tipo = _tipo(type(objetos[0]))
+    filas = [
+        TerminoBusqueda(tipo=tipo, objeto_id=objeto.pk, termino=termino)
+        for objeto in objetos
+        for termino in terminos(objeto.nombres, objeto.apellidos, objeto.cedula, objeto.telefono)
+    ]
+    nuevos = {fila.termino for fila in filas} - expandidos
+    with transaction.atomic():
+        TerminoBusqueda.objects.filter(tipo=tipo, objeto_id__in=[objeto.pk for objeto in objetos]).delete()
+        TerminoBusqueda.objects.bulk_create(filas, batch_size=TAMANO_LOTE)
+        VarianteBusqueda.objects.bulk_create(
+            [
+                VarianteBusqueda(tipo=tipo, clave=clave, termino=termino)
+                for termino in nuevos
+                for clave in variantes(termino)
+            ],
+            batch_size=TAMANO_LOTE, ignore_conflicts=True,
+        )
+    expandidos |= nuevos
+    return len(filas)
+
+
+def desindexar(modelo, ids):
+    # Las variantes se conservan: sin términos que las usen no encuentran
+    # nada y desaparecen con el siguiente reindexar
+    from .models import TerminoBusqueda
+    TerminoBusqueda.objects.filter(tipo=_tipo(modelo), objeto_id__in=list(ids)).delete()
+
+
+def reindexar(modelo, lote=TAMANO_LOTE):
+    """
+    Reconstruye los términos y variantes de todo un modelo recorriéndolo por
+    lotes de pk, en una sola transacción: hasta terminar, las búsquedas
+    siguen viendo el índice anterior completo
+    """
+    from .models import TerminoBusqueda, VarianteBusqueda
+    tipo = _tipo(modelo)
+    total = 0
+    ultimo = 0
+    expandidos = set()
+    campos = ('pk', 'nombres', 'apellidos', 'cedula', 'telefono')
+    with transaction.atomic():
+        TerminoBusqueda.objects.filter(tipo=tipo).delete()
+        VarianteBusqueda.objects.filter(tipo=tipo).delete()
+        while True:
+            bloque = list(modelo.objects.filter(pk__gt=ultimo).order_by('pk').only(*campos)[:lote])
+            if not bloque:
+                return total
+            total += indexar(bloque, expandidos)
+            ultimo = bloque[-1].pk
+
+
+def _rango_prefijo(prefijo):
+    # termino >= 'abc' AND termino < 'abd': usa el índice (tipo, termino)
+    # en cualquier motor, a diferencia de LIKE en SQLite
+    return {'termino__gte': prefijo, 'termino__lt': prefijo[:-1] + chr(ord(prefijo[-1]) + 1)}
+
+
+def distancia_edicion(a, b, maximo):
+    """
+    Distancia de Damerau-Levenshtein (transposiciones de letras vecinas
+    cuentan 1) cortada en maximo + 1
+    """
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior2 = None
+    anterior = list(range(len(b) + 1))
+    for i, letra_a in enumerate(a, 1):
+        actual = [i] + [0] * len(b)
+        for j, letra_b in enumerate(b, 1):
+            actual[j] = min(
+                anterior[j] + 1,
+                actual[j - 1] + 1,
+                anterior[j - 1] + (letra_a != letra_b),
+            )
+            if i > 1 and j > 1 and letra_a == b[j - 2] and a[i - 2] == letra_b:
+                actual[j] = min(actual[j], anterior2[j - 2] + 1)
+        if min(actual) > maximo:
+            return maximo + 1
+        anterior2, anterior = anterior, actual
+    return anterior[-1]
+
+
+def _terminos_aproximados(tipo, palabra):
+    """
+    Términos que empiezan por algo a distancia 1 (2 si la palabra es
+    larga) de `palabra`. Solo se comparan los que comparten con ella una
+    clave de VarianteBusqueda, que son todos los que pueden estar a esa
+    distancia.
+    """
+    from .models import VarianteBusqueda
+    maximo = 1 if len(palabra) < LARGO_CLAVE[2] else 2
+    vocabulario = (
+        VarianteBusqueda.objects.filter(tipo=tipo, clave__in=claves(palabra, maximo))
+        .order_by().values_list('termino', flat=True).distinct()
+    )
+    parecidos = []
+    decididos = {}
+    for termino in vocabulario:
+        # Se compara contra el principio del término con largos vecinos,
+        # para que 'rodrigez' encuentre 'rodriguez' y 'rodrig' 'rodriguez';
+        # los términos con el mismo principio se deciden una sola vez
+        principio = termino[:len(palabra) + maximo]
+        if principio not in decididos:
+            decididos[principio] = any(
+                distancia_edicion(palabra, principio[:largo], maximo) <= maximo
+                for largo in range(len(palabra) - maximo, len(principio) + 1)
+                if largo > 0
+            )
+        if decididos[principio]:
+            parecidos.append(termino)
+    return parecidos
+
+
+def buscar_ids(modelo, consulta, limite=20, aproximada=True):
+    """
+    Ids de clientes o repartidores cuyos términos empiezan por cada palabra
+    de `consulta` ('ana per' encuentra a 'Ana María Pérez'). Si el prefijo
+    exacto no alcanza `limite` resultados y `aproximada`, completa con
+    términos a distancia de edición 1-2 de las palabras de 4+ letras
+    (no de los números).
+    """
+    from .models import TerminoBusqueda
+    palabras = sorted(set(plegar(consulta).split()), key=len, reverse=True)
+    if not palabras:
+        return []
+    tipo = _tipo(modelo)
+
+    def coincidencias(filtros_por_palabra):
+        # La palabra más larga, la más selectiva, recorre el índice en orden
+        # de término; las demás se exigen en la misma consulta, así que
+        # ningún resultado se pierde por cortar antes de intersectar
+        primera, *demas = filtros_por_palabra
+        consulta = TerminoBusqueda.objects.filter(primera, tipo=tipo)
+        for filtro in demas:
+            consulta = consulta.filter(
+                objeto_id__in=TerminoBusqueda.objects.filter(filtro, tipo=tipo).values('objeto_id')
+            )
+        consulta = consulta.order_by('termino', 'objeto_id').values_list('termino', 'objeto_id')
+        ids = {}
+        ultima = None
+        while len(ids) < limite:
+            pagina = consulta
+            if ultima is not None:
+                pagina = pagina.filter(Q(termino__gt=ultima[0]) | Q(termino=ultima[0], objeto_id__gt=ultima[1]))
+            filas = list(pagina[:FILAS_POR_CONSULTA])
+            # Un objeto con varios términos que coinciden aparece una vez
+            ids.update(dict.fromkeys(objeto_id for _, objeto_id in filas))
+            if len(filas) < FILAS_POR_CONSULTA:
+                break
+            ultima = filas[-1]
+        return list(ids)[:limite]
+
+    def admite_aproximada(palabra):
+        # Cédulas y teléfonos solo por prefijo exacto
+        return len(palabra) >= LONGITUD_MINIMA_APROXIMADA and palabra.isalpha()
+
+    ids = coincidencias([Q(**_rango_prefijo(palabra)) for palabra in palabras])
+    if len(ids) < limite and aproximada and any(admite_aproximada(palabra) for palabra in palabras):
+        filtros = []
+        for palabra in palabras:
+            filtro = Q(**_rango_prefijo(palabra))
+            if admite_aproximada(palabra):
+                parecidos = _terminos_aproximados(tipo, palabra)
+                if parecidos:
+                    filtro |= Q(termino__in=parecidos)
+            filtros.append(filtro)
+        exactos = set(ids)
+        ids += [objeto_id for objeto_id in coincidencias(filtros) if objeto_id not in exactos]
+    return ids[:limite]
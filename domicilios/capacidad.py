@@ -0,0 +1,145 @@
+import time
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Value, When
+from django.db.models.functions import Least
+
+from .models import Pedido, Repartidor
+
+# Pedidos que ocupan capacidad de su repartidor
+ESTADOS_CON_CARGA = ('asignado', 'en_camino')
+TAMANO_LOTE = 2000
+
+Deriva = namedtuple('Deriva', [
+    'repartidor_id', 'capacidad_maxima', 'carga',
+    'capacidad_anterior', 'capacidad_nueva', 'disponible_anterior', 'disponible_nuevo',
+])
+ResultadoReconciliacion = namedtuple('ResultadoReconciliacion', ['revisados', 'derivas', 'duracion'])
+
+
+def reservar_capacidad(repartidor_id, cantidad=1):
+    """
+    Reserva `cantidad` entregas de un repartidor sin bloquear la fila.
+
+    Es un único UPDATE ... WHERE capacidad_entregas >= cantidad que además
+    marca al repartidor como no disponible cuando se queda sin capacidad.
+    Retorna True si la reserva se hizo y False si otro proceso se llevó la
+    capacidad primero.
+    """
+    # `disponible` va antes que `capacidad_entregas`: MySQL evalúa el SET de
+    # izquierda a derecha y el CASE debe ver la capacidad anterior.
+    actualizados = Repartidor.objects.filter(
+        pk=repartidor_id,
+        activo=True,
+        disponible=True,
+        capacidad_entregas__gte=cantidad
+    ).update(
+        disponible=Case(
+            When(capacidad_entregas__lte=cantidad, then=Value(False)),
+            default=F('disponible')
+        ),
+        capacidad_entregas=F('capacidad_entregas') - cantidad
+    )
+    return actualizados == 1
+
+
+def reservar_hasta(repartidor_id, cantidad):
+    """
+    Reserva hasta `cantidad` entregas de un repartidor: de una vez y, si no
+    alcanza, una por una hasta agotar su capacidad. Retorna cuántas reservó.
+    """
+    if reservar_capacidad(repartidor_id, cantidad):
+        return cantidad
+    reservadas = 0
+    while reservadas < cantidad and reservar_capacidad(repartidor_id):
+        reservadas += 1
+    return reservadas
+
+
+def liberar_capacidad(repartidor_id, cantidad=1):
+    """
+    Devuelve `cantidad` entregas a un repartidor (sin pasar de su
+    capacidad_maxima), en un único UPDATE. Solo lo vuelve a marcar
+    disponible si estaba fuera por haberse quedado sin capacidad (la
+    contraparte de reservar_capacidad); si lo apagaron a mano se respeta.
+    Retorna True si el repartidor existe.
+    """
+    # Igual que en reservar_capacidad, el CASE va primero para ver la capacidad anterior
+    actualizados = Repartidor.objects.filter(pk=repartidor_id).update(
+        disponible=Case(
+            When(capacidad_entregas__lte=0, then=Value(True)),
+            default=F('disponible')
+        ),
+        capacidad_entregas=Least(F('capacidad_entregas') + cantidad, F('capacidad_maxima'))
+    )
+    return actualizados == 1
+
+
+def cargas_abiertas(repartidor_ids=None):
+    """{repartidor_id: pedidos asignados o en camino}, con un solo GROUP BY"""
+    pedidos = Pedido.objects.filter(estado__in=ESTADOS_CON_CARGA, repartidor__isnull=False)
+    if repartidor_ids is not None:
+        pedidos = pedidos.filter(repartidor_id__in=repartidor_ids)
+    return dict(pedidos.order_by().values_list('repartidor_id').annotate(total=Count('pk')))
+
+
+def _deriva(repartidor_id, capacidad_maxima, capacidad, disponible, carga):
+    nueva = max(capacidad_maxima - carga, 0)
+    if nueva == 0:
+        disponible_nuevo = False
+    elif not disponible and capacidad <= 0:
+        # Estaba fuera solo por verse lleno; si lo apagaron a mano se respeta
+        disponible_nuevo = True
+    else:
+        disponible_nuevo = disponible
+    if (nueva, disponible_nuevo) == (capacidad, disponible):
+        return None
+    return Deriva(repartidor_id, capacidad_maxima, carga, capacidad, nueva, disponible, disponible_nuevo)
+
+
+def reconciliar(aplicar=True, lote=TAMANO_LOTE):
+    """
+    Recalcula capacidad_entregas = capacidad_maxima - pedidos abiertos, y
+    `disponible`, de todos los repartidores.
+
+    Un recorrido sin bloqueos (un GROUP BY de la carga y los repartidores
+    por lotes) encuentra los que derivaron; solo esos se bloquean, se les
+    recuenta la carga (una reserva que llegó entretanto queda contada) y se
+    corrigen con un bulk_update por lote. Con aplicar=False solo informa.
+    """
+    inicio = time.perf_counter()
+    campos = ('repartidor_id', 'capacidad_maxima', 'capacidad_entregas', 'disponible')
+    cargas = cargas_abiertas()
+    revisados = 0
+    sospechosos = []
+    for repartidor_id, maxima, capacidad, disponible in (
+        Repartidor.objects.order_by().values_list(*campos).iterator(chunk_size=lote)
+    ):
+        revisados += 1
+        if _deriva(repartidor_id, maxima, capacidad, disponible, cargas.get(repartidor_id, 0)):
+            sospechosos.append(repartidor_id)
+
+    derivas = []
+    for desde in range(0, len(sospechosos), lote):
+        ids = sospechosos[desde:desde + lote]
+        with transaction.atomic():
+            repartidores = Repartidor.objects.filter(pk__in=ids).only(*campos)
+            if aplicar:
+                repartidores = repartidores.select_for_update()
+            repartidores = list(repartidores)
+            cargas_lote = cargas_abiertas(ids)
+            corregidos = []
+            for repartidor in repartidores:
+                deriva = _deriva(
+                    repartidor.repartidor_id, repartidor.capacidad_maxima, repartidor.capacidad_entregas,
+                    repartidor.disponible, cargas_lote.get(repartidor.repartidor_id, 0)
+                )
+                if deriva:
+                    derivas.append(deriva)
+                    repartidor.capacidad_entregas = deriva.capacidad_nueva
+                    repartidor.disponible = deriva.disponible_nuevo
+                    corregidos.append(repartidor)
+            if aplicar:
+                Repartidor.objects.bulk_update(corregidos, ['capacidad_entregas', 'disponible'])
+    return ResultadoReconciliacion(revisados, derivas, time.perf_counter() - inicio)
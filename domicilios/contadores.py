@@ -0,0 +1,97 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .models import ContadorPedidos, Pedido
+
+DIMENSIONES = ('estado', 'zona')
+
+
+def ajustar(deltas):
+    """
+    Suma los `deltas` {(dimension, valor): cantidad} a los contadores con
+    UPDATE ... SET total = total + n, creando la fila si aún no existe
+    """
+    for (dimension, valor), delta in deltas.items():
+        if not delta or valor is None:
+            continue
+        filtro = ContadorPedidos.objects.filter(dimension=dimension, valor=valor)
+        if filtro.update(total=F('total') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                ContadorPedidos.objects.create(dimension=dimension, valor=valor, total=delta)
+        except IntegrityError:
+            # Otro proceso creó la fila entre el UPDATE y el INSERT
+            filtro.update(total=F('total') + delta)
+
+
+def registrar_cambio(anterior, nuevo):
+    """
+    Ajusta los contadores por el alta, cambio o baja de un pedido.
+    `anterior` y `nuevo` son tuplas (estado, zona_entrega), o None para
+    un pedido que se crea o se elimina.
+    """
+    deltas = Counter()
+    for indice, dimension in enumerate(DIMENSIONES):
+        valor_anterior = anterior[indice] if anterior else None
+        valor_nuevo = nuevo[indice] if nuevo else None
+        if anterior and nuevo and (valor_anterior is None or valor_nuevo is None):
+            continue
+        if valor_anterior == valor_nuevo:
+            continue
+        if valor_anterior is not None:
+            deltas[(dimension, valor_anterior)] -= 1
+        if valor_nuevo is not None:
+            deltas[(dimension, valor_nuevo)] += 1
+    ajustar(deltas)
+
+
+def registrar_transicion(estado_anterior, estado_nuevo, cantidad):
+    """
+    Ajuste para cambios de estado hechos con UPDATE directo, que no pasan por save()
+    """
+    ajustar({
+        ('estado', estado_anterior): -cantidad,
+        ('estado', estado_nuevo): cantidad,
+    })
+
+
+def descontar(valores):
+    """
+    Descuenta pedidos que salen de PEDIDO sin pasar por delete() (el
+    archivo). `valores` son tuplas (estado, zona_entrega).
+    """
+    deltas = Counter()
+    for valores_pedido in valores:
+        for dimension, valor in zip(DIMENSIONES, valores_pedido):
+            deltas[(dimension, valor)] -= 1
+    ajustar(deltas)
+
+
+def totales(dimension):
+    """
+    Retorna {valor: total} de una dimensión leyendo solo los contadores
+    """
+    return dict(
+        ContadorPedidos.objects.filter(dimension=dimension, total__gt=0)
+        .order_by('valor')
+        .values_list('valor', 'total')
+    )
+
+
+def reconstruir():
+    """
+    Recalcula todos los contadores desde PEDIDO (los pedidos archivados ya
+    no cuentan)
+    """
+    columnas = {'estado': 'estado', 'zona': 'zona_entrega'}
+    with transaction.atomic():
+        ContadorPedidos.objects.all().delete()
+        filas = []
+        for dimension, columna in columnas.items():
+            for fila in Pedido.objects.order_by().values(columna).annotate(total=Count('pk')):
+                filas.append(ContadorPedidos(dimension=dimension, valor=fila[columna], total=fila['total']))
+        ContadorPedidos.objects.bulk_create(filas)
+    return len(filas)
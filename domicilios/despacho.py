@@ -0,0 +1,101 @@
+import random
+
+from django.db import OperationalError
+from django.utils import timezone
+
+from . import metricas
+from .asignacion import asignar_pedidos_pendientes
+from .contadores import totales
+from .models import Pedido
+
+# Pedidos leídos por lote: se duplica mientras la cola llena el lote y se
+# reduce a la mitad cuando queda holgado
+LOTE_MINIMO = 50
+LOTE_MAXIMO = 2000
+# Segundos entre lotes sin trabajo: se duplica en cada vuelta vacía
+ESPERA_MINIMA = 0.5
+ESPERA_MAXIMA = 30
+# Retrasos guardados entre resúmenes (los percentiles se calculan sobre ellos)
+MAXIMO_MUESTRAS = 100000
+
+
+class Despachador:
+    """
+    Asigna pedidos pendientes en lotes pequeños y frecuentes
+    (asignar_pedidos_pendientes con `limite`), ajustando el tamaño del lote
+    a la cola y la espera entre lotes a la actividad.
+
+    Varias instancias pueden correr a la vez: la reserva de capacidad y la
+    asignación son UPDATE condicionales, así que un pedido nunca queda con
+    dos repartidores; si dos instancias chocan (bloqueo o deadlock) el lote
+    se revierte entero y se reintenta tras una espera corta.
+    """
+    def __init__(self, usuario, lote_minimo=LOTE_MINIMO, lote_maximo=LOTE_MAXIMO,
+                 espera_minima=ESPERA_MINIMA, espera_maxima=ESPERA_MAXIMA):
+        self.usuario = usuario
+        self.lote_minimo = lote_minimo
+        self.lote_maximo = lote_maximo
+        self.espera_minima = espera_minima
+        self.espera_maxima = espera_maxima
+        self.lote = lote_minimo
+        self.espera = espera_minima
+        self.reiniciar_estadisticas()
+
+    def reiniciar_estadisticas(self):
+        self.lotes = 0
+        self.asignados = 0
+        self.conflictos = 0
+        self.tamanos = []
+        self.retrasos = []
+
+    def ciclo(self):
+        """Procesa un lote y retorna los segundos a esperar antes del siguiente"""
+        try:
+            resultado = asignar_pedidos_pendientes(self.usuario, limite=self.lote)
+        except OperationalError:
+            self.conflictos += 1
+            metricas.incrementar('despacho_conflictos_total')
+            # Con azar para que dos instancias no vuelvan a chocar en el mismo instante
+            return self.espera_minima * random.uniform(0.5, 1.5)
+
+        if resultado.leidos:
+            self.lotes += 1
+            self.tamanos.append(resultado.leidos)
+        self.asignados += resultado.asignaciones
+        if len(self.retrasos) < MAXIMO_MUESTRAS:
+            self.retrasos.extend(resultado.retrasos[:MAXIMO_MUESTRAS - len(self.retrasos)])
+        metricas.incrementar('despacho_lotes_total')
+        metricas.incrementar('despacho_asignados_total', resultado.asignaciones)
+
+        lote_lleno = resultado.leidos >= self.lote
+        if lote_lleno:
+            self.lote = min(self.lote * 2, self.lote_maximo)
+        elif resultado.leidos < self.lote // 2:
+            self.lote = max(self.lote // 2, self.lote_minimo)
+
+        if not resultado.asignaciones:
+            # Sin pedidos o sin capacidad: se espera cada vez más
+            espera, self.espera = self.espera, min(self.espera * 2, self.espera_maxima)
+            return espera
+        self.espera = self.espera_minima
+        # Si quedó cola detrás del lote se sigue sin esperar
+        return 0 if lote_lleno else self.espera_minima
+
+
+def retraso_cola():
+    """Segundos que lleva esperando el pedido pendiente más antiguo (0 sin cola)"""
+    mas_antiguo = (
+        Pedido.objects.filter(estado='pendiente').order_by('fecha_pedido')
+        .values_list('fecha_pedido', flat=True).first()
+    )
+    return (timezone.now() - mas_antiguo).total_seconds() if mas_antiguo else 0
+
+
+def exportar_prometheus():
+    """Cola del despacho leída de la base, sin importar dónde corre el despachador"""
+    return (
+        '# TYPE farmacia_despacho_pendientes gauge\n'
+        f'farmacia_despacho_pendientes {totales("estado").get("pendiente", 0)}\n'
+        '# TYPE farmacia_despacho_retraso_segundos gauge\n'
+        f'farmacia_despacho_retraso_segundos {retraso_cola():.1f}\n'
+    )
@@ -0,0 +1,160 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from .utils import normalizar_zona
+
+# Tiempos de partida (minutos) cuando aún no hay entregas registradas
+TIEMPOS_BASE = {
+    'Norte': 30,
+    'Sur': 45,
+    'Este': 35,
+    'Oeste': 40,
+    'Centro': 25,
+}
+TIEMPO_BASE_DEFECTO = 30
+
+MULTIPLICADORES_PRIORIDAD = {
+    'normal': 1.0,
+    'alta': 0.8,
+    'urgente': 0.6,
+}
+
+# Entregas de los últimos VENTANA_DIAS días alimentan la tabla, que se
+# recarga completa cada TIEMPO_RECARGA segundos para olvidar lo viejo y
+# recoger lo aprendido por otros procesos. La recarga corre en un hilo
+# aparte y mientras tanto se sigue estimando con la tabla anterior
+VENTANA_DIAS = 90
+TIEMPO_RECARGA = 3600
+
+# Cuántas entregas "vale" la estimación del nivel superior: una celda con
+# pocas muestras se acerca a la de su zona y prioridad, y esa a la tabla base
+PESO_PREVIO = 10
+
+
+class TablaETA:
+    """
+    Promedios de tiempo_real_minutos por (zona, prioridad, hora del día) y
+    por (zona, prioridad), guardados como [entregas, suma de minutos] para
+    poder sumar entregas nuevas sin recalcular
+    """
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._carga_inicial = threading.Lock()
+        self._celdas = {}
+        self._por_zona = {}
+        self._cargada_en = None
+        self._recargando = False
+
+    def cargar(self):
+        from .models import Pedido, PedidoArchivado
+        desde = timezone.now() - timedelta(days=VENTANA_DIAS)
+        celdas = {}
+        por_zona = {}
+        for modelo in (Pedido, PedidoArchivado):
+            filas = (
+                modelo.objects
+                .filter(estado='entregado', tiempo_real_minutos__isnull=False, fecha_pedido__gte=desde)
+                .annotate(hora=ExtractHour('fecha_pedido'))
+                .order_by()
+                .values('zona_entrega', 'prioridad', 'hora')
+                .annotate(entregas=Count('pk'), minutos=Sum('tiempo_real_minutos'))
+            )
+            for fila in filas:
+                zona = normalizar_zona(fila['zona_entrega'])
+                for tabla, clave in (
+                    (celdas, (zona, fila['prioridad'], fila['hora'])),
+                    (por_zona, (zona, fila['prioridad'])),
+                ):
+                    acumulado = tabla.setdefault(clave, [0, 0])
+                    acumulado[0] += fila['entregas']
+                    acumulado[1] += fila['minutos']
+        with self._candado:
+            self._celdas = celdas
+            self._por_zona = por_zona
+            self._cargada_en = time.monotonic()
+
+    def _vigente(self):
+        return self._cargada_en is not None and time.monotonic() - self._cargada_en < TIEMPO_RECARGA
+
+    def _asegurar_cargada(self):
+        # Solo la primera consulta del proceso espera la carga, porque no hay
+        # tabla que servir; un único hilo la hace y los demás la esperan
+        with self._carga_inicial:
+            if self._cargada_en is None:
+                self.cargar()
+
+    def _recargar_en_segundo_plano(self):
+        with self._candado:
+            if self._recargando:
+                return
+            self._recargando = True
+        threading.Thread(target=self._recargar, name='recarga-eta', daemon=True).start()
+
+    def _recargar(self):
+        try:
+            self.cargar()
+        finally:
+            with self._candado:
+                self._recargando = False
+            connection.close()
+
+    def registrar(self, zona, prioridad, hora, minutos):
+        zona = normalizar_zona(zona)
+        with self._candado:
+            for tabla, clave in (
+                (self._celdas, (zona, prioridad, hora)),
+                (self._por_zona, (zona, prioridad)),
+            ):
+                acumulado = tabla.setdefault(clave, [0, 0])
+                acumulado[0] += 1
+                acumulado[1] += minutos
+
+    def estimar(self, zona, prioridad, hora):
+        if self._cargada_en is None:
+            self._asegurar_cargada()
+        elif not self._vigente():
+            self._recargar_en_segundo_plano()
+        zona = normalizar_zona(zona)
+        estimado = (
+            TIEMPOS_BASE.get(zona, TIEMPO_BASE_DEFECTO) * MULTIPLICADORES_PRIORIDAD.get(prioridad, 1.0)
+        )
+        for tabla, clave in (
+            (self._por_zona, (zona, prioridad)),
+            (self._celdas, (zona, prioridad, hora)),
+        ):
+            entregas, minutos = tabla.get(clave, (0, 0))
+            estimado = (minutos + PESO_PREVIO * estimado) / (entregas + PESO_PREVIO)
+        return max(1, round(estimado))
+
+
+tabla = TablaETA()
+
+
+def _hora(momento=None):
+    momento = momento or timezone.now()
+    if timezone.is_aware(momento):
+        momento = timezone.localtime(momento)
+    return momento.hour
+
+
+def estimar(zona, prioridad='normal', momento=None):
+    """
+    Minutos estimados de entrega para un pedido hecho en `momento` (ahora
+    por defecto). La primera consulta del proceso carga la tabla con una
+    sola consulta agrupada; las demás son búsquedas en diccionarios y, si
+    la tabla venció, disparan su recarga sin esperarla.
+    """
+    return tabla.estimar(zona, prioridad, _hora(momento))
+
+
+def registrar_entrega(pedido):
+    """Suma a la tabla en memoria un pedido recién entregado"""
+    if pedido.tiempo_real_minutos is None or pedido.fecha_pedido is None:
+        return
+    tabla.registrar(pedido.zona_entrega, pedido.prioridad, _hora(pedido.fecha_pedido), pedido.tiempo_real_minutos)
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Max, Q
+from django.utils import timezone
+
+# Eventos perdidos que se reenvían a quien se reconecta con Last-Event-ID;
+# con más, el cliente recibe `recargar`
+EVENTOS_RECIENTES = 500
+# Eventos pendientes por conexión antes de considerarla atrasada
+COLA_POR_SUSCRIPTOR = 100
+INTERVALO_LATIDO = 15
+# Cada proceso web relee EVENTO_TABLERO con esta frecuencia mientras tenga
+# conexiones abiertas
+INTERVALO_SONDEO = 0.5
+LOTE_SONDEO = 1000
+# Un id saltado puede ser una transacción más lenta que confirma después:
+# se sigue buscando durante ESPERA_HUECOS segundos (hasta MAXIMO_HUECOS ids)
+ESPERA_HUECOS = 10
+MAXIMO_HUECOS = 1000
+# La poda la hace `manage.py worker`, que corre también bajo WSGI
+RETENCION_EVENTOS = timedelta(hours=1)
+INTERVALO_PODA = 300
+
+
+def en_vivo():
+    """
+    Si el tablero abre el flujo SSE. Solo bajo ASGI (farmacia/asgi.py pone
+    EVENTOS_EN_VIVO=1): con WSGI cada conexión abierta ocuparía un hilo del
+    servidor, así que lista_pedidos consulta eventos_desde() cada pocos
+    segundos en su lugar.
+    """
+    return getattr(settings, 'EVENTOS_EN_VIVO', os.environ.get('EVENTOS_EN_VIVO') == '1')
+
+
+class Suscripcion:
+    def __init__(self, loop):
+        self.loop = loop
+        self.cola = asyncio.Queue(maxsize=COLA_POR_SUSCRIPTOR)
+        self.atrasada = False
+
+    def entregar(self, evento):
+        # Corre en el loop del suscriptor (ver Broker.difundir)
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.atrasada = True
+
+
+class Broker:
+    """
+    Reparte los eventos de EVENTO_TABLERO a las conexiones SSE del proceso.
+    Un hilo por proceso sondea la tabla mientras haya conexiones y
+    difundir() alimenta la cola de cada una, así que los eventos de otros
+    procesos (worker, despachar, otros servidores web) también llegan.
+    """
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._suscripciones = set()
+        self._hay_suscriptores = threading.Event()
+        self._hilo = None
+        self._ultimo = None
+        self._huecos = {}
+
+    def suscribir(self, desde):
+        """
+        Registra una conexión que ya vio los eventos hasta `desde`; los
+        posteriores que el sondeo no alcance a traer los repone flujo()
+        """
+        suscripcion = Suscripcion(asyncio.get_running_loop())
+        with self._candado:
+            self._suscripciones.add(suscripcion)
+            if self._ultimo is None:
+                self._ultimo = desde
+            self._hay_suscriptores.set()
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._sondear_siempre, name='eventos-tablero', daemon=True)
+                self._hilo.start()
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._candado:
+            self._suscripciones.discard(suscripcion)
+            if not self._suscripciones:
+                # Sin conexiones se deja de sondear; la siguiente parte de su propio id
+                self._hay_suscriptores.clear()
+                self._ultimo = None
+                self._huecos = {}
+
+    def difundir(self, evento):
+        with self._candado:
+            suscripciones = list(self._suscripciones)
+        for suscripcion in suscripciones:
+            try:
+                suscripcion.loop.call_soon_threadsafe(suscripcion.entregar, evento)
+            except RuntimeError:
+                # El loop ya se cerró: la conexión murió sin cancelar
+                self.cancelar(suscripcion)
+
+    def sondear(self):
+        """Lee y difunde los eventos nuevos de EVENTO_TABLERO; retorna cuántos"""
+        from .models import EventoTablero
+        with self._candado:
+            ultimo = self._ultimo
+            huecos = dict(self._huecos)
+        if ultimo is None:
+            return 0
+        ahora = time.monotonic()
+        huecos = {evento_id: visto for evento_id, visto in huecos.items() if ahora - visto < ESPERA_HUECOS}
+        filtro = Q(pk__gt=ultimo)
+        if huecos:
+            filtro |= Q(pk__in=list(huecos))
+        filas = list(
+            EventoTablero.objects.filter(filtro).order_by('pk').values_list('pk', 'datos')[:LOTE_SONDEO]
+        )
+        for evento_id, _ in filas:
+            huecos.pop(evento_id, None)
+            if evento_id > ultimo:
+                if evento_id - ultimo - 1 <= MAXIMO_HUECOS - len(huecos):
+                    huecos.update(dict.fromkeys(range(ultimo + 1, evento_id), ahora))
+                ultimo = evento_id
+        with self._candado:
+            if self._ultimo is None:
+                # Se cerraron todas las conexiones mientras se leía
+                return 0
+            self._ultimo = max(self._ultimo, ultimo)
+            self._huecos = huecos
+        for evento in filas:
+            self.difundir(evento)
+        return len(filas)
+
+    def _sondear_siempre(self):
+        while True:
+            self._hay_suscriptores.wait()
+            close_old_connections()
+            try:
+                self.sondear()
+            except DatabaseError:
+                # Base caída o conexión rota: se reintenta en el siguiente sondeo
+                pass
+            time.sleep(INTERVALO_SONDEO)
+
+    @property
+    def conexiones(self):
+        return len(self._suscripciones)
+
+
+broker = Broker()
+
+
+def delta_pedido(tipo, pedido):
+    """Resumen compacto del pedido para el tablero de despacho"""
+    repartidor = pedido.repartidor if pedido.repartidor_id else None
+    return {
+        'tipo': tipo,
+        'pedido_id': pedido.pedido_id,
+        'estado': pedido.estado,
+        'estado_display': pedido.get_estado_display(),
+        'prioridad': pedido.prioridad,
+        'zona': pedido.zona_entrega,
+        'repartidor_id': pedido.repartidor_id,
+        'repartidor': repartidor.nombres if repartidor else None,
+    }
+
+
+def publicar(datos):
+    """
+    Guarda el evento en EVENTO_TABLERO dentro de la transacción en curso:
+    los tableros solo lo ven si el cambio se confirma
+    """
+    publicar_varios([datos])
+
+
+def publicar_varios(lista_datos):
+    from .models import EventoTablero
+    EventoTablero.objects.bulk_create(
+        [EventoTablero(datos=json.dumps(datos, ensure_ascii=False)) for datos in lista_datos]
+    )
+
+
+def publicar_pedido(tipo, pedido):
+    publicar(delta_pedido(tipo, pedido))
+
+
+def publicar_pedidos(tipo, pedidos):
+    """Un solo INSERT para los eventos de un cambio en lote"""
+    publicar_varios([delta_pedido(tipo, pedido) for pedido in pedidos])
+
+
+def ultimo_evento():
+    from .models import EventoTablero
+    return EventoTablero.objects.aggregate(ultimo=Max('pk'))['ultimo'] or 0
+
+
+def eventos_desde(ultimo_id):
+    """Hasta EVENTOS_RECIENTES + 1 eventos posteriores a `ultimo_id`, en orden"""
+    from .models import EventoTablero
+    return list(
+        EventoTablero.objects.filter(pk__gt=ultimo_id).order_by('pk')
+        .values_list('pk', 'datos')[:EVENTOS_RECIENTES + 1]
+    )
+
+
+def podar():
+    from .models import EventoTablero
+    return EventoTablero.objects.filter(fecha__lt=timezone.now() - RETENCION_EVENTOS).delete()[0]
+
+
+def formatear(evento):
+    identificador, datos = evento
+    return f'id: {identificador}\ndata: {datos}\n\n'
+
+
+async def flujo(ultimo_id=None):
+    """
+    Generador asíncrono con el texto SSE: primero lo perdido desde
+    Last-Event-ID, luego los eventos nuevos y un comentario de latido para
+    que los proxies no cierren la conexión ociosa
+    """
+    if ultimo_id is None:
+        ultimo_id = await sync_to_async(ultimo_evento)()
+    suscripcion = broker.suscribir(ultimo_id)
+    try:
+        yield 'retry: 3000\n\n'
+        # Lo confirmado desde `ultimo_id` que el sondeo ya había dejado atrás;
+        # lo que además llegue por la cola se descarta por id
+        repuestos = await sync_to_async(eventos_desde)(ultimo_id)
+        if len(repuestos) > EVENTOS_RECIENTES:
+            repuestos = []
+            yield 'event: recargar\ndata: {}\n\n'
+        for evento in repuestos:
+            yield formatear(evento)
+        entregados = {evento[0] for evento in repuestos}
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), INTERVALO_LATIDO)
+            except asyncio.TimeoutError:
+                yield ': latido\n\n'
+                continue
+            if evento[0] <= ultimo_id or evento[0] in entregados:
+                # El sondeo del proceso iba más atrás que esta conexión
+                continue
+            if suscripcion.atrasada:
+                # Se perdieron eventos: el cliente debe recargar la lista
+                suscripcion.atrasada = False
+                yield 'event: recargar\ndata: {}\n\n'
+            yield formatear(evento)
+    finally:
+        broker.cancelar(suscripcion)
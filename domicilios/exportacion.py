@@ -0,0 +1,142 @@
+import csv
+import datetime
+import json
+
+from django.db import connection, models
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Pedido, HistorialEstados, ReporteEntregas
+
+TAMANO_BLOQUE = 2000
+FILAS_POR_ESCRITURA = 500
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# conjunto -> (modelo, campo de fecha, campo de zona, campo de estado, columnas)
+CONJUNTOS = {
+    'pedidos': (
+        Pedido, 'fecha_pedido', 'zona_entrega', 'estado',
+        [
+            'pedido_id', 'fecha_pedido', 'estado', 'prioridad', 'zona_entrega',
+            'direccion_entrega', 'tiempo_estimado_minutos', 'tiempo_real_minutos',
+            'fecha_asignacion', 'fecha_entrega_estimada', 'fecha_entrega_real',
+            'cliente_id', 'cliente__cedula', 'cliente__nombres', 'cliente__apellidos',
+            'repartidor_id', 'repartidor__cedula', 'repartidor__nombres', 'repartidor__apellidos',
+        ],
+    ),
+    'historial': (
+        HistorialEstados, 'fecha_cambio', 'pedido__zona_entrega', 'estado_nuevo',
+        [
+            'historial_id', 'pedido_id', 'estado_anterior', 'estado_nuevo',
+            'fecha_cambio', 'usuario',
+        ],
+    ),
+    'reportes': (
+        ReporteEntregas, 'fecha_reporte', 'pedido__zona_entrega', 'estado_entrega',
+        [
+            'reporte_id', 'pedido_id', 'repartidor_id', 'fecha_reporte', 'hora_salida',
+            'hora_llegada', 'hora_entrega', 'tiempo_transito', 'tiempo_total',
+            'estado_entrega', 'motivo_falla', 'calificacion', 'comentarios_cliente',
+        ],
+    ),
+}
+
+
+class FiltroInvalido(ValueError):
+    pass
+
+
+def _limite_fecha(valor, campo, hasta):
+    fecha = parse_date(valor) if isinstance(valor, str) else valor
+    if fecha is None:
+        raise FiltroInvalido(f'Fecha inválida: {valor} (use AAAA-MM-DD)')
+    if not isinstance(campo, models.DateTimeField):
+        return fecha
+    # Rango sobre la columna en vez de __date para que use el índice
+    if hasta:
+        fecha += datetime.timedelta(days=1)
+    return timezone.make_aware(datetime.datetime.combine(fecha, datetime.time.min))
+
+
+def construir_consulta(conjunto, desde=None, hasta=None, zona=None, estado=None):
+    """
+    Retorna (columnas, queryset de tuplas) de un conjunto exportable con los
+    filtros opcionales de rango de fechas (inclusivo), zona y estado
+    """
+    if conjunto not in CONJUNTOS:
+        raise FiltroInvalido(f'Conjunto desconocido: {conjunto}')
+    modelo, campo_fecha, campo_zona, campo_estado, columnas = CONJUNTOS[conjunto]
+    campo = modelo._meta.get_field(campo_fecha)
+    queryset = modelo.objects.all()
+    if desde:
+        queryset = queryset.filter(**{f'{campo_fecha}__gte': _limite_fecha(desde, campo, False)})
+    if hasta:
+        operador = 'lt' if isinstance(campo, models.DateTimeField) else 'lte'
+        queryset = queryset.filter(**{f'{campo_fecha}__{operador}': _limite_fecha(hasta, campo, True)})
+    if zona:
+        queryset = queryset.filter(**{campo_zona: zona})
+    if estado:
+        queryset = queryset.filter(**{campo_estado: estado})
+    return columnas, queryset.order_by(modelo._meta.pk.name).values_list(*columnas)
+
+
+class _Eco:
+    """Objeto tipo archivo que retorna lo escrito en vez de guardarlo"""
+    def write(self, valor):
+        return valor
+
+
+def _valor_json(valor):
+    if isinstance(valor, (datetime.date, datetime.time)):
+        return valor.isoformat()
+    return str(valor)
+
+
+def leer_por_bloques(queryset):
+    """
+    Recorre la consulta en bloques de TAMANO_BLOQUE filas. Usa
+    .iterator(chunk_size=...) donde el motor entrega resultados en streaming;
+    el driver de MySQL carga el resultado completo en memoria, así que ahí
+    se pagina por llave primaria (la primera columna de cada conjunto).
+    """
+    if connection.vendor != 'mysql':
+        yield from queryset.iterator(chunk_size=TAMANO_BLOQUE)
+        return
+    llave = queryset.model._meta.pk.name
+    ultimo = None
+    while True:
+        bloque = queryset if ultimo is None else queryset.filter(**{f'{llave}__gt': ultimo})
+        filas = list(bloque[:TAMANO_BLOQUE])
+        yield from filas
+        if len(filas) < TAMANO_BLOQUE:
+            return
+        ultimo = filas[-1][0]
+
+
+def generar_filas(columnas, queryset, formato):
+    """
+    Genera el contenido en bloques de texto a medida que se leen las filas,
+    así la memoria no crece con el número de filas exportadas
+    """
+    filas = leer_por_bloques(queryset)
+    if formato == 'csv':
+        escritor = csv.writer(_Eco())
+        yield escritor.writerow(columnas)
+        def serializar(fila):
+            return escritor.writerow(fila)
+    else:
+        def serializar(fila):
+            return json.dumps(dict(zip(columnas, fila)), default=_valor_json, ensure_ascii=False) + '\n'
+
+    bloque = []
+    for fila in filas:
+        bloque.append(serializar(fila))
+        if len(bloque) >= FILAS_POR_ESCRITURA:
+            yield ''.join(bloque)
+            bloque = []
+    if bloque:
+        yield ''.join(bloque)
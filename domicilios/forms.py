@@ -27,6 +27,7 @@ class RepartidorForm(forms.ModelForm):
             'telefono': forms.TextInput(attrs={'class': 'form-control'}),
             'vehiculo': forms.TextInput(attrs={'class': 'form-control'}),
             'zona_asignada': forms.TextInput(attrs={'class': 'form-control'}),
+            'capacidad_maxima': forms.NumberInput(attrs={'class': 'form-control'}),
             'capacidad_entregas': forms.NumberInput(attrs={'class': 'form-control'}),
             'disponible': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'activo': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
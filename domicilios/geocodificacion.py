@@ -0,0 +1,341 @@
+import csv
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+# Nomenclátor local: CSV con columnas direccion,latitud,longitud. La
+# dirección puede ser completa ('Carrera 45 # 12-30') o solo el cruce
+# ('Carrera 45 # 12'), que cubre todas las casas de esa cuadra.
+NOMENCLATURA_DIRECCIONES = getattr(
+    settings, 'NOMENCLATURA_DIRECCIONES', Path(__file__).resolve().parent / 'datos' / 'nomenclatura.csv'
+)
+# Entradas en memoria del proceso y filas en DIRECCION_GEOCODIFICADA
+CAPACIDAD_CACHE_MEMORIA = 20000
+CAPACIDAD_CACHE_PERSISTENTE = getattr(settings, 'CAPACIDAD_CACHE_GEOCODIFICACION', 200000)
+# fecha_uso solo se reescribe si tiene más de un día, para no escribir en
+# cada lectura
+REFRESCO_FECHA_USO = timedelta(days=1)
+
+# Lado de cada celda de la rejilla, en grados (~1,1 km de latitud)
+TAMANO_CELDA = 0.01
+# Ubicaciones más viejas que esto no cuentan para "el más cercano"
+UBICACION_VIGENTE = timedelta(minutes=30)
+TIEMPO_RECARGA_INDICE = 30
+RADIO_MAXIMO_KM = 30
+
+KM_POR_GRADO_LATITUD = 110.57
+KM_POR_GRADO_LONGITUD = 111.32
+
+ABREVIATURAS = {
+    'cra': 'carrera', 'kra': 'carrera', 'kr': 'carrera', 'cr': 'carrera', 'carrera': 'carrera',
+    'cl': 'calle', 'cll': 'calle', 'clle': 'calle',
+    'av': 'avenida', 'avda': 'avenida',
+    'ak': 'avenida carrera', 'ac': 'avenida calle',
+    'dg': 'diagonal', 'diag': 'diagonal',
+    'tv': 'transversal', 'tr': 'transversal', 'trans': 'transversal',
+    'no': '#', 'nro': '#', 'numero': '#',
+}
+
+_CRUCE = re.compile(r'^(.*?\d+[a-z]?(?: bis)?(?: [a-z])?) # (\d+[a-z]?)')
+
+
+def normalizar_direccion(direccion):
+    """
+    Forma canónica de una dirección para usarla como llave:
+    'Cra. 45 No 12-30 ' -> 'carrera 45 # 12-30'
+    """
+    texto = unicodedata.normalize('NFKD', direccion or '').encode('ascii', 'ignore').decode().lower()
+    texto = re.sub(r'[.,;]', ' ', texto)
+    texto = re.sub(r'\s*#\s*', ' # ', texto)
+    texto = re.sub(r'\s*-\s*', '-', texto)
+    palabras = [ABREVIATURAS.get(palabra, palabra) for palabra in texto.split()]
+    # 'calle 80 # # 4-10' (de 'Calle 80 No. # 4-10') -> un solo '#'
+    limpias = []
+    for palabra in palabras:
+        if palabra == '#' and limpias and limpias[-1] == '#':
+            continue
+        limpias.append(palabra)
+    return ' '.join(limpias)[:255]
+
+
+def clave_cruce(direccion_normalizada):
+    """'carrera 45 # 12-30' -> 'carrera 45 # 12'; None si no es una dirección de cruce"""
+    coincidencia = _CRUCE.match(direccion_normalizada)
+    return f'{coincidencia.group(1)} # {coincidencia.group(2)}' if coincidencia else None
+
+
+class Nomenclator:
+    """Direcciones conocidas del archivo local, cargadas una vez por proceso"""
+    def __init__(self, ruta):
+        self.ruta = Path(ruta)
+        self._direcciones = None
+        self._candado = threading.Lock()
+
+    def _cargar(self):
+        direcciones = {}
+        if self.ruta.exists():
+            with open(self.ruta, newline='', encoding='utf-8') as archivo:
+                for fila in csv.DictReader(archivo):
+                    try:
+                        coordenadas = (float(fila['latitud']), float(fila['longitud']))
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    direcciones[normalizar_direccion(fila.get('direccion'))] = coordenadas
+        return direcciones
+
+    def buscar(self, direccion_normalizada):
+        if self._direcciones is None:
+            with self._candado:
+                if self._direcciones is None:
+                    self._direcciones = self._cargar()
+        coordenadas = self._direcciones.get(direccion_normalizada)
+        if coordenadas is None:
+            cruce = clave_cruce(direccion_normalizada)
+            if cruce:
+                coordenadas = self._direcciones.get(cruce)
+        return coordenadas
+
+
+nomenclator = Nomenclator(NOMENCLATURA_DIRECCIONES)
+
+_SIN_COORDENADAS = (None, None)
+_memoria = OrderedDict()
+_candado_memoria = threading.Lock()
+
+
+def _recordar(direccion, coordenadas):
+    with _candado_memoria:
+        _memoria[direccion] = coordenadas
+        _memoria.move_to_end(direccion)
+        while len(_memoria) > CAPACIDAD_CACHE_MEMORIA:
+            _memoria.popitem(last=False)
+
+
+def geocodificar(direccion):
+    """
+    Retorna (latitud, longitud) de una dirección, o None si no se conoce.
+
+    Busca en el LRU en memoria, luego en DIRECCION_GEOCODIFICADA y por
+    último en el nomenclátor local; lo resuelto (también los fallos) queda
+    guardado en ambas cachés. No hace llamadas de red.
+    """
+    from .models import DireccionGeocodificada
+    normalizada = normalizar_direccion(direccion)
+    if not normalizada:
+        return None
+    with _candado_memoria:
+        coordenadas = _memoria.get(normalizada)
+        if coordenadas is not None:
+            _memoria.move_to_end(normalizada)
+    if coordenadas is None:
+        ahora = timezone.now()
+        fila = DireccionGeocodificada.objects.filter(direccion=normalizada).first()
+        if fila is not None:
+            coordenadas = (fila.latitud, fila.longitud)
+            if ahora - fila.fecha_uso > REFRESCO_FECHA_USO:
+                DireccionGeocodificada.objects.filter(pk=fila.pk).update(fecha_uso=ahora)
+        else:
+            coordenadas = nomenclator.buscar(normalizada) or _SIN_COORDENADAS
+            try:
+                with transaction.atomic():
+                    DireccionGeocodificada.objects.create(
+                        direccion=normalizada, latitud=coordenadas[0], longitud=coordenadas[1], fecha_uso=ahora
+                    )
+            except IntegrityError:
+                # Otro proceso la guardó entre la lectura y el INSERT
+                pass
+        _recordar(normalizada, coordenadas)
+    return None if coordenadas == _SIN_COORDENADAS else coordenadas
+
+
+def podar_cache(maximo=None):
+    """
+    Deja en DIRECCION_GEOCODIFICADA solo las `maximo` direcciones usadas
+    más recientemente. Retorna cuántas filas se borraron.
+    """
+    from .models import DireccionGeocodificada
+    maximo = CAPACIDAD_CACHE_PERSISTENTE if maximo is None else maximo
+    corte = (
+        DireccionGeocodificada.objects.order_by('-fecha_uso', '-pk')
+        .values_list('fecha_uso', flat=True)[maximo:maximo + 1]
+        .first()
+    )
+    if corte is None:
+        return 0
+    borradas, _ = DireccionGeocodificada.objects.filter(fecha_uso__lte=corte).delete()
+    return borradas
+
+
+def distancia_km(latitud1, longitud1, latitud2, longitud2):
+    """Aproximación equirectangular; sobra precisión para distancias urbanas"""
+    dx = (longitud2 - longitud1) * KM_POR_GRADO_LONGITUD * math.cos(math.radians((latitud1 + latitud2) / 2))
+    dy = (latitud2 - latitud1) * KM_POR_GRADO_LATITUD
+    return math.hypot(dx, dy)
+
+
+def _celdas_del_anillo(fila, columna, anillo):
+    # Perímetro del cuadrado de lado 2*anillo+1 centrado en (fila, columna)
+    if anillo == 0:
+        yield fila, columna
+        return
+    for j in range(columna - anillo, columna + anillo + 1):
+        yield fila - anillo, j
+        yield fila + anillo, j
+    for i in range(fila - anillo + 1, fila + anillo):
+        yield i, columna - anillo
+        yield i, columna + anillo
+
+
+class IndiceRejilla:
+    """
+    Índice espacial en memoria: cada punto va a la celda de TAMANO_CELDA
+    grados que lo contiene, y la búsqueda de vecinos revisa anillos de
+    celdas alrededor del origen hasta que el anillo siguiente ya no puede
+    tener nada más cerca que el k-ésimo encontrado.
+    """
+    def __init__(self, tamano_celda=TAMANO_CELDA):
+        self.tamano_celda = tamano_celda
+        self._celdas = {}
+        self._posiciones = {}
+        self._candado = threading.Lock()
+
+    def _celda(self, latitud, longitud):
+        return (math.floor(latitud / self.tamano_celda), math.floor(longitud / self.tamano_celda))
+
+    def __len__(self):
+        return len(self._posiciones)
+
+    def mover(self, identificador, latitud, longitud):
+        with self._candado:
+            self._quitar(identificador)
+            celda = self._celda(latitud, longitud)
+            self._celdas.setdefault(celda, {})[identificador] = (latitud, longitud)
+            self._posiciones[identificador] = celda
+
+    def quitar(self, identificador):
+        with self._candado:
+            self._quitar(identificador)
+
+    def _quitar(self, identificador):
+        celda = self._posiciones.pop(identificador, None)
+        if celda is not None:
+            puntos = self._celdas[celda]
+            del puntos[identificador]
+            if not puntos:
+                del self._celdas[celda]
+
+    def reemplazar(self, puntos):
+        """Carga completa desde [(identificador, latitud, longitud)]"""
+        celdas = {}
+        posiciones = {}
+        for identificador, latitud, longitud in puntos:
+            celda = self._celda(latitud, longitud)
+            celdas.setdefault(celda, {})[identificador] = (latitud, longitud)
+            posiciones[identificador] = celda
+        with self._candado:
+            self._celdas = celdas
+            self._posiciones = posiciones
+
+    def cercanos(self, latitud, longitud, k=5, radio_km=RADIO_MAXIMO_KM):
+        """Lista de hasta k (distancia_km, identificador), del más cercano al más lejano"""
+        fila, columna = self._celda(latitud, longitud)
+        # Lo mínimo que avanza un anillo de celdas, en km (la longitud se
+        # encoge con el coseno de la latitud)
+        km_longitud = KM_POR_GRADO_LONGITUD * math.cos(math.radians(latitud))
+        paso_km = self.tamano_celda * min(KM_POR_GRADO_LATITUD, km_longitud)
+        anillos_maximos = int(radio_km / paso_km) + 1
+        encontrados = []
+        with self._candado:
+            if not self._celdas:
+                return []
+            for anillo in range(anillos_maximos + 1):
+                for celda in _celdas_del_anillo(fila, columna, anillo):
+                    for identificador, (lat, lon) in self._celdas.get(celda, {}).items():
+                        distancia = math.hypot((lon - longitud) * km_longitud, (lat - latitud) * KM_POR_GRADO_LATITUD)
+                        if distancia <= radio_km:
+                            encontrados.append((distancia, identificador))
+                if len(encontrados) >= k:
+                    # Un punto del anillo siguiente está al menos a anillo*paso_km
+                    kesimo = heapq.nsmallest(k, encontrados)[-1][0]
+                    if kesimo <= anillo * paso_km:
+                        break
+        return heapq.nsmallest(k, encontrados)
+
+
+indice_repartidores = IndiceRejilla()
+_indice_cargado_en = None
+
+
+def recargar_indice():
+    """Carga en la rejilla los repartidores disponibles con ubicación vigente"""
+    global _indice_cargado_en
+    from .models import Repartidor
+    puntos = Repartidor.objects.filter(
+        activo=True,
+        disponible=True,
+        capacidad_entregas__gt=0,
+        latitud__isnull=False,
+        longitud__isnull=False,
+        fecha_ubicacion__gte=timezone.now() - UBICACION_VIGENTE,
+    ).values_list('repartidor_id', 'latitud', 'longitud')
+    indice_repartidores.reemplazar(puntos)
+    _indice_cargado_en = time.monotonic()
+
+
+def actualizar_ubicacion(repartidor_id, latitud, longitud):
+    """
+    Guarda la última ubicación de un repartidor con un UPDATE y la mueve en
+    la rejilla del proceso. Retorna False si el repartidor no existe.
+    """
+    from .models import Repartidor
+    actualizados = Repartidor.objects.filter(pk=repartidor_id).update(
+        latitud=latitud, longitud=longitud, fecha_ubicacion=timezone.now()
+    )
+    if actualizados:
+        indice_repartidores.mover(repartidor_id, latitud, longitud)
+    return actualizados == 1
+
+
+def repartidores_cercanos(pedido, k=5):
+    """
+    Los k repartidores disponibles más cercanos a la dirección del pedido,
+    como lista de (repartidor, distancia_km). Vacía si la dirección no se
+    puede geocodificar o nadie ha reportado ubicación.
+
+    La rejilla solo propone candidatos (se recarga cada
+    TIEMPO_RECARGA_INDICE segundos); la disponibilidad se confirma en la
+    base con una sola consulta.
+    """
+    from .models import Repartidor
+    coordenadas = geocodificar(pedido.direccion_entrega)
+    if coordenadas is None:
+        return []
+    if _indice_cargado_en is None or time.monotonic() - _indice_cargado_en > TIEMPO_RECARGA_INDICE:
+        recargar_indice()
+    # Se piden de más por si alguno dejó de estar disponible desde la recarga
+    candidatos = indice_repartidores.cercanos(*coordenadas, k=k * 2)
+    if not candidatos:
+        return []
+    disponibles = Repartidor.objects.in_bulk(
+        [identificador for _, identificador in candidatos]
+    )
+    vigente_desde = timezone.now() - UBICACION_VIGENTE
+    cercanos = []
+    for distancia, identificador in candidatos:
+        repartidor = disponibles.get(identificador)
+        if (repartidor and repartidor.activo and repartidor.disponible and repartidor.capacidad_entregas > 0
+                and repartidor.fecha_ubicacion and repartidor.fecha_ubicacion >= vigente_desde):
+            cercanos.append((repartidor, round(distancia, 2)))
+            if len(cercanos) == k:
+                break
+    return cercanos
@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from domicilios.archivo import ESTADOS_ARCHIVABLES, archivar_lote
+from domicilios.models import Pedido
+
+
+class Command(BaseCommand):
+    help = (
+        'Mueve los pedidos entregados/cancelados más antiguos que --dias, con su '
+        'historial y reportes, a las tablas de archivo en lotes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=180, help='Antigüedad mínima del pedido')
+        parser.add_argument('--lote', type=int, default=1000, help='Pedidos por transacción')
+        parser.add_argument('--pausa', type=float, default=0, help='Segundos de espera entre lotes')
+        parser.add_argument('--simular', action='store_true', help='Solo cuenta los pedidos a archivar')
+
+    def handle(self, *args, **options):
+        if options['dias'] < 1 or options['lote'] < 1:
+            raise CommandError('--dias y --lote deben ser positivos')
+        corte = timezone.now() - timedelta(days=options['dias'])
+
+        if options['simular']:
+            total = Pedido.objects.filter(estado__in=ESTADOS_ARCHIVABLES, fecha_pedido__lt=corte).count()
+            self.stdout.write(f'{total} pedidos anteriores a {corte:%Y-%m-%d} se archivarían')
+            return
+
+        inicio = time.perf_counter()
+        pedidos = historial = reportes = 0
+        while True:
+            movidos = archivar_lote(corte, options['lote'])
+            if not movidos[0]:
+                break
+            pedidos += movidos[0]
+            historial += movidos[1]
+            reportes += movidos[2]
+            self.stdout.write(f'  {pedidos} pedidos archivados...')
+            if options['pausa']:
+                # Deja respirar a la réplica / al buffer pool entre lotes
+                time.sleep(options['pausa'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {pedidos} pedidos, {historial} registros de historial y {reportes} reportes '
+            f'archivados en {time.perf_counter() - inicio:.1f} s'
+        ))
@@ -0,0 +1,373 @@
+import json
+import random
+import re
+import time
+import tracemalloc
+from datetime import timedelta
+from itertools import islice
+
+import django
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from django.urls.resolvers import RoutePattern
+from django.utils import timezone
+
+from domicilios import busqueda, contadores
+from domicilios.capacidad import ESTADOS_CON_CARGA, reconciliar
+from domicilios.metricas import percentil
+from domicilios.models import (
+    Cliente, Repartidor, Pedido, HistorialEstados, ReporteEntregas, ContadorPedidos, EventoTablero,
+    PedidoArchivado, HistorialEstadosArchivado, ReporteEntregasArchivado, TerminoBusqueda, VarianteBusqueda,
+)
+from domicilios.utils import ZONAS_VECINAS
+
+# Estados por los que pasa un pedido según su estado final (para el historial)
+RECORRIDOS = {
+    'pendiente': ['pendiente'],
+    'asignado': ['pendiente', 'asignado'],
+    'en_camino': ['pendiente', 'asignado', 'en_camino'],
+    'entregado': ['pendiente', 'asignado', 'en_camino', 'entregado'],
+    'cancelado': ['pendiente', 'cancelado'],
+}
+PESOS_ESTADO = {'pendiente': 10, 'asignado': 10, 'en_camino': 5, 'entregado': 65, 'cancelado': 10}
+PESOS_PRIORIDAD = {'normal': 80, 'alta': 15, 'urgente': 5}
+PESOS_ENTREGA = {'exitosa': 85, 'fallida': 10, 'reprogramada': 5}
+VEHICULOS = ['Moto', 'Bicicleta', 'Carro', None]
+
+# Rutas que no se recorren: cerrarían la sesión del cliente de pruebas o,
+# como el flujo SSE, nunca terminan de responder
+RUTAS_EXCLUIDAS = {'logout', 'admin:logout', 'eventos_pedidos'}
+
+# Personal administrativo para las vistas generales y un usuario con perfil
+# de cliente para las vistas cliente_* (index lo redirige a su panel)
+USUARIO_BENCH = 'bench'
+USUARIO_CLIENTE_BENCH = 'bench_cliente'
+
+
+def en_lotes(objetos, tamano):
+    objetos = iter(objetos)
+    while True:
+        lote = list(islice(objetos, tamano))
+        if not lote:
+            return
+        yield lote
+
+
+def recorrer_rutas(patrones, prefijo='', espacio=None):
+    """
+    Genera (nombre, plantilla de URL) de cada ruta sin expresiones regulares.
+    Del admin solo se toman las páginas sin parámetros (índice y listados).
+    """
+    for patron in patrones:
+        if not isinstance(patron.pattern, RoutePattern):
+            continue
+        ruta = prefijo + str(patron.pattern)
+        if isinstance(patron, URLResolver):
+            yield from recorrer_rutas(patron.url_patterns, ruta, patron.namespace or espacio)
+        elif patron.name:
+            if espacio == 'admin' and '<' in ruta:
+                continue
+            yield (f'{espacio}:{patron.name}' if espacio else patron.name), ruta
+
+
+class Command(BaseCommand):
+    help = (
+        'Siembra datos sintéticos y mide cada ruta de farmacia/urls.py con el cliente de '
+        'pruebas: latencia p50/p95, consultas y memoria pico por vista, en JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=5000)
+        parser.add_argument('--repartidores', type=int, default=300)
+        parser.add_argument('--pedidos', type=int, default=50000)
+        parser.add_argument('--proporcion-reportes', type=float, default=0.8,
+                            help='Fracción de pedidos entregados con reporte de entrega')
+        parser.add_argument('--dias', type=int, default=90, help='Antigüedad máxima de los pedidos')
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por bulk_create al sembrar')
+        parser.add_argument('--repeticiones', type=int, default=10)
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--sin-sembrar', action='store_true', help='Reutiliza los datos existentes')
+        parser.add_argument('--rutas', help='Regex: solo mide las rutas cuyo nombre coincida')
+        parser.add_argument('--excluir', default=r'^exportar_',
+                            help='Regex de nombres de ruta a omitir (por defecto las exportaciones)')
+        parser.add_argument('--salida', help='Archivo JSON de salida (por defecto stdout)')
+
+    def handle(self, *args, **options):
+        if options['repeticiones'] < 1:
+            raise CommandError('--repeticiones debe ser al menos 1')
+        call_command('migrate', verbosity=0, interactive=False)
+        if not options['sin_sembrar']:
+            if connection.vendor != 'sqlite':
+                raise CommandError(
+                    'bench borra y siembra las tablas: úselo con --settings=farmacia.settings_bench '
+                    'o pase --sin-sembrar'
+                )
+            inicio = time.perf_counter()
+            self.sembrar(options)
+            self.stderr.write(f'Datos sembrados en {time.perf_counter() - inicio:.1f} s')
+
+        sesion_staff = Client(raise_request_exception=False)
+        sesion_staff.force_login(User.objects.get(username=USUARIO_BENCH))
+        sesion_cliente = Client(raise_request_exception=False)
+        sesion_cliente.force_login(User.objects.get(username=USUARIO_CLIENTE_BENCH))
+        parametros = self.parametros_de_ruta()
+
+        vistas = {}
+        for nombre, plantilla in recorrer_rutas(get_resolver().url_patterns):
+            if nombre in RUTAS_EXCLUIDAS:
+                continue
+            if options['rutas'] and not re.search(options['rutas'], nombre):
+                continue
+            if options['excluir'] and re.search(options['excluir'], nombre):
+                continue
+            url = self.construir_url(plantilla, parametros)
+            if url is None:
+                self.stderr.write(f'Se omite {nombre}: parámetros desconocidos en {plantilla}')
+                continue
+            sesion = sesion_cliente if nombre.startswith('cliente_') else sesion_staff
+            vistas[nombre] = self.medir(sesion, url, options['repeticiones'])
+            self.stderr.write(f"{nombre}: p50 {vistas[nombre]['p50_ms']} ms, {vistas[nombre]['consultas']} consultas")
+
+        resultado = {
+            'configuracion': {
+                'clientes': Cliente.objects.count(),
+                'repartidores': Repartidor.objects.count(),
+                'pedidos': Pedido.objects.count(),
+                'historial': HistorialEstados.objects.count(),
+                'reportes': ReporteEntregas.objects.count(),
+                'repeticiones': options['repeticiones'],
+                'semilla': options['semilla'],
+                'motor': connection.vendor,
+                'django': django.get_version(),
+            },
+            'vistas': vistas,
+        }
+        texto = json.dumps(resultado, indent=2, sort_keys=True, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(texto + '\n')
+        else:
+            self.stdout.write(texto)
+
+    # ---- Siembra ----------------------------------------------------------
+
+    def sembrar(self, options):
+        aleatorio = random.Random(options['semilla'])
+        lote = options['lote']
+        with connection.cursor() as cursor:
+            # Durabilidad irrelevante en una base de benchmark
+            cursor.execute('PRAGMA synchronous = OFF')
+            for modelo in (
+                ReporteEntregasArchivado, HistorialEstadosArchivado, PedidoArchivado,
+                ReporteEntregas, HistorialEstados, Pedido, Repartidor, Cliente, ContadorPedidos,
+                TerminoBusqueda, VarianteBusqueda, EventoTablero,
+            ):
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(modelo._meta.db_table)}')
+
+        usuario, _ = User.objects.get_or_create(username=USUARIO_BENCH)
+        usuario.is_staff = usuario.is_superuser = True
+        usuario.set_unusable_password()
+        usuario.save()
+        usuario_cliente, _ = User.objects.get_or_create(username=USUARIO_CLIENTE_BENCH)
+        usuario_cliente.set_unusable_password()
+        usuario_cliente.save()
+
+        zonas = list(ZONAS_VECINAS)
+        ahora = timezone.now()
+
+        def clientes():
+            for i in range(1, options['clientes'] + 1):
+                yield Cliente(
+                    cliente_id=i,
+                    usuario=usuario_cliente if i == 1 else None,
+                    cedula=f'1{i:09d}',
+                    nombres=f'Cliente{i}',
+                    apellidos=f'Apellido{i % 997}',
+                    telefono=f'300{i:07d}',
+                    direccion=f'Calle {i % 200} # {i % 97}-{i % 53}',
+                    zona=aleatorio.choice(zonas),
+                    fecha_registro=ahora - timedelta(days=aleatorio.randint(0, 3 * options['dias'])),
+                )
+
+        # Capacidad configurada de cada repartidor; los pedidos abiertos solo
+        # se reparten entre los activos con cupo, para que capacidad_entregas
+        # (lo libre, que se recalcula al final) cuadre con la carga
+        maximas = {i: aleatorio.randint(1, 5) for i in range(1, options['repartidores'] + 1)}
+        activos = {i: aleatorio.random() < 0.95 for i in maximas}
+        cupo = {i: maxima for i, maxima in maximas.items() if activos[i]}
+        con_cupo = list(cupo)
+
+        def repartidor_con_cupo():
+            if not con_cupo:
+                return None
+            posicion = aleatorio.randrange(len(con_cupo))
+            repartidor_id = con_cupo[posicion]
+            cupo[repartidor_id] -= 1
+            if not cupo[repartidor_id]:
+                con_cupo[posicion] = con_cupo[-1]
+                con_cupo.pop()
+            return repartidor_id
+
+        def repartidores():
+            for i in range(1, options['repartidores'] + 1):
+                yield Repartidor(
+                    repartidor_id=i,
+                    cedula=f'2{i:09d}',
+                    nombres=f'Repartidor{i}',
+                    apellidos=f'Apellido{i % 997}',
+                    telefono=f'310{i:07d}',
+                    vehiculo=aleatorio.choice(VEHICULOS),
+                    zona_asignada=aleatorio.choice(zonas),
+                    capacidad_maxima=maximas[i],
+                    capacidad_entregas=maximas[i],
+                    disponible=aleatorio.random() < 0.7,
+                    activo=activos[i],
+                )
+
+        self.insertar(Cliente, clientes(), lote)
+        self.insertar(Repartidor, repartidores(), lote)
+
+        estados, pesos_estado = zip(*PESOS_ESTADO.items())
+        prioridades, pesos_prioridad = zip(*PESOS_PRIORIDAD.items())
+        entregas, pesos_entrega = zip(*PESOS_ENTREGA.items())
+        rango = options['dias'] * 86400
+        for inicio in range(0, options['pedidos'], lote):
+            pedidos, historial, reportes = [], [], []
+            for pedido_id in range(inicio + 1, min(inicio + lote, options['pedidos']) + 1):
+                estado = aleatorio.choices(estados, pesos_estado)[0]
+                repartidor_id = None
+                if estado in ESTADOS_CON_CARGA:
+                    repartidor_id = repartidor_con_cupo()
+                    if repartidor_id is None:
+                        # Sin cupo en ningún repartidor el pedido sigue en cola
+                        estado = 'pendiente'
+                elif 'asignado' in RECORRIDOS[estado]:
+                    repartidor_id = aleatorio.randint(1, options['repartidores'])
+                fecha = ahora - timedelta(seconds=aleatorio.randint(0, rango))
+                estimado = aleatorio.randint(15, 90)
+                pedido = Pedido(
+                    pedido_id=pedido_id,
+                    cliente_id=aleatorio.randint(1, options['clientes']),
+                    fecha_pedido=fecha,
+                    estado=estado,
+                    direccion_entrega=f'Carrera {pedido_id % 150} # {pedido_id % 89}-{pedido_id % 41}',
+                    zona_entrega=aleatorio.choice(zonas),
+                    prioridad=aleatorio.choices(prioridades, pesos_prioridad)[0],
+                    tiempo_estimado_minutos=estimado,
+                )
+                recorrido = RECORRIDOS[estado]
+                if repartidor_id:
+                    pedido.repartidor_id = repartidor_id
+                    pedido.fecha_asignacion = fecha + timedelta(minutes=aleatorio.randint(1, 20))
+                    pedido.fecha_entrega_estimada = fecha + timedelta(minutes=estimado)
+                if estado == 'entregado':
+                    pedido.tiempo_real_minutos = max(5, int(aleatorio.gauss(estimado, 10)))
+                    pedido.fecha_entrega_real = fecha + timedelta(minutes=pedido.tiempo_real_minutos)
+                    if aleatorio.random() < options['proporcion_reportes']:
+                        estado_entrega = aleatorio.choices(entregas, pesos_entrega)[0]
+                        reportes.append(ReporteEntregas(
+                            pedido_id=pedido_id,
+                            repartidor_id=pedido.repartidor_id,
+                            fecha_reporte=pedido.fecha_entrega_real.date(),
+                            tiempo_total=pedido.tiempo_real_minutos,
+                            estado_entrega=estado_entrega,
+                            calificacion=aleatorio.randint(1, 5) if estado_entrega == 'exitosa' else None,
+                        ))
+                anterior = None
+                for paso, estado_paso in enumerate(recorrido):
+                    historial.append(HistorialEstados(
+                        pedido_id=pedido_id,
+                        estado_anterior=anterior,
+                        estado_nuevo=estado_paso,
+                        fecha_cambio=fecha + timedelta(minutes=10 * paso),
+                        usuario=USUARIO_BENCH,
+                    ))
+                    anterior = estado_paso
+                pedidos.append(pedido)
+            with transaction.atomic():
+                Pedido.objects.bulk_create(pedidos)
+                HistorialEstados.objects.bulk_create(historial)
+                ReporteEntregas.objects.bulk_create(reportes)
+
+        # bulk_create no pasa por Pedido.save(): recalcular contadores al final
+        contadores.reconstruir()
+        # Capacidad libre = capacidad_maxima - pedidos abiertos; sin cupo, no disponible
+        reconciliar(aplicar=True)
+
+    def insertar(self, modelo, objetos, lote):
+        expandidos = set()
+        for bloque in en_lotes(objetos, lote):
+            with transaction.atomic():
+                modelo.objects.bulk_create(bloque)
+                busqueda.indexar(bloque, expandidos)
+
+    # ---- Medición ---------------------------------------------------------
+
+    def parametros_de_ruta(self):
+        pedido = (
+            Pedido.objects.filter(estado='entregado', reporteentregas__isnull=False).order_by('pk').first()
+            or Pedido.objects.order_by('pk').first()
+        )
+        reporte = ReporteEntregas.objects.order_by('pk').first()
+        cliente = Cliente.objects.order_by('pk').first()
+        repartidor = Repartidor.objects.order_by('pk').first()
+        return {
+            'pedido_id': pedido and pedido.pk,
+            'reporte_id': reporte and reporte.pk,
+            'cliente_id': cliente and cliente.pk,
+            'repartidor_id': repartidor and repartidor.pk,
+        }
+
+    def construir_url(self, plantilla, parametros):
+        faltantes = []
+
+        def reemplazar(coincidencia):
+            valor = parametros.get(coincidencia.group(1))
+            if valor is None:
+                faltantes.append(coincidencia.group(1))
+                return ''
+            return str(valor)
+
+        url = '/' + re.sub(r'<(?:\w+:)?(\w+)>', reemplazar, plantilla)
+        return None if faltantes else url
+
+    def pedir(self, cliente, url):
+        respuesta = cliente.get(url)
+        if respuesta.streaming:
+            tamano = sum(len(bloque) for bloque in respuesta.streaming_content)
+        else:
+            tamano = len(respuesta.content)
+        return respuesta.status_code, tamano
+
+    def medir(self, cliente, url, repeticiones):
+        # Primera petición de calentamiento: llena cachés de conteos y plantillas
+        self.pedir(cliente, url)
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            self.pedir(cliente, url)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+
+        # Consultas y memoria en una pasada aparte para no inflar la latencia
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as consultas:
+                estado, tamano = self.pedir(cliente, url)
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            'url': url,
+            'estado': estado,
+            'bytes': tamano,
+            'p50_ms': round(percentil(tiempos, 50), 2),
+            'p95_ms': round(percentil(tiempos, 95), 2),
+            'consultas': len(consultas),
+            'memoria_pico_kb': round(pico / 1024, 1),
+        }
@@ -0,0 +1,63 @@
+import random
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from domicilios.asignacion import orden_de_atencion
+from domicilios.models import Pedido
+from domicilios.utils import ZONAS_VECINAS
+from domicilios.viajes import armar_viajes
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el armado de viajes de la asignación automática (viajes.armar_viajes: '
+        'zona, cercanía y best-fit) con datos sintéticos en memoria'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pedidos', type=int, default=50000)
+        parser.add_argument('--repartidores', type=int, default=2000)
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        aleatorio = random.Random(options['semilla'])
+        zonas = list(ZONAS_VECINAS)
+        prioridades = [valor for valor, _ in Pedido.PRIORIDAD_CHOICES]
+        ahora = timezone.now()
+        tiempos = []
+        for _ in range(options['repeticiones']):
+            pedidos = [
+                SimpleNamespace(
+                    pedido_id=i,
+                    zona_entrega=aleatorio.choice(zonas),
+                    prioridad=aleatorio.choice(prioridades),
+                    fecha_pedido=ahora - timedelta(seconds=aleatorio.randint(0, 86400)),
+                    direccion_entrega=f'Carrera {aleatorio.randint(1, 150)} # {aleatorio.randint(1, 90)}-{aleatorio.randint(1, 40)}',
+                )
+                for i in range(options['pedidos'])
+            ]
+            repartidores = [
+                SimpleNamespace(
+                    repartidor_id=i,
+                    zona_asignada=aleatorio.choice(zonas),
+                    capacidad_entregas=aleatorio.randint(1, 5),
+                    disponible=True,
+                )
+                for i in range(options['repartidores'])
+            ]
+            inicio = time.perf_counter()
+            viajes = armar_viajes(pedidos, repartidores, orden=orden_de_atencion)
+            tiempos.append(time.perf_counter() - inicio)
+
+        mejor = min(tiempos)
+        self.stdout.write(
+            f"{options['pedidos']} pedidos, {options['repartidores']} repartidores: "
+            f"{sum(len(pedidos_viaje) for _, pedidos_viaje in viajes)} asignaciones en {len(viajes)} viajes "
+            f"en {mejor * 1000:.1f} ms "
+            f"({mejor / options['pedidos'] * 1e6:.2f} µs por pedido, mejor de {len(tiempos)})"
+        )
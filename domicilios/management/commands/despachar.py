@@ -0,0 +1,79 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from domicilios import despacho
+from domicilios.metricas import percentil
+
+
+class Command(BaseCommand):
+    help = (
+        'Asigna continuamente los pedidos pendientes en lotes que crecen con la '
+        'cola y se espacian sin trabajo; se pueden correr varias instancias'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', default='despacho_automatico', help='Usuario del historial de estados')
+        parser.add_argument('--lote-minimo', type=int, default=despacho.LOTE_MINIMO)
+        parser.add_argument('--lote-maximo', type=int, default=despacho.LOTE_MAXIMO)
+        parser.add_argument('--espera-minima', type=float, default=despacho.ESPERA_MINIMA,
+                            help='Segundos entre lotes con trabajo')
+        parser.add_argument('--espera-maxima', type=float, default=despacho.ESPERA_MAXIMA,
+                            help='Tope de la espera entre lotes sin trabajo')
+        parser.add_argument('--intervalo-reporte', type=float, default=60,
+                            help='Segundos entre resúmenes de lotes y retrasos')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Termina en cuanto un lote no asigna nada')
+
+    def handle(self, *args, **options):
+        despachador = despacho.Despachador(
+            options['usuario'],
+            lote_minimo=options['lote_minimo'],
+            lote_maximo=options['lote_maximo'],
+            espera_minima=options['espera_minima'],
+            espera_maxima=options['espera_maxima'],
+        )
+        self.detener = False
+        # Termina el lote en curso antes de salir
+        signal.signal(signal.SIGTERM, self.pedir_parada)
+        signal.signal(signal.SIGINT, self.pedir_parada)
+
+        self.stdout.write('Despachador esperando pedidos...')
+        desde = time.monotonic()
+        while not self.detener:
+            close_old_connections()
+            antes = (despachador.asignados, despachador.conflictos)
+            espera = despachador.ciclo()
+            if options['una_vez'] and (despachador.asignados, despachador.conflictos) == antes:
+                break
+            if time.monotonic() - desde >= options['intervalo_reporte']:
+                self.reportar(despachador, time.monotonic() - desde)
+                desde = time.monotonic()
+            # Espera en pasos cortos para atender SIGTERM sin demora
+            fin = time.monotonic() + espera
+            while not self.detener and time.monotonic() < fin:
+                time.sleep(min(0.5, fin - time.monotonic()))
+        self.reportar(despachador, time.monotonic() - desde)
+
+    def pedir_parada(self, *args):
+        self.detener = True
+
+    def reportar(self, despachador, segundos):
+        tamanos = sorted(despachador.tamanos)
+        retrasos = sorted(despachador.retrasos)
+        linea = (
+            f'  {despachador.asignados} asignados ({despachador.asignados / segundos:.1f}/s), '
+            f'{despachador.lotes} lotes'
+        )
+        if tamanos:
+            linea += f' (medio {sum(tamanos) / len(tamanos):.0f}, máximo {tamanos[-1]}, actual {despachador.lote})'
+        if retrasos:
+            linea += (
+                f', espera hasta asignar p50 {percentil(retrasos, 50):.0f} s '
+                f'p95 {percentil(retrasos, 95):.0f} s'
+            )
+        linea += f', cola {despacho.retraso_cola():.0f} s, conflictos {despachador.conflictos}'
+        self.stdout.write(linea)
+        despachador.reiniciar_estadisticas()
@@ -0,0 +1,50 @@
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from domicilios.exportacion import CONJUNTOS, FORMATOS, FiltroInvalido, construir_consulta, generar_filas
+
+
+class Command(BaseCommand):
+    help = 'Exporta pedidos, historial o reportes a CSV/NDJSON en streaming (millones de filas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('conjunto', choices=sorted(CONJUNTOS))
+        parser.add_argument('--formato', choices=sorted(FORMATOS), default='csv')
+        parser.add_argument('--desde', help='Fecha inicial AAAA-MM-DD (inclusive)')
+        parser.add_argument('--hasta', help='Fecha final AAAA-MM-DD (inclusive)')
+        parser.add_argument('--zona')
+        parser.add_argument('--estado')
+        parser.add_argument('--salida', help='Archivo de salida (.gz para comprimir); por defecto stdout')
+
+    def handle(self, *args, **options):
+        try:
+            columnas, filas = construir_consulta(
+                options['conjunto'],
+                desde=options['desde'],
+                hasta=options['hasta'],
+                zona=options['zona'],
+                estado=options['estado'],
+            )
+        except FiltroInvalido as e:
+            raise CommandError(str(e))
+
+        salida = options['salida']
+        if not salida:
+            archivo = sys.stdout
+        elif salida.endswith('.gz'):
+            archivo = gzip.open(salida, 'wt', encoding='utf-8', newline='')
+        else:
+            archivo = open(salida, 'w', encoding='utf-8', newline='')
+
+        inicio = time.perf_counter()
+        try:
+            for bloque in generar_filas(columnas, filas, options['formato']):
+                archivo.write(bloque)
+        finally:
+            if archivo is not sys.stdout:
+                archivo.close()
+        if salida:
+            self.stderr.write(f'✅ Exportado {options["conjunto"]} a {salida} en {time.perf_counter() - inicio:.1f} s')
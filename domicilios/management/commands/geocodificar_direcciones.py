@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from domicilios.geocodificacion import geocodificar, podar_cache
+from domicilios.models import Pedido
+
+
+class Command(BaseCommand):
+    help = (
+        'Geocodifica con el nomenclátor local las direcciones de los pedidos '
+        'pendientes/asignados (precalienta la caché) y poda la caché persistente'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--podar', type=int, default=None, metavar='MAXIMO',
+                            help='Deja solo las MAXIMO direcciones usadas más recientemente')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        direcciones = (
+            Pedido.objects.filter(estado__in=('pendiente', 'asignado'))
+            .order_by().values_list('direccion_entrega', flat=True).distinct()
+        )
+        resueltas = total = 0
+        for direccion in direcciones.iterator(chunk_size=2000):
+            total += 1
+            resueltas += geocodificar(direccion) is not None
+        self.stdout.write(
+            f'{resueltas} de {total} direcciones con coordenadas '
+            f'({time.perf_counter() - inicio:.1f} s)'
+        )
+        if options['podar'] is not None:
+            borradas = podar_cache(options['podar'])
+            self.stdout.write(self.style.SUCCESS(f'✅ {borradas} direcciones podadas de la caché'))
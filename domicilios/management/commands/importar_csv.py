@@ -0,0 +1,248 @@
+import csv
+import time
+from collections import Counter
+
+from django import forms
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from domicilios import busqueda, contadores
+from domicilios.capacidad import ESTADOS_CON_CARGA, reservar_hasta
+from domicilios.forms import ClienteForm, RepartidorForm, PedidoForm
+from domicilios.models import Cliente, Repartidor, Pedido, HistorialEstados
+from domicilios.transiciones import ESTADOS_CON_REPARTIDOR
+
+# modelo -> (clase del modelo, formulario cuyas reglas de campo se aplican)
+MODELOS = {
+    'clientes': (Cliente, ClienteForm),
+    'repartidores': (Repartidor, RepartidorForm),
+    'pedidos': (Pedido, PedidoForm),
+}
+
+# capacidad_entregas es la capacidad libre: un repartidor nuevo no tiene
+# pedidos, así que se toma de capacidad_maxima (ver construir)
+CAMPOS_EXCLUIDOS = {'usuario', 'capacidad_entregas'}
+MAXIMO_RECHAZOS_MOSTRADOS = 20
+USUARIO_HISTORIAL = 'importar_csv'
+# forms.BooleanField toma cualquier texto no vacío como verdadero ('no' incluido)
+VERDADEROS = {'1', 'true', 't', 'si', 'sí', 's', 'yes', 'y', 'x', 'on'}
+FALSOS = {'0', 'false', 'f', 'no', 'n', 'off'}
+
+
+class Command(BaseCommand):
+    help = 'Importa clientes, repartidores o pedidos desde un CSV con bulk_create por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('modelo', choices=sorted(MODELOS))
+        parser.add_argument('archivo')
+        parser.add_argument('--lote', type=int, default=1000, help='Filas por bulk_create')
+        parser.add_argument('--delimitador', default=',')
+        parser.add_argument('--rechazos', help='CSV donde escribir las filas rechazadas con su error')
+        parser.add_argument('--simular', action='store_true', help='Solo valida, no inserta')
+
+    def handle(self, *args, **options):
+        self.modelo, formulario = MODELOS[options['modelo']]
+        self.campos = {
+            nombre: campo for nombre, campo in formulario.base_fields.items()
+            if nombre not in CAMPOS_EXCLUIDOS
+        }
+        self.llaves = {}
+        self.cedulas = None
+        if self.modelo is not Pedido:
+            # Una sola consulta para detectar cédulas repetidas en memoria
+            self.cedulas = set(self.modelo.objects.values_list('cedula', flat=True).iterator())
+
+        inicio = time.perf_counter()
+        procesadas = insertadas = 0
+        self.rechazadas = rechazadas = []
+        pendientes = []
+        with open(options['archivo'], newline='', encoding='utf-8-sig') as archivo:
+            lector = csv.DictReader(archivo, delimiter=options['delimitador'])
+            self.validar_encabezado(lector.fieldnames or [])
+            for fila in lector:
+                procesadas += 1
+                try:
+                    pendientes.append((lector.line_num, fila, self.construir(fila)))
+                except forms.ValidationError as e:
+                    rechazadas.append((lector.line_num, fila, '; '.join(e.messages)))
+                if len(pendientes) >= options['lote']:
+                    insertadas += self.insertar(pendientes, options)
+                    pendientes = []
+        insertadas += self.insertar(pendientes, options)
+        duracion = time.perf_counter() - inicio
+
+        self.reportar_rechazos(rechazadas, options['rechazos'])
+        velocidad = procesadas / duracion if duracion else procesadas
+        accion = 'validadas' if options['simular'] else 'insertadas'
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {procesadas} filas procesadas, {insertadas} {accion}, {len(rechazadas)} rechazadas '
+            f'en {duracion:.1f} s ({velocidad:.0f} filas/s)'
+        ))
+
+    def validar_encabezado(self, columnas):
+        columnas = set(columnas)
+        faltantes = []
+        for nombre, campo in self.campos.items():
+            if nombre in columnas or not campo.required:
+                continue
+            if isinstance(campo, forms.ModelChoiceField) and f'{nombre}_cedula' in columnas:
+                continue
+            if self.modelo._meta.get_field(nombre).has_default():
+                continue
+            faltantes.append(nombre)
+        if faltantes:
+            raise CommandError(f'Faltan columnas obligatorias: {", ".join(faltantes)}')
+
+    def resolver_llave(self, nombre, campo, fila):
+        """
+        Resuelve una llave foránea por id o por <campo>_cedula contra mapas
+        precargados, en vez de una consulta por fila como haría el formulario
+        """
+        relacionado = campo.queryset.model
+        if nombre not in self.llaves:
+            self.llaves[nombre] = (
+                set(relacionado.objects.values_list('pk', flat=True).iterator()),
+                dict(relacionado.objects.values_list('cedula', 'pk').iterator()),
+            )
+        ids, por_cedula = self.llaves[nombre]
+        cedula = (fila.get(f'{nombre}_cedula') or '').strip()
+        valor = (fila.get(nombre) or '').strip()
+        if cedula:
+            if cedula not in por_cedula:
+                raise forms.ValidationError(f'no existe la cédula {cedula}')
+            return por_cedula[cedula]
+        if not valor:
+            if campo.required:
+                raise forms.ValidationError('este campo es obligatorio')
+            return None
+        try:
+            valor = int(valor)
+        except ValueError:
+            raise forms.ValidationError(f'id inválido {valor}')
+        if valor not in ids:
+            raise forms.ValidationError(f'no existe el id {valor}')
+        return valor
+
+    def construir(self, fila):
+        datos = {}
+        errores = []
+        for nombre, campo in self.campos.items():
+            try:
+                if isinstance(campo, forms.ModelChoiceField):
+                    if nombre in fila or f'{nombre}_cedula' in fila:
+                        datos[f'{nombre}_id'] = self.resolver_llave(nombre, campo, fila)
+                elif nombre in fila:
+                    crudo = (fila[nombre] or '').strip()
+                    if not crudo and self.modelo._meta.get_field(nombre).has_default():
+                        continue
+                    if isinstance(campo, forms.BooleanField):
+                        datos[nombre] = self.booleano(crudo)
+                    else:
+                        datos[nombre] = campo.clean(crudo)
+            except forms.ValidationError as e:
+                errores.extend(f'{nombre}: {mensaje}' for mensaje in e.messages)
+        if errores:
+            raise forms.ValidationError(errores)
+
+        if self.modelo is Repartidor:
+            datos['capacidad_entregas'] = datos.get(
+                'capacidad_maxima', Repartidor._meta.get_field('capacidad_maxima').default
+            )
+        elif datos.get('estado') in ESTADOS_CON_REPARTIDOR and not datos.get('repartidor_id'):
+            raise forms.ValidationError(f'repartidor: obligatorio para un pedido {datos["estado"]}')
+
+        if self.cedulas is not None:
+            if datos['cedula'] in self.cedulas:
+                raise forms.ValidationError(f'cedula: ya existe {datos["cedula"]}')
+            self.cedulas.add(datos['cedula'])
+        return self.modelo(**datos)
+
+    def booleano(self, crudo):
+        valor = crudo.lower()
+        if valor in VERDADEROS:
+            return True
+        if valor in FALSOS:
+            return False
+        raise forms.ValidationError(f'valor inválido {crudo} (use sí/no, true/false o 1/0)')
+
+    def reservar(self, pendientes):
+        """
+        Reserva la capacidad de los repartidores de los pedidos que llegan
+        asignados o en camino, como al asignarlos en la aplicación; los que
+        ya no caben se rechazan. Retorna los objetos a insertar.
+        """
+        por_repartidor = {}
+        for pendiente in pendientes:
+            pedido = pendiente[2]
+            if pedido.repartidor_id and pedido.estado in ESTADOS_CON_CARGA:
+                por_repartidor.setdefault(pedido.repartidor_id, []).append(pendiente)
+        sin_capacidad = set()
+        for repartidor_id, filas in por_repartidor.items():
+            reservadas = reservar_hasta(repartidor_id, len(filas))
+            for linea, fila, pedido in filas[reservadas:]:
+                sin_capacidad.add(id(pedido))
+                self.rechazadas.append((linea, fila, f'repartidor: {repartidor_id} no tiene capacidad disponible'))
+        return [pedido for _, _, pedido in pendientes if id(pedido) not in sin_capacidad]
+
+    def insertar(self, pendientes, options):
+        if not pendientes or options['simular']:
+            return len(pendientes)
+        with transaction.atomic():
+            if self.modelo is Pedido:
+                objetos = self.reservar(pendientes)
+                sin_ids = not connection.features.can_return_rows_from_bulk_insert
+                if sin_ids:
+                    ultimo = Pedido.objects.aggregate(ultimo=Max('pk'))['ultimo'] or 0
+                self.modelo.objects.bulk_create(objetos, batch_size=options['lote'])
+                if sin_ids:
+                    # MySQL no devuelve los ids insertados. En REPEATABLE READ la
+                    # transacción no ve pedidos de otras sesiones posteriores a su
+                    # primera lectura, así que los ids mayores que `ultimo` son
+                    # los recién insertados, en el mismo orden
+                    ids = list(Pedido.objects.filter(pk__gt=ultimo).order_by('pk').values_list('pk', flat=True))
+                    if len(ids) != len(objetos):
+                        raise CommandError('No se pudieron leer los ids de los pedidos insertados')
+                    for pedido, pk in zip(objetos, ids):
+                        pedido.pk = pk
+                # bulk_create no pasa por Pedido.save(): ajustar contadores aquí
+                deltas = Counter()
+                for pedido in objetos:
+                    deltas[('estado', pedido.estado)] += 1
+                    deltas[('zona', pedido.zona_entrega)] += 1
+                contadores.ajustar(deltas)
+                # Estado inicial en el historial, como al crear el pedido en la aplicación
+                HistorialEstados.objects.bulk_create(
+                    [
+                        HistorialEstados(pedido_id=pedido.pk, estado_nuevo=pedido.estado, usuario=USUARIO_HISTORIAL)
+                        for pedido in objetos
+                    ],
+                    batch_size=options['lote']
+                )
+            else:
+                objetos = [objeto for _, _, objeto in pendientes]
+                self.modelo.objects.bulk_create(objetos, batch_size=options['lote'])
+                # bulk_create tampoco dispara post_save: indexar los términos
+                # de búsqueda aquí. MySQL no devuelve los ids insertados, se
+                # leen por cédula.
+                if any(objeto.pk is None for objeto in objetos):
+                    ids = dict(
+                        self.modelo.objects.filter(cedula__in=[objeto.cedula for objeto in objetos])
+                        .values_list('cedula', 'pk')
+                    )
+                    for objeto in objetos:
+                        objeto.pk = ids[objeto.cedula]
+                busqueda.indexar(objetos)
+        return len(objetos)
+
+    def reportar_rechazos(self, rechazadas, ruta):
+        if ruta:
+            with open(ruta, 'w', newline='', encoding='utf-8') as archivo:
+                escritor = csv.writer(archivo)
+                escritor.writerow(['linea', 'error', 'fila'])
+                for linea, fila, error in rechazadas:
+                    escritor.writerow([linea, error, dict(fila)])
+        for linea, _, error in rechazadas[:MAXIMO_RECHAZOS_MOSTRADOS]:
+            self.stderr.write(f'Línea {linea}: {error}')
+        if len(rechazadas) > MAXIMO_RECHAZOS_MOSTRADOS:
+            self.stderr.write(f'... y {len(rechazadas) - MAXIMO_RECHAZOS_MOSTRADOS} rechazos más')
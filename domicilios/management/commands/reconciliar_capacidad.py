@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from domicilios.capacidad import TAMANO_LOTE, reconciliar
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula la capacidad libre y la disponibilidad de cada repartidor a partir '
+        'de sus pedidos asignados/en camino y muestra la deriva encontrada'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Solo muestra la deriva, sin corregirla')
+        parser.add_argument('--detalle', type=int, default=20,
+                            help='Repartidores con más deriva que se listan (0 para ninguno)')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE)
+
+    def handle(self, *args, **options):
+        resultado = reconciliar(aplicar=not options['simular'], lote=options['lote'])
+        derivas = resultado.derivas
+        devuelta = sum(max(d.capacidad_nueva - d.capacidad_anterior, 0) for d in derivas)
+        retirada = sum(max(d.capacidad_anterior - d.capacidad_nueva, 0) for d in derivas)
+        habilitados = sum(d.disponible_nuevo and not d.disponible_anterior for d in derivas)
+        deshabilitados = sum(d.disponible_anterior and not d.disponible_nuevo for d in derivas)
+
+        self.stdout.write(
+            f'{resultado.revisados} repartidores revisados en {resultado.duracion:.2f} s: '
+            f'{len(derivas)} con deriva'
+        )
+        if derivas:
+            self.stdout.write(
+                f'  capacidad devuelta {devuelta}, retirada {retirada}; '
+                f'{habilitados} vuelven a estar disponibles, {deshabilitados} quedan no disponibles'
+            )
+        mayores = sorted(derivas, key=lambda d: -abs(d.capacidad_nueva - d.capacidad_anterior))[:options['detalle']]
+        if mayores:
+            self.stdout.write(f'  {"repartidor":>10} {"máxima":>7} {"carga":>6} {"libre antes":>12} {"libre ahora":>12}  disponible')
+            for d in mayores:
+                self.stdout.write(
+                    f'  {d.repartidor_id:>10} {d.capacidad_maxima:>7} {d.carga:>6} '
+                    f'{d.capacidad_anterior:>12} {d.capacidad_nueva:>12}  '
+                    f'{"sí" if d.disponible_anterior else "no"} -> {"sí" if d.disponible_nuevo else "no"}'
+                )
+        if options['simular']:
+            self.stdout.write('Simulación: no se cambió nada')
+        elif derivas:
+            self.stdout.write(self.style.SUCCESS(f'✅ {len(derivas)} repartidores corregidos'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from domicilios.contadores import reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero los contadores de pedidos por estado y por zona'
+
+    def handle(self, *args, **options):
+        filas = reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'✅ {filas} contadores reconstruidos'))
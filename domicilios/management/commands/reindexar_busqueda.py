@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from domicilios.busqueda import reindexar
+from domicilios.models import Cliente, Repartidor
+
+MODELOS = {
+    'clientes': Cliente,
+    'repartidores': Repartidor,
+}
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de términos de búsqueda de clientes y/o repartidores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('modelos', nargs='*', help=f'{", ".join(sorted(MODELOS))} (todos si se omite)')
+        parser.add_argument('--lote', type=int, default=2000, help='Filas por lote')
+
+    def handle(self, *args, **options):
+        desconocidos = set(options['modelos']) - set(MODELOS)
+        if desconocidos:
+            raise CommandError(f'Modelos desconocidos: {", ".join(sorted(desconocidos))}')
+        for nombre in options['modelos'] or sorted(MODELOS):
+            inicio = time.perf_counter()
+            total = reindexar(MODELOS[nombre], options['lote'])
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ {nombre}: {total} términos en {time.perf_counter() - inicio:.1f} s'
+            ))
@@ -0,0 +1,84 @@
+import os
+import signal
+import socket
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from domicilios import eventos, tareas
+
+
+class Command(BaseCommand):
+    help = (
+        'Procesa la cola de tareas en segundo plano (reportes automáticos, '
+        'asignación automática) con reintentos y cola de errores'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=10, help='Tareas reclamadas por consulta')
+        parser.add_argument('--espera', type=float, default=1.0, help='Segundos de espera con la cola vacía')
+        parser.add_argument('--tipos', nargs='+', help='Solo estos tipos de tarea')
+        parser.add_argument('--una-vez', action='store_true', help='Vacía la cola disponible y termina')
+        parser.add_argument('--intervalo-reporte', type=float, default=60,
+                            help='Segundos entre resúmenes de rendimiento por tipo')
+        parser.add_argument('--retener-dias', type=int, default=7,
+                            help='Días que se conservan las tareas completadas')
+        parser.add_argument('--reintentar-fallidas', action='store_true',
+                            help='Devuelve la cola de errores a pendientes y termina')
+
+    def handle(self, *args, **options):
+        if options['reintentar_fallidas']:
+            devueltas = sum(tareas.reintentar_fallidas(tipo) for tipo in options['tipos'] or [None])
+            self.stdout.write(f'{devueltas} tareas devueltas a la cola')
+            return
+
+        trabajador = f'{socket.gethostname()}:{os.getpid()}'
+        self.detener = False
+        # Termina el lote en curso antes de salir
+        signal.signal(signal.SIGTERM, self.pedir_parada)
+        signal.signal(signal.SIGINT, self.pedir_parada)
+
+        self.stdout.write(f'Worker {trabajador} esperando tareas...')
+        resultados = Counter()
+        desde = time.monotonic()
+        # Purga y poda en la primera vuelta; luego cada hora y cada INTERVALO_PODA
+        ultima_purga = ultima_poda = float('-inf')
+        while not self.detener:
+            close_old_connections()
+            lote = tareas.reclamar(trabajador, options['lote'], options['tipos'])
+            for tarea in lote:
+                resultados[(tarea.tipo, tareas.ejecutar(tarea))] += 1
+            if time.monotonic() - desde >= options['intervalo_reporte']:
+                self.reportar(resultados, time.monotonic() - desde)
+                resultados.clear()
+                desde = time.monotonic()
+            if time.monotonic() - ultima_purga > 3600:
+                tareas.purgar_completadas(options['retener_dias'])
+                ultima_purga = time.monotonic()
+            if time.monotonic() - ultima_poda > eventos.INTERVALO_PODA:
+                # Eventos del tablero que ya ninguna reconexión va a pedir
+                eventos.podar()
+                ultima_poda = time.monotonic()
+            if not lote:
+                if options['una_vez']:
+                    break
+                time.sleep(options['espera'])
+        self.reportar(resultados, time.monotonic() - desde)
+
+    def pedir_parada(self, *args):
+        self.detener = True
+
+    def reportar(self, resultados, segundos):
+        if not resultados:
+            return
+        por_tipo = Counter()
+        for (tipo, _), cantidad in resultados.items():
+            por_tipo[tipo] += cantidad
+        for tipo, total in sorted(por_tipo.items()):
+            detalle = ', '.join(
+                f'{cantidad} {resultado}' for (tipo_r, resultado), cantidad in sorted(resultados.items())
+                if tipo_r == tipo
+            )
+            self.stdout.write(f'  {tipo}: {total / segundos:.1f} tareas/s ({detalle})')
@@ -0,0 +1,290 @@
+import random
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.template.backends import django as backend_django
+
+# Límites fijos de los histogramas: la memoria depende del número de vistas
+# con nombre, no del número de peticiones
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+LIMITES_BYTES = (1024, 10240, 51200, 102400, 512000, 1048576, 5242880)
+
+# Una misma consulta repetida tantas veces en una petición es sospechosa de N+1
+UMBRAL_N_MAS_UNO = 5
+MAXIMO_SOSPECHOSAS_POR_VISTA = 10
+LARGO_MAXIMO_SQL = 200
+
+PREFIJO = 'farmacia'
+
+HISTOGRAMAS = {
+    'peticion_segundos': ('Duración total de la petición', LIMITES_SEGUNDOS),
+    'sql_segundos': ('Tiempo en consultas SQL por petición', LIMITES_SEGUNDOS),
+    'render_segundos': ('Tiempo renderizando plantillas por petición', LIMITES_SEGUNDOS),
+    'consultas': ('Consultas SQL por petición', LIMITES_CONSULTAS),
+    'respuesta_bytes': ('Tamaño de la respuesta (sin streaming)', LIMITES_BYTES),
+}
+
+_medicion_actual = ContextVar('medicion_actual', default=None)
+_candado = threading.Lock()
+_histogramas = {}
+_contadores = {}
+_sospechosas = {}
+
+
+class Histograma:
+    """Histograma acumulado con límites fijos, al estilo de Prometheus"""
+    def __init__(self, limites):
+        self.limites = limites
+        self.cubetas = [0] * len(limites)
+        self.suma = 0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.cubetas[i] += 1
+                break
+        self.suma += valor
+        self.total += 1
+
+
+class Medicion:
+    """
+    Datos recogidos durante una petición muestreada. Las vistas asíncronas
+    consultan desde varios hilos a la vez (ver agregados.py), así que las
+    sumas van con candado.
+    """
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo_sql = 0.0
+        self.tiempo_render = 0.0
+        self.sql = Counter()
+        self.candado = threading.Lock()
+
+    def consulta(self, sql, duracion):
+        with self.candado:
+            self.tiempo_sql += duracion
+            self.consultas += 1
+            # El SQL llega con marcadores (%s), así que el mismo texto con
+            # distintos parámetros cuenta como la misma consulta
+            self.sql[sql] += 1
+
+    def render(self, duracion):
+        with self.candado:
+            self.tiempo_render += duracion
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    """
+    execute_wrapper de cada conexión: mide la consulta si la petición en
+    curso está muestreada. La medición se busca en el ContextVar, que
+    sync_to_async copia a sus hilos, así que también se cuentan las
+    consultas de los hilos de las vistas asíncronas, cada uno con su conexión.
+    """
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion.consulta(sql, time.perf_counter() - inicio)
+
+
+def _instalar_en_conexion(connection, **kwargs):
+    if _medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir_consulta)
+
+
+def percentil(valores, porcentaje):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    indice = max(0, -(-len(valores) * porcentaje // 100) - 1)
+    return valores[int(indice)]
+
+
+def incrementar(nombre, cantidad=1, **etiquetas):
+    """Suma `cantidad` a un contador con etiquetas (expuesto en /metrics)"""
+    clave = (nombre, tuple(sorted(etiquetas.items())))
+    with _candado:
+        _contadores[clave] = _contadores.get(clave, 0) + cantidad
+
+
+def registrar(vista, duracion, medicion, tamano=None):
+    valores = {
+        'peticion_segundos': duracion,
+        'sql_segundos': medicion.tiempo_sql,
+        'render_segundos': medicion.tiempo_render,
+        'consultas': medicion.consultas,
+    }
+    if tamano is not None:
+        valores['respuesta_bytes'] = tamano
+    repetidas = [(sql, veces) for sql, veces in medicion.sql.items() if veces >= UMBRAL_N_MAS_UNO]
+
+    with _candado:
+        for nombre, valor in valores.items():
+            clave = (nombre, vista)
+            if clave not in _histogramas:
+                _histogramas[clave] = Histograma(HISTOGRAMAS[nombre][1])
+            _histogramas[clave].observar(valor)
+        if repetidas:
+            clave = ('n_mas_uno_total', (('vista', vista),))
+            _contadores[clave] = _contadores.get(clave, 0) + 1
+            sospechosas = _sospechosas.setdefault(vista, {})
+            for sql, veces in repetidas:
+                sql = sql[:LARGO_MAXIMO_SQL]
+                if sql in sospechosas or len(sospechosas) < MAXIMO_SOSPECHOSAS_POR_VISTA:
+                    sospechosas[sql] = max(veces, sospechosas.get(sql, 0))
+
+
+def reiniciar():
+    with _candado:
+        _histogramas.clear()
+        _contadores.clear()
+        _sospechosas.clear()
+
+
+def _medir_render(render):
+    def render_medido(self, context=None, request=None):
+        medicion = _medicion_actual.get()
+        if medicion is None:
+            return render(self, context, request)
+        inicio = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            medicion.render(time.perf_counter() - inicio)
+    render_medido.medido = True
+    return render_medido
+
+
+def _instalar_medicion_render():
+    # Solo se envuelve el render de nivel superior del backend de Django; los
+    # {% include %} se renderizan dentro de él y no se cuentan dos veces
+    if not getattr(backend_django.Template.render, 'medido', False):
+        backend_django.Template.render = _medir_render(backend_django.Template.render)
+
+
+class MetricasMiddleware:
+    """
+    Registra por nombre de URL: duración, número y tiempo de consultas SQL,
+    tiempo de render y tamaño de la respuesta, y marca como sospechosas de
+    N+1 las consultas idénticas repetidas en una misma petición.
+
+    Funciona bajo WSGI y ASGI; con vistas asíncronas también cuenta las
+    consultas que corren en hilos del pool (thread_sensitive=False).
+    METRICAS_MUESTREO (0 a 1, por defecto 1) es la fracción de peticiones
+    medidas; con 0 el middleware solo delega en la vista. Los datos viven en
+    memoria de cada proceso.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+        self.muestreo = getattr(settings, 'METRICAS_MUESTREO', 1.0)
+        if self.muestreo > 0:
+            _instalar_medicion_render()
+            # Cada conexión nueva, de cualquier hilo, mide sus consultas
+            connection_created.connect(_instalar_en_conexion, dispatch_uid='metricas_medir_consulta')
+
+    def muestrear(self):
+        return self.muestreo > 0 and (self.muestreo >= 1 or random.random() < self.muestreo)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        if not self.muestrear():
+            return self.get_response(request)
+
+        # La conexión de este hilo pudo abrirse antes de conectar la señal
+        _instalar_en_conexion(connection)
+        medicion = Medicion()
+        token = _medicion_actual.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        self.registrar(request, response, medicion, time.perf_counter() - inicio)
+        return response
+
+    async def __acall__(self, request):
+        if not self.muestrear():
+            return await self.get_response(request)
+
+        medicion = Medicion()
+        token = _medicion_actual.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        self.registrar(request, response, medicion, time.perf_counter() - inicio)
+        return response
+
+    def registrar(self, request, response, medicion, duracion):
+        coincidencia = getattr(request, 'resolver_match', None)
+        vista = coincidencia.view_name if coincidencia and coincidencia.view_name else 'sin_ruta'
+        tamano = None if response.streaming else len(response.content)
+        registrar(vista, duracion, medicion, tamano)
+
+
+def _etiquetas(pares):
+    if not pares:
+        return ''
+    texto = ','.join(
+        '{}="{}"'.format(nombre, str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for nombre, valor in pares
+    )
+    return '{' + texto + '}'
+
+
+def exportar_prometheus():
+    """Retorna todas las métricas en el formato de texto de Prometheus"""
+    with _candado:
+        histogramas = {
+            clave: (list(h.cubetas), h.suma, h.total, h.limites) for clave, h in _histogramas.items()
+        }
+        contadores = dict(_contadores)
+        sospechosas = {vista: dict(consultas) for vista, consultas in _sospechosas.items()}
+
+    lineas = []
+    for nombre, (ayuda, _) in HISTOGRAMAS.items():
+        metrica = f'{PREFIJO}_{nombre}'
+        lineas.append(f'# HELP {metrica} {ayuda}')
+        lineas.append(f'# TYPE {metrica} histogram')
+        for (nombre_h, vista), (cubetas, suma, total, limites) in sorted(histogramas.items()):
+            if nombre_h != nombre:
+                continue
+            acumulado = 0
+            for limite, cantidad in zip(limites, cubetas):
+                acumulado += cantidad
+                lineas.append(f'{metrica}_bucket{_etiquetas([("vista", vista), ("le", limite)])} {acumulado}')
+            lineas.append(f'{metrica}_bucket{_etiquetas([("vista", vista), ("le", "+Inf")])} {total}')
+            lineas.append(f'{metrica}_sum{_etiquetas([("vista", vista)])} {suma}')
+            lineas.append(f'{metrica}_count{_etiquetas([("vista", vista)])} {total}')
+
+    for nombre in sorted({nombre for nombre, _ in contadores}):
+        metrica = f'{PREFIJO}_{nombre}'
+        lineas.append(f'# TYPE {metrica} counter')
+        for (nombre_c, etiquetas), valor in sorted(contadores.items()):
+            if nombre_c == nombre:
+                lineas.append(f'{metrica}{_etiquetas(etiquetas)} {valor}')
+
+    metrica = f'{PREFIJO}_n_mas_uno_repeticiones'
+    lineas.append(f'# HELP {metrica} Máximo de repeticiones observado por consulta sospechosa de N+1')
+    lineas.append(f'# TYPE {metrica} gauge')
+    for vista, consultas in sorted(sospechosas.items()):
+        for sql, veces in sorted(consultas.items()):
+            lineas.append(f'{metrica}{_etiquetas([("vista", vista), ("sql", sql)])} {veces}')
+    return '\n'.join(lineas) + '\n'
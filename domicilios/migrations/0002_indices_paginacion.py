@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['fecha_registro'], name='CLIENTE_fecha_r_399e09_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', 'fecha_pedido'], name='PEDIDO_estado_4056b7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repartidor',
+            index=models.Index(fields=['activo', 'nombres'], name='REPARTIDOR_activo_b0e9b1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reporteentregas',
+            index=models.Index(fields=['fecha_reporte'], name='REPORTE_ENT_fecha_r_5d39cb_idx'),
+        ),
+    ]
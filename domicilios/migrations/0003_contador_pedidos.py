@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def poblar_contadores(apps, schema_editor):
+    Pedido = apps.get_model('domicilios', 'Pedido')
+    ContadorPedidos = apps.get_model('domicilios', 'ContadorPedidos')
+    filas = []
+    for dimension, columna in (('estado', 'estado'), ('zona', 'zona_entrega')):
+        for fila in Pedido.objects.order_by().values(columna).annotate(total=Count('pk')):
+            filas.append(ContadorPedidos(dimension=dimension, valor=fila[columna], total=fila['total']))
+    ContadorPedidos.objects.bulk_create(filas)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0002_indices_paginacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorPedidos',
+            fields=[
+                ('contador_id', models.AutoField(primary_key=True, serialize=False)),
+                ('dimension', models.CharField(choices=[('estado', 'Estado'), ('zona', 'Zona')], max_length=10)),
+                ('valor', models.CharField(max_length=50)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de Pedidos',
+                'verbose_name_plural': 'Contadores de Pedidos',
+                'db_table': 'CONTADOR_PEDIDOS',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='contadorpedidos',
+            constraint=models.UniqueConstraint(fields=('dimension', 'valor'), name='contador_dimension_valor_unico'),
+        ),
+        migrations.RunPython(poblar_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0003_contador_pedidos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cliente',
+            name='apellidos',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='cliente',
+            name='nombres',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='cliente',
+            name='telefono',
+            field=models.CharField(db_index=True, max_length=15),
+        ),
+        migrations.AlterField(
+            model_name='repartidor',
+            name='apellidos',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='repartidor',
+            name='nombres',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='repartidor',
+            name='telefono',
+            field=models.CharField(db_index=True, max_length=15),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0005_version_pedido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PedidoArchivado',
+            fields=[
+                ('pedido_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('fecha_pedido', models.DateTimeField()),
+                ('fecha_asignacion', models.DateTimeField(blank=True, null=True)),
+                ('fecha_entrega_estimada', models.DateTimeField(blank=True, null=True)),
+                ('fecha_entrega_real', models.DateTimeField(blank=True, null=True)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('asignado', 'Asignado'), ('en_camino', 'En Camino'), ('entregado', 'Entregado'), ('cancelado', 'Cancelado')], max_length=20)),
+                ('direccion_entrega', models.CharField(max_length=255)),
+                ('zona_entrega', models.CharField(max_length=50)),
+                ('prioridad', models.CharField(choices=[('normal', 'Normal'), ('alta', 'Alta'), ('urgente', 'Urgente')], max_length=10)),
+                ('tiempo_estimado_minutos', models.IntegerField()),
+                ('tiempo_real_minutos', models.IntegerField(blank=True, null=True)),
+                ('observaciones', models.TextField(blank=True, null=True)),
+                ('fecha_archivado', models.DateTimeField(default=django.utils.timezone.now)),
+                ('cliente', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='domicilios.cliente')),
+                ('repartidor', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='domicilios.repartidor')),
+            ],
+            options={
+                'verbose_name': 'Pedido Archivado',
+                'verbose_name_plural': 'Pedidos Archivados',
+                'db_table': 'PEDIDO_ARCHIVADO',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReporteEntregasArchivado',
+            fields=[
+                ('reporte_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('fecha_reporte', models.DateField()),
+                ('hora_salida', models.TimeField(blank=True, null=True)),
+                ('hora_llegada', models.TimeField(blank=True, null=True)),
+                ('hora_entrega', models.TimeField(blank=True, null=True)),
+                ('tiempo_transito', models.IntegerField(blank=True, null=True)),
+                ('tiempo_total', models.IntegerField(blank=True, null=True)),
+                ('estado_entrega', models.CharField(choices=[('exitosa', 'Exitosa'), ('fallida', 'Fallida'), ('reprogramada', 'Reprogramada')], max_length=15)),
+                ('motivo_falla', models.TextField(blank=True, null=True)),
+                ('calificacion', models.IntegerField(blank=True, null=True)),
+                ('comentarios_cliente', models.TextField(blank=True, null=True)),
+                ('pedido', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='domicilios.pedidoarchivado')),
+                ('repartidor', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='domicilios.repartidor')),
+            ],
+            options={
+                'verbose_name': 'Reporte de Entrega Archivado',
+                'verbose_name_plural': 'Reportes de Entrega Archivados',
+                'db_table': 'REPORTE_ENTREGAS_ARCHIVADO',
+            },
+        ),
+        migrations.CreateModel(
+            name='HistorialEstadosArchivado',
+            fields=[
+                ('historial_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('estado_anterior', models.CharField(blank=True, max_length=50, null=True)),
+                ('estado_nuevo', models.CharField(max_length=50)),
+                ('fecha_cambio', models.DateTimeField()),
+                ('usuario', models.CharField(max_length=100)),
+                ('pedido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='domicilios.pedidoarchivado')),
+            ],
+            options={
+                'verbose_name': 'Historial de Estado Archivado',
+                'verbose_name_plural': 'Historial de Estados Archivado',
+                'db_table': 'HISTORIAL_ESTADOS_ARCHIVADO',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pedidoarchivado',
+            index=models.Index(fields=['fecha_pedido'], name='PEDIDO_ARCH_fecha_p_5c3d04_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historialestadosarchivado',
+            index=models.Index(fields=['pedido', 'fecha_cambio'], name='HISTORIAL_E_pedido__8b6038_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0006_archivo_pedidos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DireccionGeocodificada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direccion', models.CharField(max_length=255, unique=True)),
+                ('latitud', models.FloatField(blank=True, null=True)),
+                ('longitud', models.FloatField(blank=True, null=True)),
+                ('fecha_uso', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Dirección Geocodificada',
+                'verbose_name_plural': 'Direcciones Geocodificadas',
+                'db_table': 'DIRECCION_GEOCODIFICADA',
+            },
+        ),
+        migrations.AddField(
+            model_name='repartidor',
+            name='fecha_ubicacion',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repartidor',
+            name='latitud',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repartidor',
+            name='longitud',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
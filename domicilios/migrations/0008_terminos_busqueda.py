@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+def indexar_existentes(apps, schema_editor):
+    from domicilios.busqueda import terminos
+    TerminoBusqueda = apps.get_model('domicilios', 'TerminoBusqueda')
+    for tipo, nombre_modelo in (('cliente', 'Cliente'), ('repartidor', 'Repartidor')):
+        modelo = apps.get_model('domicilios', nombre_modelo)
+        filas = []
+        personas = modelo.objects.order_by().values_list('pk', 'nombres', 'apellidos', 'cedula', 'telefono')
+        for pk, *campos in personas.iterator(chunk_size=2000):
+            filas.extend(
+                TerminoBusqueda(tipo=tipo, objeto_id=pk, termino=termino) for termino in terminos(*campos)
+            )
+            if len(filas) >= 10000:
+                TerminoBusqueda.objects.bulk_create(filas)
+                filas = []
+        TerminoBusqueda.objects.bulk_create(filas)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0007_geocodificacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerminoBusqueda',
+            fields=[
+                ('termino_id', models.AutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('cliente', 'Cliente'), ('repartidor', 'Repartidor')], max_length=10)),
+                ('objeto_id', models.IntegerField()),
+                ('termino', models.CharField(max_length=100)),
+            ],
+            options={
+                'verbose_name': 'Término de Búsqueda',
+                'verbose_name_plural': 'Términos de Búsqueda',
+                'db_table': 'TERMINO_BUSQUEDA',
+                'indexes': [models.Index(fields=['tipo', 'termino', 'objeto_id'], name='TERMINO_BUS_tipo_5e2dd6_idx'), models.Index(fields=['tipo', 'objeto_id'], name='TERMINO_BUS_tipo_22616e_idx')],
+            },
+        ),
+        migrations.RunPython(indexar_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0008_terminos_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historialestados',
+            index=models.Index(fields=['fecha_cambio'], name='HISTORIAL_E_fecha_c_d2cf9f_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0010_tareas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', 'prioridad', 'fecha_pedido'], name='PEDIDO_estado_34bf7b_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:56
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def estimar_capacidad_maxima(apps, schema_editor):
+    # La capacidad configurada no se guardaba: se toma lo que queda libre más
+    # los pedidos abiertos, sin bajar del valor por defecto (la deriva por
+    # entregas nunca devueltas solo la reduce)
+    Pedido = apps.get_model('domicilios', 'Pedido')
+    Repartidor = apps.get_model('domicilios', 'Repartidor')
+    cargas = dict(
+        Pedido.objects.filter(estado__in=('asignado', 'en_camino'), repartidor__isnull=False)
+        .order_by().values_list('repartidor_id').annotate(total=Count('pk'))
+    )
+    cambios = []
+    for repartidor in Repartidor.objects.only('pk', 'capacidad_entregas').iterator(chunk_size=2000):
+        repartidor.capacidad_maxima = max(5, repartidor.capacidad_entregas + cargas.get(repartidor.pk, 0))
+        cambios.append(repartidor)
+        if len(cambios) >= 2000:
+            Repartidor.objects.bulk_update(cambios, ['capacidad_maxima'])
+            cambios = []
+    Repartidor.objects.bulk_update(cambios, ['capacidad_maxima'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0011_indice_despacho'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repartidor',
+            name='capacidad_maxima',
+            field=models.IntegerField(default=5),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', 'repartidor'], name='PEDIDO_estado_e2709d_idx'),
+        ),
+        migrations.RunPython(estimar_capacidad_maxima, migrations.RunPython.noop),
+    ]
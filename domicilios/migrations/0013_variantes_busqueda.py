@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+def expandir_existentes(apps, schema_editor):
+    from domicilios.busqueda import variantes
+    TerminoBusqueda = apps.get_model('domicilios', 'TerminoBusqueda')
+    VarianteBusqueda = apps.get_model('domicilios', 'VarianteBusqueda')
+    filas = []
+    distintos = TerminoBusqueda.objects.order_by().values_list('tipo', 'termino').distinct()
+    for tipo, termino in distintos.iterator(chunk_size=2000):
+        filas.extend(
+            VarianteBusqueda(tipo=tipo, clave=clave, termino=termino) for clave in variantes(termino)
+        )
+        if len(filas) >= 10000:
+            VarianteBusqueda.objects.bulk_create(filas)
+            filas = []
+    VarianteBusqueda.objects.bulk_create(filas)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0012_capacidad_maxima'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VarianteBusqueda',
+            fields=[
+                ('variante_id', models.AutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('cliente', 'Cliente'), ('repartidor', 'Repartidor')], max_length=10)),
+                ('clave', models.CharField(max_length=10)),
+                ('termino', models.CharField(max_length=100)),
+            ],
+            options={
+                'verbose_name': 'Variante de Búsqueda',
+                'verbose_name_plural': 'Variantes de Búsqueda',
+                'db_table': 'VARIANTE_BUSQUEDA',
+            },
+        ),
+        migrations.AlterField(
+            model_name='cliente',
+            name='apellidos',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='cliente',
+            name='nombres',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='cliente',
+            name='telefono',
+            field=models.CharField(max_length=15),
+        ),
+        migrations.AlterField(
+            model_name='repartidor',
+            name='apellidos',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='repartidor',
+            name='nombres',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='repartidor',
+            name='telefono',
+            field=models.CharField(max_length=15),
+        ),
+        migrations.AddConstraint(
+            model_name='variantebusqueda',
+            constraint=models.UniqueConstraint(fields=('tipo', 'clave', 'termino'), name='variante_tipo_clave_termino_unica'),
+        ),
+        migrations.RunPython(expandir_existentes, migrations.RunPython.noop),
+    ]
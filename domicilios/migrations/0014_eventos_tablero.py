@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0013_variantes_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoTablero',
+            fields=[
+                ('evento_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('datos', models.TextField()),
+                ('fecha', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Evento del Tablero',
+                'verbose_name_plural': 'Eventos del Tablero',
+                'db_table': 'EVENTO_TABLERO',
+            },
+        ),
+    ]
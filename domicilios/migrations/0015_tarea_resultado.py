@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0014_eventos_tablero'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarea',
+            name='resultado',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
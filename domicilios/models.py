@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -19,6 +20,9 @@ class Cliente(models.Model):
         db_table = 'CLIENTE'
         verbose_name = 'Cliente'
         verbose_name_plural = 'Clientes'
+        indexes = [
+            models.Index(fields=['fecha_registro']),
+        ]
 
     def __str__(self):
         return f"{self.nombres} {self.apellidos} - {self.cedula}"
@@ -32,13 +36,23 @@ class Repartidor(models.Model):
     vehiculo = models.CharField(max_length=50, blank=True, null=True)
     disponible = models.BooleanField(default=True)
     zona_asignada = models.CharField(max_length=50)
+    # Entregas que el repartidor puede llevar a la vez (configurada); capacidad_entregas
+    # es lo que le queda libre y se recalcula con `manage.py reconciliar_capacidad`
+    capacidad_maxima = models.IntegerField(default=5)
     capacidad_entregas = models.IntegerField(default=5)
     activo = models.BooleanField(default=True)
+    # Última ubicación reportada (opcional); la usa el índice de geocodificacion.py
+    latitud = models.FloatField(null=True, blank=True)
+    longitud = models.FloatField(null=True, blank=True)
+    fecha_ubicacion = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'REPARTIDOR'
         verbose_name = 'Repartidor'
         verbose_name_plural = 'Repartidores'
+        indexes = [
+            models.Index(fields=['activo', 'nombres']),
+        ]
 
     def __str__(self):
         return f"{self.nombres} {self.apellidos} - {self.vehiculo}"
@@ -72,6 +86,8 @@ class Pedido(models.Model):
     tiempo_estimado_minutos = models.IntegerField()
     tiempo_real_minutos = models.IntegerField(null=True, blank=True)
     observaciones = models.TextField(blank=True, null=True)
+    # Sube en cada modificación; invalida los fragmentos cacheados del pedido
+    version = models.PositiveIntegerField(default=1, editable=False)
 
     class Meta:
         db_table = 'PEDIDO'
@@ -81,11 +97,46 @@ class Pedido(models.Model):
             models.Index(fields=['estado']),
             models.Index(fields=['zona_entrega']),
             models.Index(fields=['fecha_pedido']),
+            models.Index(fields=['estado', 'fecha_pedido']),
+            # Lotes del despachador: pendientes por prioridad, los más antiguos primero
+            models.Index(fields=['estado', 'prioridad', 'fecha_pedido']),
+            # Carga abierta por repartidor (reconciliar_capacidad) solo desde el índice
+            models.Index(fields=['estado', 'repartidor']),
         ]
 
     def __str__(self):
         return f"Pedido {self.pedido_id} - {self.cliente.nombres}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._contador_original = instancia._valores_contador()
+        return instancia
+
+    def _valores_contador(self):
+        # Valores que alimentan ContadorPedidos (None si el campo está diferido)
+        return (self.__dict__.get('estado'), self.__dict__.get('zona_entrega'))
+
+    def save(self, *args, **kwargs):
+        from .contadores import registrar_cambio
+        creando = self._state.adding
+        if not creando:
+            # Incremento atómico en la base para que dos guardados concurrentes
+            # nunca terminen con la misma versión
+            self.version = F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not creando:
+                self.refresh_from_db(fields=['version'])
+            actuales = self._valores_contador()
+            registrar_cambio(
+                None if creando else getattr(self, '_contador_original', (None, None)),
+                actuales
+            )
+        self._contador_original = actuales
+
 class HistorialEstados(models.Model):
     historial_id = models.AutoField(primary_key=True)
     pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE)
@@ -100,6 +151,7 @@ class HistorialEstados(models.Model):
         verbose_name_plural = 'Historial de Estados'
         indexes = [
             models.Index(fields=['pedido', 'fecha_cambio']),
+            models.Index(fields=['fecha_cambio']),
         ]
 
     def __str__(self):
@@ -130,6 +182,242 @@ class ReporteEntregas(models.Model):
         db_table = 'REPORTE_ENTREGAS'
         verbose_name = 'Reporte de Entrega'
         verbose_name_plural = 'Reportes de Entrega'
+        indexes = [
+            models.Index(fields=['fecha_reporte']),
+        ]
+
+    def __str__(self):
+        return f"Reporte {self.reporte_id} - Pedido {self.pedido.pedido_id}"
+
+class ContadorPedidos(models.Model):
+    DIMENSION_CHOICES = [
+        ('estado', 'Estado'),
+        ('zona', 'Zona'),
+    ]
+
+    contador_id = models.AutoField(primary_key=True)
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    valor = models.CharField(max_length=50)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'CONTADOR_PEDIDOS'
+        verbose_name = 'Contador de Pedidos'
+        verbose_name_plural = 'Contadores de Pedidos'
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'valor'], name='contador_dimension_valor_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}={self.valor}: {self.total}"
+
+class Tarea(models.Model):
+    """
+    Trabajo en segundo plano (ver tareas.py y `manage.py worker`). Se
+    encola en la misma transacción que el cambio que lo origina.
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En Proceso'),
+        ('completada', 'Completada'),
+        ('fallida', 'Fallida'),
+    ]
+
+    tarea_id = models.AutoField(primary_key=True)
+    tipo = models.CharField(max_length=50)
+    datos = models.JSONField(default=dict)
+    estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.IntegerField(default=0)
+    max_intentos = models.IntegerField(default=5)
+    disponible_en = models.DateTimeField(default=timezone.now)
+    tomada_por = models.CharField(max_length=100, blank=True, null=True)
+    tomada_en = models.DateTimeField(null=True, blank=True)
+    ultimo_error = models.TextField(blank=True, null=True)
+    # Resumen que retorna el manejador, para mostrárselo a quien la encoló
+    resultado = models.TextField(blank=True, null=True)
+    fecha_creacion = models.DateTimeField(default=timezone.now)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'TAREA'
+        verbose_name = 'Tarea'
+        verbose_name_plural = 'Tareas'
+        indexes = [
+            models.Index(fields=['estado', 'disponible_en']),
+            models.Index(fields=['estado', 'fecha_fin']),
+            models.Index(fields=['tomada_por']),
+        ]
+
+    def __str__(self):
+        return f"Tarea {self.tarea_id} - {self.tipo} ({self.estado})"
+
+class EventoTablero(models.Model):
+    """
+    Canal compartido del tablero en vivo (ver eventos.py): web, worker y
+    despachar insertan aquí sus eventos en la misma transacción que el
+    cambio, y cada proceso web los relee para sus conexiones SSE. El id es
+    el Last-Event-ID del navegador.
+    """
+    evento_id = models.BigAutoField(primary_key=True)
+    datos = models.TextField()
+    fecha = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'EVENTO_TABLERO'
+        verbose_name = 'Evento del Tablero'
+        verbose_name_plural = 'Eventos del Tablero'
+
+    def __str__(self):
+        return f"Evento {self.evento_id}"
+
+class TerminoBusqueda(models.Model):
+    """
+    Índice de búsqueda mantenido por busqueda.py: una fila por palabra de
+    nombres/apellidos (sin tildes, en minúscula) y por los dígitos de
+    cédula y teléfono de cada cliente o repartidor. Buscar por prefijo es
+    un rango sobre (tipo, termino) en vez de un LIKE '%x%' sobre la tabla.
+    """
+    TIPO_CHOICES = [
+        ('cliente', 'Cliente'),
+        ('repartidor', 'Repartidor'),
+    ]
+
+    termino_id = models.AutoField(primary_key=True)
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    objeto_id = models.IntegerField()
+    termino = models.CharField(max_length=100)
+
+    class Meta:
+        db_table = 'TERMINO_BUSQUEDA'
+        verbose_name = 'Término de Búsqueda'
+        verbose_name_plural = 'Términos de Búsqueda'
+        indexes = [
+            models.Index(fields=['tipo', 'termino', 'objeto_id']),
+            models.Index(fields=['tipo', 'objeto_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} {self.objeto_id}: {self.termino}"
+
+class VarianteBusqueda(models.Model):
+    """
+    Vecindario de borrados de los términos de TerminoBusqueda para la
+    búsqueda aproximada (busqueda.py): cada término distinto con las claves
+    que quedan al quitarle 1 o 2 letras de su principio. Solo se agregan
+    filas; las de términos que ya nadie usa desaparecen al reindexar.
+    """
+    variante_id = models.AutoField(primary_key=True)
+    tipo = models.CharField(max_length=10, choices=TerminoBusqueda.TIPO_CHOICES)
+    clave = models.CharField(max_length=10)
+    termino = models.CharField(max_length=100)
+
+    class Meta:
+        db_table = 'VARIANTE_BUSQUEDA'
+        verbose_name = 'Variante de Búsqueda'
+        verbose_name_plural = 'Variantes de Búsqueda'
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'clave', 'termino'], name='variante_tipo_clave_termino_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} {self.clave}: {self.termino}"
+
+class DireccionGeocodificada(models.Model):
+    """
+    Caché persistente de geocodificacion.py: dirección normalizada ->
+    coordenadas (nulas si el nomenclátor no la conoce). Las filas menos
+    usadas se podan por fecha_uso.
+    """
+    direccion = models.CharField(max_length=255, unique=True)
+    latitud = models.FloatField(null=True, blank=True)
+    longitud = models.FloatField(null=True, blank=True)
+    fecha_uso = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'DIRECCION_GEOCODIFICADA'
+        verbose_name = 'Dirección Geocodificada'
+        verbose_name_plural = 'Direcciones Geocodificadas'
+
+    def __str__(self):
+        return f"{self.direccion} ({self.latitud}, {self.longitud})"
+
+# ✅ ARCHIVO HISTÓRICO
+# Pedidos entregados/cancelados antiguos movidos por `manage.py archivar_pedidos`.
+# Conservan su id original; las llaves hacia clientes y repartidores no
+# tienen restricción en la base para no bloquear su eliminación.
+
+class PedidoArchivado(models.Model):
+    pedido_id = models.IntegerField(primary_key=True)
+    cliente = models.ForeignKey(
+        Cliente, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    repartidor = models.ForeignKey(
+        Repartidor, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    fecha_pedido = models.DateTimeField()
+    fecha_asignacion = models.DateTimeField(null=True, blank=True)
+    fecha_entrega_estimada = models.DateTimeField(null=True, blank=True)
+    fecha_entrega_real = models.DateTimeField(null=True, blank=True)
+    estado = models.CharField(max_length=20, choices=Pedido.ESTADO_CHOICES)
+    direccion_entrega = models.CharField(max_length=255)
+    zona_entrega = models.CharField(max_length=50)
+    prioridad = models.CharField(max_length=10, choices=Pedido.PRIORIDAD_CHOICES)
+    tiempo_estimado_minutos = models.IntegerField()
+    tiempo_real_minutos = models.IntegerField(null=True, blank=True)
+    observaciones = models.TextField(blank=True, null=True)
+    fecha_archivado = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'PEDIDO_ARCHIVADO'
+        verbose_name = 'Pedido Archivado'
+        verbose_name_plural = 'Pedidos Archivados'
+        indexes = [
+            models.Index(fields=['fecha_pedido']),
+        ]
+
+    def __str__(self):
+        return f"Pedido archivado {self.pedido_id}"
+
+class HistorialEstadosArchivado(models.Model):
+    historial_id = models.IntegerField(primary_key=True)
+    pedido = models.ForeignKey(PedidoArchivado, on_delete=models.CASCADE)
+    estado_anterior = models.CharField(max_length=50, blank=True, null=True)
+    estado_nuevo = models.CharField(max_length=50)
+    fecha_cambio = models.DateTimeField()
+    usuario = models.CharField(max_length=100)
+
+    class Meta:
+        db_table = 'HISTORIAL_ESTADOS_ARCHIVADO'
+        verbose_name = 'Historial de Estado Archivado'
+        verbose_name_plural = 'Historial de Estados Archivado'
+        indexes = [
+            models.Index(fields=['pedido', 'fecha_cambio']),
+        ]
+
+    def __str__(self):
+        return f"Historial archivado {self.historial_id} - {self.pedido_id}"
+
+class ReporteEntregasArchivado(models.Model):
+    reporte_id = models.IntegerField(primary_key=True)
+    pedido = models.OneToOneField(PedidoArchivado, on_delete=models.CASCADE)
+    repartidor = models.ForeignKey(
+        Repartidor, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    fecha_reporte = models.DateField()
+    hora_salida = models.TimeField(null=True, blank=True)
+    hora_llegada = models.TimeField(null=True, blank=True)
+    hora_entrega = models.TimeField(null=True, blank=True)
+    tiempo_transito = models.IntegerField(null=True, blank=True)
+    tiempo_total = models.IntegerField(null=True, blank=True)
+    estado_entrega = models.CharField(max_length=15, choices=ReporteEntregas.ESTADO_ENTREGA_CHOICES)
+    motivo_falla = models.TextField(blank=True, null=True)
+    calificacion = models.IntegerField(null=True, blank=True)
+    comentarios_cliente = models.TextField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'REPORTE_ENTREGAS_ARCHIVADO'
+        verbose_name = 'Reporte de Entrega Archivado'
+        verbose_name_plural = 'Reportes de Entrega Archivados'
 
     def __str__(self):
-        return f"Reporte {self.reporte_id} - Pedido {self.pedido.pedido_id}"
\ No newline at end of file
+        return f"Reporte archivado {self.reporte_id} - Pedido {self.pedido_id}"
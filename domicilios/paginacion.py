@@ -0,0 +1,179 @@
+import base64
+import datetime
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+TAMANO_PAGINA = 50
+TIEMPO_CACHE_CONTEOS = 60
+
+
+class PaginaKeyset:
+    """
+    Página de resultados obtenida por cursor (keyset) en vez de OFFSET
+    """
+    def __init__(self, objetos, url_anterior, url_siguiente):
+        self.objetos = objetos
+        self.url_anterior = url_anterior
+        self.url_siguiente = url_siguiente
+
+    @property
+    def hay_anterior(self):
+        return self.url_anterior is not None
+
+    @property
+    def hay_siguiente(self):
+        return self.url_siguiente is not None
+
+
+def _campos_orden(modelo, orden):
+    campos = []
+    for nombre in orden:
+        descendente = nombre.startswith('-')
+        campos.append((modelo._meta.get_field(nombre.lstrip('-')), descendente))
+    return campos
+
+
+def _codificar_cursor(objeto, campos):
+    valores = []
+    for campo, _ in campos:
+        valor = getattr(objeto, campo.attname)
+        if isinstance(valor, (datetime.date, datetime.time)):
+            valor = valor.isoformat()
+        valores.append(valor)
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+
+def _decodificar_cursor(cursor, campos):
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(valores) != len(campos):
+            return None
+        return [campo.to_python(valor) for (campo, _), valor in zip(campos, valores)]
+    except Exception:
+        return None
+
+
+def _condicion_despues(campos, valores, hacia_atras):
+    """
+    Construye (a, b, c) > (va, vb, vc) respetando la dirección de cada campo:
+    a > va OR (a = va AND b > vb) OR (a = va AND b = vb AND c > vc)
+    """
+    condicion = Q()
+    iguales = Q()
+    for (campo, descendente), valor in zip(campos, valores):
+        operador = 'lt' if descendente != hacia_atras else 'gt'
+        condicion |= iguales & Q(**{f'{campo.name}__{operador}': valor})
+        iguales &= Q(**{campo.name: valor})
+    return condicion
+
+
+def _url_con_cursor(request, prefijo, parametro, cursor):
+    parametros = request.GET.copy()
+    parametros.pop(f'{prefijo}antes', None)
+    parametros.pop(f'{prefijo}despues', None)
+    if cursor is not None:
+        parametros[f'{prefijo}{parametro}'] = cursor
+    consulta = parametros.urlencode()
+    return f'?{consulta}' if consulta else '?'
+
+
+def paginar(request, queryset, orden, tamano=TAMANO_PAGINA, prefijo=''):
+    """
+    Pagina un queryset por cursor sobre las columnas de `orden`.
+
+    El cursor viaja en ?despues= / ?antes= con los valores de la última o
+    primera fila mostrada, así que la página N cuesta lo mismo que la
+    primera (un rango sobre el índice en vez de OFFSET). El último campo de
+    `orden` debe ser único para desempatar, normalmente la llave primaria.
+    Con `prefijo` se pueden paginar varias listas en la misma página.
+    """
+    campos = _campos_orden(queryset.model, orden)
+    despues = request.GET.get(f'{prefijo}despues')
+    antes = request.GET.get(f'{prefijo}antes')
+    hacia_atras = bool(antes) and not despues
+    valores = _decodificar_cursor(antes if hacia_atras else despues, campos) if (antes or despues) else None
+
+    if hacia_atras and valores is not None:
+        orden_inverso = [nombre[1:] if nombre.startswith('-') else f'-{nombre}' for nombre in orden]
+        filas = list(
+            queryset.filter(_condicion_despues(campos, valores, True)).order_by(*orden_inverso)[:tamano + 1]
+        )
+        hay_anterior = len(filas) > tamano
+        objetos = filas[:tamano][::-1]
+        hay_siguiente = True
+    else:
+        if valores is not None:
+            queryset = queryset.filter(_condicion_despues(campos, valores, False))
+        filas = list(queryset.order_by(*orden)[:tamano + 1])
+        hay_siguiente = len(filas) > tamano
+        objetos = filas[:tamano]
+        hay_anterior = valores is not None
+
+    url_anterior = url_siguiente = None
+    if objetos:
+        if hay_anterior:
+            url_anterior = _url_con_cursor(request, prefijo, 'antes', _codificar_cursor(objetos[0], campos))
+        if hay_siguiente:
+            url_siguiente = _url_con_cursor(request, prefijo, 'despues', _codificar_cursor(objetos[-1], campos))
+    elif valores is not None:
+        url_anterior = _url_con_cursor(request, prefijo, 'antes', None)
+    return PaginaKeyset(objetos, url_anterior, url_siguiente)
+
+
+def estimar_filas(modelo):
+    """
+    Estimación de filas de la tabla sin recorrerla (estadísticas de MySQL).
+    Retorna None si el motor no ofrece una estimación barata.
+    """
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+            [modelo._meta.db_table]
+        )
+        fila = cursor.fetchone()
+    return fila[0] if fila else None
+
+
+def contar_aproximado(queryset, clave, tiempo=TIEMPO_CACHE_CONTEOS):
+    """
+    Total aproximado para mostrar junto a una lista paginada: la estimación
+    del motor si el queryset no tiene filtros, o un COUNT(*) guardado en
+    caché durante `tiempo` segundos
+    """
+    if not queryset.query.where:
+        estimado = estimar_filas(queryset.model)
+        if estimado is not None:
+            return estimado
+    clave = f'conteo:{clave}'
+    total = cache.get(clave)
+    if total is None:
+        total = queryset.count()
+        cache.set(clave, total, tiempo)
+    return total
+
+
+class PaginadorEstimado(Paginator):
+    """
+    Paginator del admin cuyo total sale de contar_aproximado(): la
+    estimación del motor sin filtros, o un COUNT(*) en caché por cada
+    combinación de filtros, en vez de contar la tabla en cada página
+    """
+    @cached_property
+    def count(self):
+        consulta = self.object_list.query
+        try:
+            firma = hashlib.md5(str(consulta).encode()).hexdigest()
+        except EmptyResultSet:
+            # Un filtro que nunca coincide (pk__in=[]) no tiene SQL que firmar
+            return 0
+        return contar_aproximado(self.object_list, f'admin:{consulta.model._meta.label_lower}:{firma}')
@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import busqueda
+from .capacidad import ESTADOS_CON_CARGA, liberar_capacidad
+from .contadores import registrar_cambio
+from .models import Cliente, Pedido, Repartidor
+
+
+@receiver(post_delete, sender=Pedido)
+def descontar_pedido_eliminado(sender, instance, **kwargs):
+    # Corre dentro de la transacción del delete()
+    registrar_cambio(instance._valores_contador(), None)
+    if instance.estado in ESTADOS_CON_CARGA and instance.repartidor_id:
+        # El pedido abierto ya no ocupa a su repartidor
+        liberar_capacidad(instance.repartidor_id)
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_save, sender=Repartidor)
+def indexar_persona(sender, instance, update_fields=None, **kwargs):
+    # Guardados que no tocan los campos buscables no reescriben términos
+    if update_fields is not None and not {'nombres', 'apellidos', 'cedula', 'telefono'} & set(update_fields):
+        return
+    busqueda.indexar([instance])
+
+
+@receiver(post_delete, sender=Cliente)
+@receiver(post_delete, sender=Repartidor)
+def desindexar_persona(sender, instance, **kwargs):
+    busqueda.desindexar(sender, [instance.pk])
@@ -0,0 +1,243 @@
+import random
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import metricas
+from .models import Pedido, ReporteEntregas, Tarea
+
+# Segundos que una tarea puede estar "en_proceso" antes de que otro worker
+# la considere abandonada (proceso muerto) y la vuelva a tomar
+ARRIENDO = 300
+# Reintentos con espera exponencial: 10 s, 20 s, 40 s... hasta ESPERA_MAXIMA
+ESPERA_BASE = 10
+ESPERA_MAXIMA = 3600
+LARGO_MAXIMO_ERROR = 4000
+# Veces que un worker sin SKIP LOCKED reintenta si otro le ganó todo el lote
+INTENTOS_RECLAMO = 3
+
+_manejadores = {}
+
+
+def manejador(tipo):
+    """Registra la función que procesa las tareas de `tipo` (recibe sus datos como kwargs)"""
+    def registrar(funcion):
+        _manejadores[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def encolar(tipo, max_intentos=5, **datos):
+    """
+    Crea una tarea pendiente. Dentro de transaction.atomic() queda ligada a
+    la transacción: si el cambio que la origina se revierte, la tarea
+    también.
+    """
+    if tipo not in _manejadores:
+        raise ValueError(f'Tipo de tarea desconocido: {tipo}')
+    return Tarea.objects.create(tipo=tipo, datos=datos, max_intentos=max_intentos)
+
+
+def encolar_varias(tipo, lista_datos, max_intentos=5):
+    """Como encolar(), con un solo INSERT para una tarea por cada dict de `lista_datos`"""
+    if tipo not in _manejadores:
+        raise ValueError(f'Tipo de tarea desconocido: {tipo}')
+    return Tarea.objects.bulk_create(
+        [Tarea(tipo=tipo, datos=datos, max_intentos=max_intentos) for datos in lista_datos]
+    )
+
+
+def encolar_unica(tipo, **datos):
+    """Como encolar(), pero no duplica una tarea igual que aún no ha terminado"""
+    # Las tareas abiertas de un tipo son pocas: se comparan los datos en
+    # Python en vez de depender de la igualdad JSON de cada motor
+    abiertas = Tarea.objects.filter(tipo=tipo, estado__in=('pendiente', 'en_proceso')).only('datos')
+    for tarea in abiertas:
+        if tarea.datos == datos:
+            return tarea
+    return encolar(tipo, **datos)
+
+
+def _liberar_abandonadas(ahora):
+    # Un intento que nunca terminó cuenta como fallido
+    abandonadas = Tarea.objects.filter(estado='en_proceso', tomada_en__lt=ahora - timedelta(seconds=ARRIENDO))
+    error = 'Arriendo vencido: el worker no terminó la tarea'
+    abandonadas.filter(intentos__gte=F('max_intentos') - 1).update(
+        estado='fallida', intentos=F('intentos') + 1, ultimo_error=error, fecha_fin=ahora
+    )
+    abandonadas.update(
+        estado='pendiente', tomada_por=None, tomada_en=None, intentos=F('intentos') + 1, ultimo_error=error
+    )
+
+
+def reclamar(trabajador, lote=10, tipos=None):
+    """
+    Toma hasta `lote` tareas pendientes para `trabajador` y las retorna.
+
+    Con SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL, MySQL 8) varios
+    workers leen lotes distintos sin esperarse. En SQLite, que no lo
+    tiene, los candidatos se marcan con un UPDATE condicional
+    (estado='pendiente') y cada worker se queda solo con las filas que
+    llevan su marca: si dos compiten por la misma tarea, solo uno la toma.
+    """
+    ahora = timezone.now()
+    _liberar_abandonadas(ahora)
+    marca = f'{trabajador}:{uuid.uuid4().hex[:8]}'
+    candidatas = Tarea.objects.filter(estado='pendiente', disponible_en__lte=ahora)
+    if tipos:
+        candidatas = candidatas.filter(tipo__in=tipos)
+    candidatas = candidatas.order_by('disponible_en', 'pk')
+
+    def marcar(ids):
+        return Tarea.objects.filter(pk__in=ids, estado='pendiente').update(
+            estado='en_proceso', tomada_por=marca, tomada_en=ahora
+        )
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidatas.select_for_update(skip_locked=True).values_list('pk', flat=True)[:lote])
+            if ids:
+                marcar(ids)
+    else:
+        # Sin transacción alrededor: en SQLite una lectura que luego escribe
+        # falla con "database is locked" en vez de esperar; el UPDATE
+        # condicional ya es atómico por sí solo
+        for _ in range(INTENTOS_RECLAMO):
+            ids = list(candidatas.values_list('pk', flat=True)[:lote])
+            if not ids or marcar(ids):
+                break
+    if not ids:
+        return []
+    return list(Tarea.objects.filter(tomada_por=marca, estado='en_proceso').order_by('disponible_en', 'pk'))
+
+
+def _espera_reintento(intentos):
+    espera = min(ESPERA_BASE * 2 ** (intentos - 1), ESPERA_MAXIMA)
+    return timedelta(seconds=espera * random.uniform(0.8, 1.2))
+
+
+def ejecutar(tarea):
+    """
+    Corre una tarea ya reclamada y registra el resultado: completada,
+    pendiente con espera exponencial, o fallida (cola de errores) al
+    agotar max_intentos. Retorna el resultado como texto.
+
+    Si el manejador retorna un texto, queda en Tarea.resultado.
+    """
+    inicio = time.perf_counter()
+    propia = Tarea.objects.filter(pk=tarea.pk, tomada_por=tarea.tomada_por, estado='en_proceso')
+    try:
+        funcion = _manejadores[tarea.tipo]
+        with transaction.atomic():
+            # Se marca primero y se revierte si el manejador falla: si el
+            # arriendo venció y otro worker la tomó, no se ejecuta dos veces;
+            # además la transacción escribe antes de leer, lo que en SQLite
+            # evita el "database is locked" al pasar de lectura a escritura
+            if not propia.update(estado='completada', fecha_fin=timezone.now(), ultimo_error=None):
+                return 'perdida'
+            resumen = funcion(**tarea.datos)
+            if resumen is not None:
+                Tarea.objects.filter(pk=tarea.pk).update(resultado=resumen)
+        resultado = 'completada'
+    except Exception:
+        intentos = tarea.intentos + 1
+        error = traceback.format_exc()[-LARGO_MAXIMO_ERROR:]
+        if intentos >= tarea.max_intentos:
+            propia.update(estado='fallida', intentos=intentos, ultimo_error=error, fecha_fin=timezone.now())
+            resultado = 'fallida'
+        else:
+            propia.update(
+                estado='pendiente', intentos=intentos, ultimo_error=error, tomada_por=None, tomada_en=None,
+                disponible_en=timezone.now() + _espera_reintento(intentos)
+            )
+            resultado = 'reintento'
+    duracion = time.perf_counter() - inicio
+    metricas.incrementar('tareas_procesadas_total', tipo=tarea.tipo, resultado=resultado)
+    metricas.incrementar('tareas_segundos_total', duracion, tipo=tarea.tipo)
+    return resultado
+
+
+def reintentar_fallidas(tipo=None):
+    """Devuelve a la cola las tareas de la cola de errores, con intentos en cero"""
+    fallidas = Tarea.objects.filter(estado='fallida')
+    if tipo:
+        fallidas = fallidas.filter(tipo=tipo)
+    return fallidas.update(
+        estado='pendiente', intentos=0, disponible_en=timezone.now(), tomada_por=None, tomada_en=None, fecha_fin=None
+    )
+
+
+def purgar_completadas(dias):
+    borradas, _ = Tarea.objects.filter(
+        estado='completada', fecha_fin__lt=timezone.now() - timedelta(days=dias)
+    ).delete()
+    return borradas
+
+
+def exportar_prometheus(ventana=300):
+    """
+    Estado de la cola leído de la base, para que /metrics lo muestre sin
+    importar en qué proceso corren los workers: tareas por tipo y estado, y
+    completadas por minuto en los últimos `ventana` segundos
+    """
+    por_estado = (
+        Tarea.objects.exclude(estado='completada').order_by()
+        .values_list('tipo', 'estado').annotate(total=Count('pk'))
+    )
+    recientes = (
+        Tarea.objects.filter(estado='completada', fecha_fin__gte=timezone.now() - timedelta(seconds=ventana))
+        .order_by().values_list('tipo').annotate(total=Count('pk'))
+    )
+    lineas = ['# TYPE farmacia_tareas gauge']
+    for tipo, estado, total in por_estado:
+        lineas.append(f'farmacia_tareas{{tipo="{tipo}",estado="{estado}"}} {total}')
+    lineas.append('# TYPE farmacia_tareas_completadas_por_minuto gauge')
+    for tipo, total in recientes:
+        lineas.append(f'farmacia_tareas_completadas_por_minuto{{tipo="{tipo}"}} {total * 60 / ventana:.2f}')
+    return '\n'.join(lineas) + '\n'
+
+
+# ✅ MANEJADORES
+
+def datos_reporte(pedido):
+    """Campos del reporte automático de entrega exitosa de un pedido con repartidor"""
+    ahora = timezone.now()
+    hora_actual = ahora.time()
+    return {
+        'repartidor_id': pedido.repartidor_id,
+        'fecha_reporte': ahora.date(),
+        'hora_salida': pedido.fecha_asignacion.time() if pedido.fecha_asignacion else hora_actual,
+        'hora_llegada': hora_actual,
+        'hora_entrega': hora_actual,
+        'tiempo_transito': 30,
+        'tiempo_total': pedido.tiempo_real_minutos if pedido.tiempo_real_minutos else 45,
+        'estado_entrega': 'exitosa',
+        'calificacion': 5,
+        'comentarios_cliente': 'Entrega exitosa',
+    }
+
+
+@manejador('crear_reporte')
+def crear_reporte_entrega(pedido_id):
+    """Reporte automático de un pedido entregado (idempotente)"""
+    pedido = Pedido.objects.filter(pk=pedido_id).first()
+    if pedido is None or pedido.repartidor_id is None:
+        # Pedido eliminado/archivado, o sin repartidor (REPORTE_ENTREGAS lo
+        # exige): no hay nada que reportar
+        return
+    ReporteEntregas.objects.get_or_create(pedido=pedido, defaults=datos_reporte(pedido))
+
+
+@manejador('asignar_automaticos')
+def asignar_automaticos(usuario):
+    from .asignacion import asignar_pedidos_pendientes
+    resultado = asignar_pedidos_pendientes(usuario)
+    return (
+        f'Se asignaron {resultado.asignaciones} pedidos a repartidores disponibles '
+        f'en {resultado.duracion:.2f} s'
+    )
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+from django import template
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from domicilios import metricas
+
+register = template.Library()
+
+PLANTILLA_FILA = 'pedidos/_fila_pedido.html'
+
+
+class CacheFragmentos:
+    """
+    Caché LRU en memoria del proceso para fragmentos HTML ya renderizados.
+    Las claves incluyen la versión de lo que se muestra, así que nunca hay
+    que invalidar: una entrada vieja simplemente deja de pedirse y sale por
+    el extremo menos usado.
+    """
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self.entradas = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self._candado = threading.Lock()
+
+    def obtener(self, clave):
+        with self._candado:
+            fragmento = self.entradas.get(clave)
+            if fragmento is None:
+                self.fallos += 1
+            else:
+                self.entradas.move_to_end(clave)
+                self.aciertos += 1
+        metricas.incrementar('cache_filas_pedidos_total', resultado='fallo' if fragmento is None else 'acierto')
+        return fragmento
+
+    def guardar(self, clave, fragmento):
+        with self._candado:
+            self.entradas[clave] = fragmento
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.capacidad:
+                self.entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._candado:
+            self.entradas.clear()
+            self.aciertos = self.fallos = 0
+
+
+filas_pedidos = CacheFragmentos(getattr(settings, 'CACHE_FILAS_PEDIDOS', 5000))
+
+
+def clave_fila(pedido):
+    # La versión cubre los campos del pedido; el cliente y el repartidor se
+    # leen con select_related y sus datos visibles van en la clave
+    cliente = pedido.cliente
+    repartidor = pedido.repartidor
+    return (
+        pedido.pedido_id,
+        pedido.version,
+        cliente.nombres,
+        cliente.apellidos,
+        repartidor and repartidor.repartidor_id,
+        repartidor and repartidor.nombres,
+        repartidor and repartidor.capacidad_entregas <= 0,
+        timezone.get_current_timezone_name(),
+    )
+
+
+@register.simple_tag
+def fila_pedido(pedido):
+    """Fila de lista_pedidos.html, renderizada una vez por versión del pedido"""
+    clave = clave_fila(pedido)
+    fragmento = filas_pedidos.obtener(clave)
+    if fragmento is None:
+        fragmento = render_to_string(PLANTILLA_FILA, {'pedido': pedido})
+        filas_pedidos.guardar(clave, fragmento)
+    return mark_safe(fragmento)
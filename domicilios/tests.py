@@ -1,3 +1,1223 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    agregados, archivo, busqueda, contadores, despacho, eta, eventos, exportacion, geocodificacion, metricas,
+    paginacion, tareas, transiciones,
+)
+from .asignacion import asignar_pedidos_pendientes, orden_de_atencion
+from .eventos import broker
+from .models import (
+    Cliente, Repartidor, Pedido, ReporteEntregas, HistorialEstados, DireccionGeocodificada, Tarea,
+    EventoTablero, TerminoBusqueda, VarianteBusqueda,
+)
+from .templatetags.pedidos_tags import filas_pedidos
+from .utils import obtener_repartidores_disponibles
+from .viajes import armar_viajes
+
+
+def crear_cliente(cedula='100', **campos):
+    """Cliente de prueba; `campos` reemplaza los valores por defecto"""
+    datos = {'nombres': 'Ana', 'apellidos': 'Pérez', 'telefono': '3000000000', 'direccion': 'Calle 1', 'zona': 'Norte'}
+    return Cliente.objects.create(cedula=cedula, **{**datos, **campos})
+
+
+def crear_repartidor(cedula='200', **campos):
+    datos = {'nombres': 'Luis', 'apellidos': 'Gómez', 'telefono': '3100000000', 'zona_asignada': 'Norte'}
+    return Repartidor.objects.create(cedula=cedula, **{**datos, **campos})
+
+
+def crear_pedido(cliente, **campos):
+    datos = {'direccion_entrega': 'Calle 1', 'zona_entrega': 'Norte', 'tiempo_estimado_minutos': 30}
+    return Pedido.objects.create(cliente=cliente, **{**datos, **campos})
+
+
+
+class ReportesEntregasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('operador', password='clave'))
+        self.cliente = crear_cliente()
+        self.repartidor = crear_repartidor()
+
+    def crear_entregados(self, cantidad, estado_entrega=None, calificacion=None):
+        for _ in range(cantidad):
+            pedido = crear_pedido(self.cliente, repartidor=self.repartidor, estado='entregado')
+            if estado_entrega:
+                ReporteEntregas.objects.create(
+                    pedido=pedido, repartidor=self.repartidor, fecha_reporte=timezone.now().date(),
+                    estado_entrega=estado_entrega, calificacion=calificacion
+                )
+
+    def test_estadisticas_y_pedidos_sin_reporte(self):
+        self.crear_entregados(2, 'exitosa', 5)
+        self.crear_entregados(1, 'fallida', 2)
+        self.crear_entregados(1, 'reprogramada')
+        self.crear_entregados(3)
+
+        respuesta = self.client.get(reverse('reportes_entregas'))
+
+        self.assertEqual(respuesta.context['total_entregas'], 4)
+        self.assertEqual(respuesta.context['entregas_exitosas'], 2)
+        self.assertEqual(respuesta.context['entregas_fallidas'], 1)
+        self.assertEqual(respuesta.context['entregas_reprogramadas'], 1)
+        self.assertEqual(respuesta.context['promedio_calificacion'], 4.0)
+        self.assertEqual(respuesta.context['pedidos_sin_reporte'], 3)
+        self.assertEqual(len(respuesta.context['pedidos_entregados_sin_reporte']), 3)
+
+    def test_numero_de_consultas_constante(self):
+        # sesión + usuario + estadísticas + página de reportes + página de
+        # pedidos sin reporte + conteo sin reporte (luego en caché)
+        # + user.cliente de base.html
+        self.crear_entregados(2, 'exitosa', 5)
+        self.crear_entregados(2)
+        with self.assertNumQueries(7):
+            self.client.get(reverse('reportes_entregas'))
+
+        cache.clear()
+        self.crear_entregados(20, 'fallida', 1)
+        self.crear_entregados(20)
+        with self.assertNumQueries(7):
+            self.client.get(reverse('reportes_entregas'))
+
+
+class FilasPedidosCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        filas_pedidos.limpiar()
+        self.client.force_login(User.objects.create_user('operador', password='clave'))
+        cliente = crear_cliente()
+        self.pedidos = [crear_pedido(cliente) for _ in range(3)]
+
+    def test_filas_se_reutilizan_hasta_que_cambia_la_version(self):
+        self.client.get(reverse('lista_pedidos'))
+        self.assertEqual((filas_pedidos.aciertos, filas_pedidos.fallos), (0, 3))
+
+        self.client.get(reverse('lista_pedidos'))
+        self.assertEqual((filas_pedidos.aciertos, filas_pedidos.fallos), (3, 3))
+
+        pedido = self.pedidos[0]
+        version = pedido.version
+        pedido.estado = 'cancelado'
+        pedido.save()
+        self.assertEqual(pedido.version, version + 1)
+
+        respuesta = self.client.get(reverse('lista_pedidos'))
+        self.assertEqual((filas_pedidos.aciertos, filas_pedidos.fallos), (5, 4))
+        self.assertContains(respuesta, 'Cancelado')
+
+
+class EventosPedidosTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('despachador', password='clave')
+        self.cliente = crear_cliente()
+
+    def tearDown(self):
+        # El cliente de pruebas no cierra el generador de la vista
+        for suscripcion in list(broker._suscripciones):
+            broker.cancelar(suscripcion)
+
+    def test_cambio_de_estado_publica_delta_en_su_transaccion(self):
+        pedido = crear_pedido(self.cliente)
+        ultimo = eventos.ultimo_evento()
+        self.client.force_login(self.usuario)
+        self.client.post(reverse('cambiar_estado_pedido', args=[pedido.pk]), {'estado': 'cancelado'})
+
+        (_, datos), = eventos.eventos_desde(ultimo)
+        self.assertIn('"tipo": "estado"', datos)
+        self.assertIn('"estado": "cancelado"', datos)
+
+        # Un cambio que se revierte no deja evento
+        with self.assertRaises(transiciones.TransicionInvalida):
+            transiciones.transicionar(Pedido.objects.get(pk=pedido.pk), 'entregado', 'despachador')
+        self.assertEqual(len(eventos.eventos_desde(ultimo)), 1)
+
+    @override_settings(EVENTOS_EN_VIVO=False)
+    def test_sin_asgi_el_tablero_consulta_en_vez_de_abrir_el_flujo(self):
+        self.client.force_login(self.usuario)
+        pedido = crear_pedido(self.cliente)
+        lista = self.client.get(reverse('lista_pedidos'))
+        self.assertNotContains(lista, 'new EventSource')
+        self.assertEqual(lista.context['ultimo_evento'], eventos.ultimo_evento())
+        self.assertEqual(self.client.get(reverse('eventos_pedidos')).status_code, 404)
+
+        desde = lista.context['ultimo_evento']
+        transiciones.transicionar(pedido, 'cancelado', 'despachador')
+        recientes = self.client.get(reverse('eventos_pedidos_recientes'), {'desde': desde}).json()
+        self.assertEqual(recientes['ultimo'], eventos.ultimo_evento())
+        self.assertEqual([delta['estado'] for delta in recientes['eventos']], ['cancelado'])
+        self.assertFalse(recientes['recargar'])
+        with mock.patch.object(eventos, 'EVENTOS_RECIENTES', 0):
+            recientes = self.client.get(reverse('eventos_pedidos_recientes'), {'desde': desde}).json()
+        self.assertEqual((recientes['recargar'], recientes['eventos']), (True, []))
+
+        with override_settings(EVENTOS_EN_VIVO=True):
+            self.assertContains(self.client.get(reverse('lista_pedidos')), 'new EventSource')
+
+    def test_el_worker_poda_los_eventos_viejos(self):
+        eventos.publicar_varios([{'tipo': 'viejo'}, {'tipo': 'nuevo'}])
+        viejo, nuevo = EventoTablero.objects.order_by('pk').values_list('pk', flat=True)
+        EventoTablero.objects.filter(pk=viejo).update(fecha=timezone.now() - eventos.RETENCION_EVENTOS * 2)
+        # También bajo WSGI, sin ninguna conexión SSE abierta
+        call_command('worker', '--una-vez', stdout=io.StringIO())
+        self.assertEqual(list(EventoTablero.objects.values_list('pk', flat=True)), [nuevo])
+
+    @override_settings(EVENTOS_EN_VIVO=True)
+    async def test_flujo_entrega_eventos_de_cualquier_proceso(self):
+        anonimo = await AsyncClient().get(reverse('eventos_pedidos'))
+        self.assertEqual(anonimo.status_code, 403)
+
+        cliente = AsyncClient()
+        await sync_to_async(cliente.force_login)(self.usuario)
+        # El sondeo se hace a mano en vez de en el hilo del broker
+        with mock.patch.object(eventos.threading, 'Thread'):
+            respuesta = await cliente.get(reverse('eventos_pedidos'))
+            self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+            flujo = respuesta.streaming_content
+            self.assertEqual(await anext(flujo), b'retry: 3000\n\n')
+            siguiente = asyncio.ensure_future(anext(flujo))
+            await asyncio.sleep(0)
+
+            # Lo mismo que insertaría un worker u otro servidor
+            await sync_to_async(eventos.publicar)({'tipo': 'nuevo', 'pedido_id': 7})
+            self.assertEqual(await sync_to_async(broker.sondear)(), 1)
+            identificador = await sync_to_async(eventos.ultimo_evento)()
+            self.assertEqual(
+                await siguiente,
+                f'id: {identificador}\ndata: {{"tipo": "nuevo", "pedido_id": 7}}\n\n'.encode()
+            )
+            self.assertEqual(broker.conexiones, 1)
+            await flujo.aclose()
+
+    async def test_reconexion_repone_lo_perdido(self):
+        for pedido_id in (1, 2, 3):
+            await sync_to_async(eventos.publicar)({'tipo': 'nuevo', 'pedido_id': pedido_id})
+        ultimo = await sync_to_async(eventos.ultimo_evento)()
+        with mock.patch.object(eventos.threading, 'Thread'):
+            flujo = eventos.flujo(ultimo - 2)
+            self.assertEqual(await anext(flujo), 'retry: 3000\n\n')
+            self.assertIn('"pedido_id": 2', await anext(flujo))
+            self.assertIn('"pedido_id": 3', await anext(flujo))
+            # El sondeo vuelve a traer lo repuesto: no se repite
+            await sync_to_async(broker.sondear)()
+            await sync_to_async(eventos.publicar)({'tipo': 'nuevo', 'pedido_id': 4})
+            await sync_to_async(broker.sondear)()
+            self.assertIn('"pedido_id": 4', await anext(flujo))
+            await flujo.aclose()
+
+    def test_huecos_de_transacciones_lentas(self):
+        broker._ultimo = 0
+        try:
+            eventos.publicar({'tipo': 'a'})
+            eventos.publicar({'tipo': 'b'})
+            primero, _ = EventoTablero.objects.order_by('pk').values_list('pk', 'datos')
+            EventoTablero.objects.filter(pk=primero[0]).delete()
+            broker.sondear()
+            self.assertEqual(list(broker._huecos), [primero[0]])
+            # La transacción del id saltado confirma después
+            EventoTablero.objects.create(pk=primero[0], datos=primero[1])
+            with mock.patch.object(broker, 'difundir') as difundir:
+                self.assertEqual(broker.sondear(), 1)
+            difundir.assert_called_once_with(primero)
+            self.assertEqual(broker._huecos, {})
+        finally:
+            broker._ultimo = None
+            broker._huecos = {}
+
+
+class AsignacionPorViajesTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('despachador', password='clave'))
+        self.cliente = crear_cliente()
+
+    def test_viajes_agrupan_por_cercania_y_respetan_capacidad(self):
+        grande = crear_repartidor('200', capacidad_entregas=3)
+        pequeno = crear_repartidor('201', capacidad_entregas=2)
+        for direccion in ('Carrera 10 # 1-5', 'Carrera 10 # 2-8', 'Carrera 10 # 3-1', 'Calle 80 # 40-2', 'Calle 80 # 41-9'):
+            crear_pedido(self.cliente, direccion_entrega=direccion)
+
+        self.client.post(reverse('asignar_automaticos'))
+        self.client.post(reverse('asignar_automaticos'))
+        self.assertEqual(Tarea.objects.filter(tipo='asignar_automaticos').count(), 1)
+        call_command('worker', '--una-vez', stdout=io.StringIO())
+
+        self.assertEqual(
+            set(Pedido.objects.filter(repartidor=grande).values_list('direccion_entrega', flat=True)),
+            {'Carrera 10 # 1-5', 'Carrera 10 # 2-8', 'Carrera 10 # 3-1'}
+        )
+        self.assertEqual(Pedido.objects.filter(repartidor=pequeno, estado='asignado').count(), 2)
+        self.assertFalse(Repartidor.objects.filter(capacidad_entregas__gt=0).exists())
+        self.assertEqual(HistorialEstados.objects.filter(estado_nuevo='asignado').count(), 5)
+
+    def test_despachador_atiende_urgentes_y_adapta_el_lote(self):
+        crear_repartidor(capacidad_entregas=2)
+        # Sur no tiene capacidad propia ni vecina: no debe tapar la cola
+        for _ in range(3):
+            crear_pedido(self.cliente, direccion_entrega='Calle 5', zona_entrega='Sur')
+        for prioridad in ('normal', 'normal', 'urgente'):
+            crear_pedido(self.cliente, direccion_entrega='Calle 9', prioridad=prioridad)
+        despachador = despacho.Despachador('despacho', lote_minimo=2, lote_maximo=8, espera_minima=1)
+
+        self.assertEqual(despachador.ciclo(), 0)
+        self.assertEqual(despachador.lote, 4)
+        asignados = Pedido.objects.filter(estado='asignado')
+        self.assertEqual(sorted(asignados.values_list('prioridad', flat=True)), ['normal', 'urgente'])
+        self.assertEqual(len(despachador.retrasos), 2)
+
+        # Sin capacidad: el lote vuelve a achicarse y la espera crece
+        self.assertEqual(despachador.ciclo(), 1)
+        self.assertEqual(despachador.ciclo(), 2)
+        self.assertEqual(despachador.lote, 2)
+        self.assertEqual(Pedido.objects.filter(estado='pendiente').count(), 4)
+
+
+    def test_sobrantes_van_a_zonas_vecinas_en_orden_de_atencion(self):
+        ahora = timezone.now()
+        pedidos = [
+            SimpleNamespace(pedido_id=i, zona_entrega=zona, prioridad=prioridad, direccion_entrega=f'Calle {i}',
+                            fecha_pedido=ahora - timedelta(minutes=minutos))
+            for i, (zona, prioridad, minutos) in enumerate([
+                ('Norte', 'urgente', 10), ('Norte', 'normal', 50), ('Sur', 'urgente', 5), ('Sur', 'alta', 30),
+            ])
+        ]
+        repartidores = [
+            SimpleNamespace(repartidor_id=i, zona_asignada=zona, capacidad_entregas=1, disponible=True)
+            for i, zona in enumerate(['Norte', 'Sur', 'Centro'])
+        ]
+        viajes = dict(
+            (repartidor.zona_asignada, [pedido.pedido_id for pedido in pedidos_viaje])
+            for repartidor, pedidos_viaje in armar_viajes(pedidos, repartidores, orden=orden_de_atencion)
+        )
+        # Sobran el normal de Norte y el alta de Sur: aunque Norte se empaca
+        # primero, el alta se lleva el cupo de Centro
+        self.assertEqual(viajes, {'Norte': [0], 'Sur': [2], 'Centro': [3]})
+
+
+class RepartidoresCercanosTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('despachador', password='clave'))
+        archivo = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        archivo.write('direccion,latitud,longitud\nCarrera 10 # 5,4.6000,-74.0800\n')
+        archivo.close()
+        self.addCleanup(os.unlink, archivo.name)
+        parches = [
+            mock.patch.object(geocodificacion, 'nomenclator', geocodificacion.Nomenclator(archivo.name)),
+            mock.patch.object(geocodificacion, '_indice_cargado_en', None),
+        ]
+        for parche in parches:
+            parche.start()
+            self.addCleanup(parche.stop)
+        geocodificacion._memoria.clear()
+
+    def test_asignacion_sugiere_los_mas_cercanos(self):
+        cliente = crear_cliente()
+        pedido = crear_pedido(cliente, direccion_entrega='Cra. 10 No 5-20')
+        ubicaciones = {'201': (4.70, -74.08), '202': (4.601, -74.081), '203': (4.62, -74.07)}
+        for cedula, (latitud, longitud) in ubicaciones.items():
+            repartidor = crear_repartidor(cedula, nombres=f'R{cedula}')
+            self.client.post(
+                reverse('ubicacion_repartidor', args=[repartidor.pk]),
+                {'latitud': latitud, 'longitud': longitud}
+            )
+
+        respuesta = self.client.get(reverse('asignar_repartidor', args=[pedido.pk]))
+
+        cercanos = respuesta.context['repartidores_cercanos']
+        self.assertEqual([repartidor.cedula for repartidor, _ in cercanos], ['202', '203', '201'])
+        self.assertLess(cercanos[0][1], 0.2)
+        self.assertTrue(DireccionGeocodificada.objects.filter(direccion='carrera 10 # 5-20').exists())
+
+
+class BusquedaIndexadaTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('operador', password='clave', is_staff=True, is_superuser=True))
+        for cedula, nombres, apellidos in (
+            ('100', 'José', 'Rodríguez Núñez'), ('101', 'Ana María', 'Pérez'), ('102', 'Anabel', 'Suárez'),
+        ):
+            crear_cliente(cedula, nombres=nombres, apellidos=apellidos, telefono=f'300-555-{cedula}')
+
+    def buscar(self, q):
+        respuesta = self.client.get(reverse('autocompletar_clientes'), {'q': q})
+        return [resultado['texto'].split(' - ')[0] for resultado in respuesta.json()['resultados']]
+
+    def test_prefijos_sin_tildes_digitos_y_errores_de_tipeo(self):
+        self.assertEqual(self.buscar('ana'), ['Ana María Pérez', 'Anabel Suárez'])
+        self.assertEqual(self.buscar('maria per'), ['Ana María Pérez'])
+        self.assertEqual(self.buscar('nunez'), ['José Rodríguez Núñez'])
+        self.assertEqual(self.buscar('300555101'), ['Ana María Pérez'])
+        self.assertEqual(self.buscar('rodrigez'), ['José Rodríguez Núñez'])
+
+    def test_indice_sigue_cambios_y_admin_lo_usa(self):
+        cliente = Cliente.objects.get(cedula='102')
+        cliente.apellidos = 'Quintero'
+        cliente.save()
+        self.assertEqual(self.buscar('quin'), ['Anabel Quintero'])
+        self.assertEqual(self.buscar('suarez'), [])
+
+        respuesta = self.client.get(reverse('admin:domicilios_cliente_changelist'), {'q': 'jose rodr'})
+        self.assertEqual([c.cedula for c in respuesta.context['cl'].result_list], ['100'])
+
+    def test_aproximada_por_variantes_tambien_en_la_primera_letra(self):
+        self.assertEqual(self.buscar('xodriguez'), ['José Rodríguez Núñez'])
+        self.assertEqual(self.buscar('nuenz'), ['José Rodríguez Núñez'])
+        self.assertEqual(self.buscar('xodriguezzz'), [])
+
+    def test_varias_palabras_se_intersectan_sin_cortar_candidatos(self):
+        for cedula in range(110, 115):
+            crear_cliente(str(cedula), nombres='Beto', apellidos='Pérez')
+        ultima = crear_cliente('120', nombres='Zoe', apellidos='Pérez')
+        with mock.patch.object(busqueda, 'FILAS_POR_CONSULTA', 2):
+            self.assertEqual(busqueda.buscar_ids(Cliente, 'perez zoe'), [ultima.pk])
+            self.assertEqual(len(busqueda.buscar_ids(Cliente, 'perez', limite=20)), 7)
+            self.assertEqual(len(busqueda.buscar_ids(Cliente, 'an', limite=20)), 2)
+
+    def test_reindexar_es_atomico(self):
+        antes = (TerminoBusqueda.objects.count(), VarianteBusqueda.objects.count())
+        indexar = busqueda.indexar
+        llamadas = []
+
+        def falla_en_el_segundo_lote(*args):
+            llamadas.append(1)
+            if len(llamadas) == 2:
+                raise OperationalError('conexión perdida')
+            return indexar(*args)
+
+        with mock.patch.object(busqueda, 'indexar', falla_en_el_segundo_lote), self.assertRaises(OperationalError):
+            busqueda.reindexar(Cliente, lote=1)
+        self.assertEqual((TerminoBusqueda.objects.count(), VarianteBusqueda.objects.count()), antes)
+
+        VarianteBusqueda.objects.all().delete()
+        busqueda.reindexar(Cliente)
+        self.assertEqual(self.buscar('rodrigez'), ['José Rodríguez Núñez'])
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('admin', password='clave'))
+        self.cliente = crear_cliente()
+        self.repartidor = crear_repartidor()
+
+    def crear_pedidos(self, cantidad):
+        for _ in range(cantidad):
+            pedido = crear_pedido(self.cliente, repartidor=self.repartidor, estado='entregado')
+            HistorialEstados.objects.create(pedido=pedido, estado_nuevo='entregado', usuario='admin')
+            ReporteEntregas.objects.create(
+                pedido=pedido, repartidor=self.repartidor, fecha_reporte=timezone.now().date(),
+                estado_entrega='exitosa'
+            )
+
+    def consultas_changelist(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas)
+
+    def test_consultas_constantes_sin_importar_las_filas(self):
+        urls = [
+            reverse(f'admin:domicilios_{modelo}_changelist')
+            for modelo in ('pedido', 'historialestados', 'reporteentregas')
+        ]
+        self.crear_pedidos(2)
+        pocas = [self.consultas_changelist(url) for url in urls]
+        self.crear_pedidos(20)
+        self.assertEqual([self.consultas_changelist(url) for url in urls], pocas)
+
+
+class ColaTareasTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('despachador', password='clave'))
+        cliente = crear_cliente()
+        repartidor = crear_repartidor()
+        self.pedido = crear_pedido(cliente, repartidor=repartidor, estado='en_camino')
+
+    def test_reporte_de_entrega_sale_del_request(self):
+        self.client.post(reverse('cambiar_estado_pedido', args=[self.pedido.pk]), {'estado': 'entregado'})
+        self.assertFalse(ReporteEntregas.objects.exists())
+
+        tomadas = tareas.reclamar('prueba', lote=5)
+        self.assertEqual([tarea.tipo for tarea in tomadas], ['crear_reporte'])
+        self.assertEqual(tareas.reclamar('otro', lote=5), [])
+        self.assertEqual(tareas.ejecutar(tomadas[0]), 'completada')
+        self.assertTrue(ReporteEntregas.objects.filter(pedido=self.pedido).exists())
+
+    def test_reintentos_y_cola_de_errores(self):
+        llamadas = []
+
+        @tareas.manejador('prueba_falla')
+        def falla(**datos):
+            llamadas.append(datos)
+            raise RuntimeError('sin conexión')
+        self.addCleanup(tareas._manejadores.pop, 'prueba_falla')
+
+        tarea = tareas.encolar('prueba_falla', max_intentos=2, lote=7)
+        self.assertEqual(tareas.ejecutar(tareas.reclamar('prueba')[0]), 'reintento')
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), ('pendiente', 1))
+        self.assertEqual(tareas.reclamar('prueba'), [])  # aún en espera exponencial
+
+        Tarea.objects.filter(pk=tarea.pk).update(disponible_en=timezone.now())
+        self.assertEqual(tareas.ejecutar(tareas.reclamar('prueba')[0]), 'fallida')
+        tarea.refresh_from_db()
+        self.assertEqual(tarea.estado, 'fallida')
+        self.assertIn('sin conexión', tarea.ultimo_error)
+        self.assertEqual(llamadas, [{'lote': 7}, {'lote': 7}])
+
+    def test_resultado_de_la_asignacion_automatica_llega_al_usuario(self):
+        crear_repartidor('201', capacidad_entregas=1)
+        crear_pedido(self.pedido.cliente)
+
+        def mensajes():
+            return [str(mensaje) for mensaje in self.client.get(reverse('lista_pedidos')).context['messages']]
+        self.client.post(reverse('asignar_automaticos'))
+        self.assertEqual(len(mensajes()), 1)  # solo el aviso de que quedó en cola
+        self.assertEqual(mensajes(), [])
+
+        call_command('worker', '--una-vez', stdout=io.StringIO())
+        tarea = Tarea.objects.get(tipo='asignar_automaticos')
+        self.assertRegex(tarea.resultado, r'^Se asignaron 1 pedidos a repartidores disponibles en [\d.]+ s$')
+        self.assertEqual(mensajes(), [f'✅ {tarea.resultado}'])
+        self.assertEqual(mensajes(), [])
+
+
+class CambioEstadoLoteTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('despachador', password='clave'))
+        self.cliente = crear_cliente()
+        self.repartidor = crear_repartidor()
+
+    def crear(self, cantidad, estado, repartidor=True):
+        return [
+            crear_pedido(self.cliente, repartidor=self.repartidor if repartidor else None, estado=estado).pk
+            for _ in range(cantidad)
+        ]
+
+    def cambiar(self, pedido_ids, estado):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.post(
+                reverse('cambiar_estado_lote'), {'pedidos': pedido_ids, 'estado': estado},
+                HTTP_ACCEPT='application/json'
+            )
+        return respuesta.json()['resultados'], len(consultas)
+
+    def test_resultado_por_pedido_y_consultas_constantes(self):
+        en_camino = self.crear(2, 'en_camino')
+        sin_repartidor, = self.crear(1, 'pendiente', repartidor=False)
+        cancelado, = self.crear(1, 'cancelado')
+
+        resultados, _ = self.cambiar([*en_camino, sin_repartidor, cancelado, 999], 'entregado')
+
+        self.assertEqual([resultado['ok'] for resultado in resultados], [True, True, False, False, False])
+        self.assertEqual(resultados[2]['error'], 'no puede pasar de Pendiente a Entregado')
+        self.assertEqual(resultados[4]['error'], 'no existe')
+        self.assertEqual(
+            set(Pedido.objects.filter(pk__in=en_camino).values_list('estado', 'version')), {('entregado', 2)}
+        )
+        self.assertEqual(HistorialEstados.objects.filter(estado_nuevo='entregado').count(), 2)
+        # Los reportes los crea el worker, igual que en el cambio individual
+        for tarea in tareas.reclamar('prueba', tipos=['crear_reporte']):
+            tareas.ejecutar(tarea)
+        self.assertEqual(ReporteEntregas.objects.filter(pedido__in=en_camino).count(), 2)
+
+        # Con los contadores ya creados, 2 o 30 pedidos cuestan lo mismo
+        _, consultas_pocos = self.cambiar(self.crear(2, 'en_camino'), 'entregado')
+        _, consultas_muchos = self.cambiar(self.crear(30, 'en_camino'), 'entregado')
+        self.assertEqual(consultas_muchos, consultas_pocos)
+
+    def test_lote_condicional_no_pisa_cambios_concurrentes(self):
+        asignados = self.crear(3, 'asignado')
+        actualizar = transiciones._actualizar
+
+        def otro_usuario_cancela(pedidos, *args):
+            # Entre la lectura y el UPDATE otro usuario cancela el segundo pedido
+            Pedido.objects.filter(pk=asignados[1]).update(estado='cancelado')
+            return actualizar(pedidos, *args)
+
+        with mock.patch.object(transiciones, '_actualizar', side_effect=otro_usuario_cancela):
+            resultados = transiciones.cambiar_estados(asignados, 'en_camino', 'despachador')
+
+        self.assertEqual([resultado['ok'] for resultado in resultados], [True, False, True])
+        self.assertEqual(
+            list(Pedido.objects.filter(pk__in=asignados).order_by('pk').values_list('estado', flat=True)),
+            ['en_camino', 'cancelado', 'en_camino']
+        )
+        self.assertEqual(HistorialEstados.objects.filter(pedido_id__in=asignados).count(), 2)
+
+    def test_transicion_condicional_no_pisa_cambios_concurrentes(self):
+        pedido_id, = self.crear(1, 'asignado')
+        pedido = Pedido.objects.get(pk=pedido_id)
+        # Otro usuario edita las observaciones y otro lo pone en camino
+        Pedido.objects.filter(pk=pedido_id).update(observaciones='Timbre dañado')
+        vigente = Pedido.objects.get(pk=pedido_id)
+        transiciones.transicionar(vigente, 'en_camino', 'otro')
+
+        with self.assertRaises(transiciones.TransicionInvalida):
+            transiciones.transicionar(pedido, 'cancelado', 'despachador')
+        transiciones.transicionar(vigente, 'entregado', 'otro')
+
+        pedido.refresh_from_db()
+        self.assertEqual((pedido.estado, pedido.observaciones, pedido.version), ('entregado', 'Timbre dañado', 3))
+        self.assertIsNotNone(pedido.fecha_entrega_real)
+        self.assertEqual(
+            list(HistorialEstados.objects.filter(pedido_id=pedido_id).values_list('estado_nuevo', flat=True)),
+            ['en_camino', 'entregado']
+        )
+        respuesta = self.client.post(reverse('cambiar_estado_pedido', args=[pedido_id]), {'estado': 'pendiente'})
+        self.assertRedirects(respuesta, reverse('cambiar_estado_pedido', args=[pedido_id]))
+
+
+class ReconciliarCapacidadTests(TestCase):
+    def setUp(self):
+        self.cliente = crear_cliente()
+
+    def crear(self, cedula, maxima, libre, disponible, abiertos, entregados=0):
+        repartidor = crear_repartidor(
+            cedula, capacidad_maxima=maxima, capacidad_entregas=libre, disponible=disponible
+        )
+        for estado in ['asignado'] * abiertos + ['entregado'] * entregados:
+            crear_pedido(self.cliente, repartidor=repartidor, estado=estado)
+        return repartidor
+
+    def test_corrige_la_deriva_y_respeta_los_apagados_a_mano(self):
+        lleno_por_entregas = self.crear('200', maxima=3, libre=0, disponible=False, abiertos=1, entregados=4)
+        self.crear('201', maxima=2, libre=2, disponible=True, abiertos=2)  # sobrecargado
+        self.crear('202', maxima=3, libre=3, disponible=False, abiertos=0)  # apagado a mano
+
+        salida = io.StringIO()
+        call_command('reconciliar_capacidad', '--simular', stdout=salida)
+        self.assertIn('3 repartidores revisados', salida.getvalue())
+        self.assertIn('2 con deriva', salida.getvalue())
+        self.assertFalse(Repartidor.objects.get(pk=lleno_por_entregas.pk).disponible)
+
+        call_command('reconciliar_capacidad', stdout=io.StringIO())
+        self.assertEqual(
+            list(Repartidor.objects.order_by('pk').values_list('capacidad_entregas', 'disponible')),
+            [(2, True), (0, False), (3, False)]
+        )
+
+        # Entregar libera la capacidad sin esperar a la reconciliación
+        pedido = Pedido.objects.get(repartidor=lleno_por_entregas, estado='asignado')
+        transiciones.transicionar(pedido, 'entregado', 'operador')
+        self.assertEqual(Repartidor.objects.get(pk=lleno_por_entregas.pk).capacidad_entregas, 3)
+
+
+class ReservaCapacidadTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('despachador', password='clave'))
+        self.cliente = crear_cliente()
+        self.luis = crear_repartidor('200', capacidad_maxima=2, capacidad_entregas=2)
+        self.pedro = crear_repartidor('201', nombres='Pedro', capacidad_maxima=1, capacidad_entregas=1)
+
+    def libres(self):
+        return list(Repartidor.objects.order_by('pk').values_list('capacidad_entregas', 'disponible'))
+
+    def test_asignar_y_reasignar_mueven_la_capacidad(self):
+        pedido = crear_pedido(self.cliente)
+        self.client.post(reverse('asignar_repartidor', args=[pedido.pk]), {'repartidor_id': self.luis.pk})
+        self.assertEqual(self.libres(), [(1, True), (1, True)])
+
+        self.client.post(reverse('reasignar_repartidor', args=[pedido.pk]), {'repartidor_id': self.pedro.pk})
+        pedido.refresh_from_db()
+        self.assertEqual(pedido.repartidor_id, self.pedro.pk)
+        self.assertEqual(self.libres(), [(2, True), (0, False)])
+
+        # Pedro ya no tiene capacidad: no se mueve nada
+        otro = crear_pedido(self.cliente)
+        self.client.post(reverse('asignar_repartidor', args=[otro.pk]), {'repartidor_id': self.luis.pk})
+        with self.assertRaises(transiciones.TransicionInvalida):
+            transiciones.reasignar(Pedido.objects.get(pk=otro.pk), self.pedro.pk)
+        self.assertEqual(Pedido.objects.get(pk=otro.pk).repartidor_id, self.luis.pk)
+        self.assertEqual(self.libres(), [(1, True), (0, False)])
+
+    def test_reasignar_no_pisa_cambios_concurrentes(self):
+        pedido = crear_pedido(self.cliente, repartidor=self.luis, estado='asignado')
+        leido = Pedido.objects.get(pk=pedido.pk)
+        # Mientras tanto otro usuario lo entrega
+        transiciones.transicionar(Pedido.objects.get(pk=pedido.pk), 'entregado', 'otro')
+
+        with self.assertRaises(transiciones.TransicionInvalida):
+            transiciones.reasignar(leido, self.pedro.pk)
+        respuesta = self.client.post(reverse('reasignar_repartidor', args=[pedido.pk]), {'repartidor_id': self.pedro.pk})
+        self.assertRedirects(respuesta, reverse('reasignar_repartidor', args=[pedido.pk]))
+        pedido.refresh_from_db()
+        self.assertEqual((pedido.estado, pedido.repartidor_id), ('entregado', self.luis.pk))
+        self.assertEqual(self.libres(), [(2, True), (1, True)])
+
+    def editar(self, pedido, **campos):
+        datos = {
+            'cliente': self.cliente.pk, 'repartidor': '', 'direccion_entrega': 'Calle 1', 'zona_entrega': 'Norte',
+            'prioridad': 'normal', 'tiempo_estimado_minutos': 30, 'observaciones': '', 'estado': pedido.estado,
+        }
+        return self.client.post(reverse('editar_pedido', args=[pedido.pk]), {**datos, **campos})
+
+    def test_formulario_de_edicion_reserva_y_libera(self):
+        pedido = crear_pedido(self.cliente)
+        self.editar(pedido, repartidor=self.luis.pk, estado='asignado')
+        pedido.refresh_from_db()
+        self.assertEqual((pedido.estado, pedido.repartidor_id), ('asignado', self.luis.pk))
+        self.assertEqual(self.libres(), [(1, True), (1, True)])
+
+        # Cambiar de repartidor en el formulario mueve la capacidad
+        self.editar(pedido, repartidor=self.pedro.pk, observaciones='Portería')
+        pedido.refresh_from_db()
+        self.assertEqual((pedido.repartidor_id, pedido.observaciones), (self.pedro.pk, 'Portería'))
+        self.assertEqual(self.libres(), [(2, True), (0, False)])
+
+        # Sin capacidad no se guarda nada del formulario
+        otro = crear_pedido(self.cliente)
+        self.editar(otro, repartidor=self.pedro.pk, estado='asignado', observaciones='Urgente')
+        otro.refresh_from_db()
+        self.assertEqual((otro.estado, otro.repartidor_id, otro.observaciones), ('pendiente', None, None))
+
+        self.editar(pedido, repartidor=self.pedro.pk, estado='cancelado')
+        self.assertEqual(self.libres(), [(2, True), (1, True)])
+
+    def test_crear_y_cambiar_en_lote_reservan_la_capacidad(self):
+        datos = {'cliente': self.cliente.pk, 'direccion_entrega': 'Calle 1', 'zona_entrega': 'Norte',
+                 'tiempo_estimado_minutos': 30}
+        self.client.post(reverse('crear_pedido'), {**datos, 'repartidor': self.pedro.pk, 'estado': 'asignado'})
+        self.client.post(reverse('crear_pedido'), {**datos, 'repartidor': self.pedro.pk, 'estado': 'asignado'})
+        self.assertEqual(Pedido.objects.filter(repartidor=self.pedro).count(), 1)
+        self.assertEqual(self.libres(), [(2, True), (0, False)])
+
+        # Pendientes con repartidor ya elegido: Luis solo tiene capacidad para dos
+        preasignados = [crear_pedido(self.cliente, repartidor=self.luis).pk for _ in range(3)]
+        resultados = transiciones.cambiar_estados(preasignados, 'asignado', 'despachador')
+        self.assertEqual([resultado['ok'] for resultado in resultados], [True, True, False])
+        self.assertEqual(resultados[2]['error'], 'su repartidor ya no tiene capacidad disponible')
+        self.assertEqual(self.libres(), [(0, False), (0, False)])
+
+    def test_liberar_respeta_al_repartidor_apagado_a_mano(self):
+        pedido = crear_pedido(self.cliente)
+        transiciones.transicionar(pedido, 'asignado', 'despachador', repartidor_id=self.pedro.pk)
+        self.assertEqual(self.libres()[1], (0, False))
+        transiciones.transicionar(pedido, 'cancelado', 'despachador')
+        # Estaba fuera por verse lleno: vuelve a estar disponible
+        self.assertEqual(self.libres()[1], (1, True))
+
+        otro = crear_pedido(self.cliente)
+        transiciones.transicionar(otro, 'asignado', 'despachador', repartidor_id=self.luis.pk)
+        Repartidor.objects.filter(pk=self.luis.pk).update(disponible=False)
+        transiciones.transicionar(otro, 'cancelado', 'despachador')
+        self.assertEqual(self.libres()[0], (2, False))
+
+    def test_eliminar_un_pedido_abierto_libera_la_capacidad(self):
+        pedido = crear_pedido(self.cliente)
+        transiciones.transicionar(pedido, 'asignado', 'despachador', repartidor_id=self.pedro.pk)
+        self.client.post(reverse('eliminar_pedido', args=[pedido.pk]))
+        self.assertFalse(Pedido.objects.filter(pk=pedido.pk).exists())
+        self.assertEqual(self.libres(), [(2, True), (1, True)])
+
+        # Uno ya entregado no devuelve nada
+        Repartidor.objects.filter(pk=self.luis.pk).update(capacidad_entregas=1)
+        crear_pedido(self.cliente, repartidor=self.luis, estado='entregado').delete()
+        self.assertEqual(self.libres(), [(1, True), (1, True)])
+
+
+class ExportacionTests(TestCase):
+    def setUp(self):
+        cliente = crear_cliente()
+        self.pedidos = [crear_pedido(cliente, zona_entrega=zona).pk for zona in ('Norte', 'Sur', 'Norte', 'Norte', 'Norte')]
+
+    def exportar(self, **parametros):
+        return self.client.get(reverse('exportar_pedidos'), parametros)
+
+    def test_solo_personal_administrativo(self):
+        self.client.force_login(User.objects.create_user('operador', password='clave'))
+        respuesta = self.exportar()
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertTrue(respuesta.url.startswith('/login/'))
+
+    def test_transmite_por_bloques_con_filtros(self):
+        self.client.force_login(User.objects.create_user('admin', password='clave', is_staff=True))
+        # Paginación por llave (la que usa MySQL) con bloques de 2 filas
+        with mock.patch.object(exportacion, 'TAMANO_BLOQUE', 2), \
+                mock.patch.object(exportacion, 'FILAS_POR_ESCRITURA', 2), \
+                mock.patch.object(exportacion.connection, 'vendor', 'mysql'):
+            respuesta = self.exportar(zona='Norte')
+            partes = [parte.decode() for parte in respuesta.streaming_content]
+
+        self.assertTrue(respuesta.streaming)
+        self.assertIn('attachment; filename="pedidos_', respuesta['Content-Disposition'])
+        # Encabezado y dos escrituras de dos filas
+        self.assertEqual(len(partes), 3)
+        filas = ''.join(partes).splitlines()
+        self.assertEqual(filas[0].split(',')[:3], ['pedido_id', 'fecha_pedido', 'estado'])
+        norte = [pk for pk, zona in zip(self.pedidos, 'NSNNN') if zona == 'N']
+        self.assertEqual([int(fila.split(',')[0]) for fila in filas[1:]], norte)
+
+        self.assertEqual(self.exportar(formato='xml').status_code, 400)
+        self.assertEqual(self.exportar(desde='ayer').status_code, 400)
+
+
+class ImportarCsvTests(TestCase):
+    def importar(self, modelo, contenido):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as archivo:
+            archivo.write(contenido)
+        self.addCleanup(os.unlink, archivo.name)
+        errores = io.StringIO()
+        call_command('importar_csv', modelo, archivo.name, stdout=io.StringIO(), stderr=errores)
+        return errores.getvalue()
+
+    def test_repartidores_con_capacidad_y_booleanos_explicitos(self):
+        errores = self.importar('repartidores', (
+            'cedula,nombres,apellidos,telefono,zona_asignada,capacidad_maxima,disponible,activo\n'
+            '201,Luis,Gómez,3100000000,Norte,3,no,Sí\n'
+            '202,Pedro,Díaz,3100000001,Sur,,false,1\n'
+            '203,Juan,Ruiz,3100000002,Sur,2,quizás,1\n'
+        ))
+        self.assertIn('Línea 4: disponible: valor inválido quizás', errores)
+        self.assertEqual(
+            list(Repartidor.objects.order_by('cedula').values_list(
+                'cedula', 'capacidad_maxima', 'capacidad_entregas', 'disponible', 'activo'
+            )),
+            [('201', 3, 3, False, True), ('202', 5, 5, False, True)]
+        )
+        self.assertEqual(busqueda.buscar_ids(Repartidor, 'gomez'), [Repartidor.objects.get(cedula='201').pk])
+
+    def test_pedidos_asignados_reservan_capacidad_e_historial(self):
+        crear_cliente()
+        luis = crear_repartidor(capacidad_maxima=2, capacidad_entregas=2)
+        # Como en MySQL, sin ids devueltos por bulk_create
+        with mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock,
+            return_value=False
+        ):
+            errores = self.importar('pedidos', (
+                'cliente_cedula,repartidor_cedula,direccion_entrega,zona_entrega,estado,tiempo_estimado_minutos\n'
+                '100,200,Calle 1,Norte,asignado,30\n'
+                '100,200,Calle 2,Norte,en_camino,30\n'
+                '100,200,Calle 3,Norte,asignado,30\n'
+                '100,,Calle 4,Norte,asignado,30\n'
+                '100,,Calle 5,Norte,pendiente,30\n'
+            ))
+        self.assertIn('Línea 5: repartidor: obligatorio para un pedido asignado', errores)
+        self.assertIn(f'Línea 4: repartidor: {luis.pk} no tiene capacidad disponible', errores)
+        self.assertEqual(
+            list(Pedido.objects.order_by('pk').values_list('direccion_entrega', 'estado')),
+            [('Calle 1', 'asignado'), ('Calle 2', 'en_camino'), ('Calle 5', 'pendiente')]
+        )
+        luis.refresh_from_db()
+        self.assertEqual((luis.capacidad_entregas, luis.disponible), (0, False))
+        self.assertEqual(
+            sorted(HistorialEstados.objects.values_list('pedido__direccion_entrega', 'estado_nuevo', 'usuario')),
+            [('Calle 1', 'asignado', 'importar_csv'), ('Calle 2', 'en_camino', 'importar_csv'),
+             ('Calle 5', 'pendiente', 'importar_csv')]
+        )
+        self.assertEqual(contadores.totales('estado'), {'asignado': 1, 'en_camino': 1, 'pendiente': 1})
+
+
+class MetricasMiddlewareTests(TestCase):
+    def setUp(self):
+        metricas.reiniciar()
+        self.addCleanup(metricas.reiniciar)
+        self.usuario = User.objects.create_user('admin', password='clave', is_staff=True)
+
+    def consultas(self, vista, metrica='consultas'):
+        texto = metricas.exportar_prometheus()
+        linea = next(linea for linea in texto.splitlines() if linea.startswith(f'farmacia_{metrica}_sum{{vista="{vista}"}}'))
+        return float(linea.split()[-1])
+
+    def test_mide_vistas_sincronas(self):
+        self.client.force_login(self.usuario)
+        crear_cliente()
+        self.client.get(reverse('lista_clientes'))
+        self.assertGreater(self.consultas('lista_clientes'), 0)
+        self.assertGreater(self.consultas('lista_clientes', 'render_segundos'), 0)
+        respuesta = self.client.get(reverse('metricas'))
+        self.assertIn('farmacia_peticion_segundos_count{vista="lista_clientes"} 1', respuesta.content.decode())
+
+    async def test_mide_consultas_de_hilos_de_vistas_asincronas(self):
+        cliente = AsyncClient()
+        await sync_to_async(cliente.force_login)(self.usuario)
+        await cliente.get(reverse('index'))
+        # Sesión y usuario, más los agregados que corren en hilos del pool
+        self.assertGreaterEqual(await sync_to_async(self.consultas)('index'), 6)
+
+
+class AgregadosConcurrentesTests(TestCase):
+    async def test_la_base_corta_el_agregado_que_vence(self):
+        errores = []
+
+        def sin_fin():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n')
+                    return cursor.fetchone()[0]
+            except OperationalError as e:
+                errores.append(str(e))
+                raise
+
+        valores, obsoletos = await agregados.calcular_concurrentes(
+            {'sin_fin': (sin_fin, -1), 'rapido': (lambda: 7, 0)}, limite=0.2
+        )
+        self.assertEqual((valores, obsoletos), ({'sin_fin': -1, 'rapido': 7}, ['sin_fin']))
+        # La consulta no sigue ocupando su hilo y su conexión
+        for _ in range(50):
+            if errores:
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(errores, ['interrupted'])
+
+    async def test_error_de_la_base_sirve_el_ultimo_valor(self):
+        await agregados.calcular_concurrentes({'prueba_errores': (lambda: 12, 0)})
+
+        def interrumpido():
+            raise OperationalError('interrupted')
+        valores, obsoletos = await agregados.calcular_concurrentes(
+            {'prueba_errores': (interrumpido, 0), 'sin_respaldo': (interrumpido, -1)}
+        )
+        self.assertEqual(valores, {'prueba_errores': 12, 'sin_respaldo': -1})
+        self.assertEqual(obsoletos, ['prueba_errores', 'sin_respaldo'])
+
+
+class EstimacionETATests(TestCase):
+    def setUp(self):
+        self.tabla = eta.TablaETA()
+        self.cliente = crear_cliente()
+        self.hora = eta._hora()
+
+    def test_las_entregas_se_mezclan_con_el_nivel_superior(self):
+        self.assertEqual(self.tabla.estimar('Norte', 'normal', self.hora), 30)
+        self.assertEqual(self.tabla.estimar('Norte', 'alta', self.hora), 24)
+        for _ in range(eta.PESO_PREVIO):
+            crear_pedido(self.cliente, estado='entregado', tiempo_real_minutos=50)
+        self.tabla.cargar()
+        # Zona y prioridad: (10 × 50 + 10 × 30) / 20 = 40; la hora se acerca
+        # a ese valor con el mismo peso
+        self.assertEqual(self.tabla.estimar('Norte', 'normal', self.hora), 45)
+        self.assertEqual(self.tabla.estimar('Norte', 'normal', (self.hora + 1) % 24), 40)
+        self.assertEqual(self.tabla.estimar('Sur', 'normal', self.hora), 45)
+
+    def test_tabla_vencida_se_recarga_sin_esperar(self):
+        self.tabla.estimar('Norte', 'normal', self.hora)
+        self.tabla.registrar('Norte', 'normal', self.hora, 130)
+        self.tabla._cargada_en -= eta.TIEMPO_RECARGA + 1
+        with mock.patch.object(eta.threading, 'Thread') as hilo, self.assertNumQueries(0):
+            # Se sigue sirviendo la tabla anterior y una sola recarga queda en curso
+            self.assertEqual(self.tabla.estimar('Norte', 'normal', self.hora), 47)
+            self.assertEqual(self.tabla.estimar('Norte', 'normal', self.hora), 47)
+        hilo.assert_called_once_with(target=self.tabla._recargar, name='recarga-eta', daemon=True)
+        hilo.return_value.start.assert_called_once_with()
+
+
+class ArchivoPedidosTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('operador', password='clave'))
+        self.cliente = crear_cliente()
+        self.repartidor = crear_repartidor()
+        hace_200_dias = timezone.now() - timedelta(days=200)
+        self.corte = timezone.now() - timedelta(days=180)
+        self.viejo = crear_pedido(
+            self.cliente, repartidor=self.repartidor, estado='entregado', fecha_pedido=hace_200_dias
+        )
+        HistorialEstados.objects.create(
+            pedido=self.viejo, estado_anterior='en_camino', estado_nuevo='entregado', usuario='operador'
+        )
+        self.reporte = ReporteEntregas.objects.create(
+            pedido=self.viejo, repartidor=self.repartidor, fecha_reporte=hace_200_dias.date(), estado_entrega='exitosa'
+        )
+        crear_pedido(self.cliente, estado='entregado')
+        crear_pedido(self.cliente, fecha_pedido=hace_200_dias, zona_entrega='Sur')
+
+    def test_archiva_pedidos_viejos_y_descuenta_contadores(self):
+        self.assertEqual(archivo.archivar_lote(self.corte, 10), (1, 1, 1))
+        self.assertEqual(archivo.archivar_lote(self.corte, 10), (0, 0, 0))
+        self.assertFalse(Pedido.objects.filter(pk=self.viejo.pk).exists())
+        esperados = ({'entregado': 1, 'pendiente': 1}, {'Norte': 1, 'Sur': 1})
+        self.assertEqual((contadores.totales('estado'), contadores.totales('zona')), esperados)
+        contadores.reconstruir()
+        self.assertEqual((contadores.totales('estado'), contadores.totales('zona')), esperados)
+
+    def test_busqueda_en_el_archivo(self):
+        archivo.archivar_lote(self.corte, 10)
+        pedido, historial, archivado = archivo.buscar_pedido(self.viejo.pk)
+        self.assertTrue(archivado)
+        self.assertEqual((pedido.cliente, pedido.repartidor), (self.cliente, self.repartidor))
+        self.assertEqual([fila.estado_nuevo for fila in historial], ['entregado'])
+        self.assertEqual(archivo.buscar_reporte(self.reporte.pk)[0].pedido_id, self.viejo.pk)
+        self.assertIsNone(archivo.buscar_pedido(self.viejo.pk + 100))
+
+    def test_archivado_con_cliente_y_repartidor_eliminados(self):
+        archivo.archivar_lote(self.corte, 10)
+        self.cliente.delete()
+        self.repartidor.delete()
+
+        pedido, _, archivado = archivo.buscar_pedido(self.viejo.pk)
+        self.assertTrue(archivado)
+        self.assertIsNone(pedido.repartidor)
+        with self.assertNumQueries(0), self.assertRaises(Cliente.DoesNotExist):
+            pedido.cliente
+        reporte, _ = archivo.buscar_reporte(self.reporte.pk)
+        with self.assertNumQueries(0), self.assertRaises(Repartidor.DoesNotExist):
+            reporte.repartidor
+        self.assertContains(self.client.get(reverse('historial_pedido', args=[self.viejo.pk])), 'eliminado')
+        self.assertContains(self.client.get(reverse('detalle_reporte', args=[self.reporte.pk])), 'eliminado')
+
+
+class PaginacionKeysetTests(TestCase):
+    def setUp(self):
+        cliente = crear_cliente()
+        # Fechas repetidas: el desempate es la llave primaria
+        momento = timezone.now()
+        self.pedidos = [
+            crear_pedido(cliente, fecha_pedido=momento - timedelta(minutes=indice // 2)) for indice in range(7)
+        ]
+        self.orden = ['-fecha_pedido', '-pedido_id']
+        self.esperados = [
+            pedido.pk for pedido in sorted(self.pedidos, key=lambda p: (p.fecha_pedido, p.pk), reverse=True)
+        ]
+
+    def pagina(self, url='?'):
+        return paginacion.paginar(RequestFactory().get(f'/pedidos/{url}'), Pedido.objects.all(), self.orden, tamano=3)
+
+    def test_recorre_adelante_y_atras_sin_repetir_ni_saltar(self):
+        paginas = [self.pagina()]
+        self.assertFalse(paginas[0].hay_anterior)
+        while paginas[-1].hay_siguiente:
+            paginas.append(self.pagina(paginas[-1].url_siguiente))
+        self.assertEqual([pedido.pk for pagina in paginas for pedido in pagina.objetos], self.esperados)
+        self.assertEqual([len(pagina.objetos) for pagina in paginas], [3, 3, 1])
+
+        regreso = self.pagina(paginas[-1].url_anterior)
+        self.assertEqual([p.pk for p in regreso.objetos], [p.pk for p in paginas[1].objetos])
+        primera = self.pagina(regreso.url_anterior)
+        self.assertEqual([p.pk for p in primera.objetos], self.esperados[:3])
+        self.assertFalse(primera.hay_anterior)
+
+    def test_cursores_invalidos_o_pasados_del_final(self):
+        invalido = self.pagina('?despues=basura')
+        self.assertEqual([p.pk for p in invalido.objetos], self.esperados[:3])
+        self.assertFalse(invalido.hay_anterior)
+
+        # La última fila desaparece entre una página y la siguiente
+        segunda = self.pagina(self.pagina().url_siguiente)
+        Pedido.objects.filter(pk=self.esperados[-1]).delete()
+        vacia = self.pagina(segunda.url_siguiente)
+        self.assertEqual((vacia.objetos, vacia.url_anterior, vacia.hay_siguiente), ([], '?', False))
+
+        exacta = paginacion.paginar(RequestFactory().get('/pedidos/'), Pedido.objects.all(), self.orden, tamano=6)
+        self.assertFalse(exacta.hay_siguiente)
+
+    def test_cursor_conserva_los_filtros(self):
+        pagina = paginacion.paginar(
+            RequestFactory().get('/pedidos/', {'estado': 'pendiente', 'antes': 'viejo'}),
+            Pedido.objects.all(), self.orden, tamano=3
+        )
+        self.assertIn('estado=pendiente', pagina.url_siguiente)
+        self.assertNotIn('antes=', pagina.url_siguiente)
+
+    def test_paginador_del_admin_con_filtros(self):
+        cache.clear()
+        filtrado = paginacion.PaginadorEstimado(Pedido.objects.filter(pk__in=self.esperados[:2]), 3)
+        self.assertEqual(filtrado.count, 2)
+        # Un filtro que nunca coincide no genera SQL: se cuenta como vacío sin consultar
+        vacio = paginacion.PaginadorEstimado(Pedido.objects.filter(pk__in=[]), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(vacio.count, 0)
+        self.assertEqual(list(vacio.page(1)), [])
+
+
+class ContadoresPedidosTests(TestCase):
+    def setUp(self):
+        self.cliente = crear_cliente()
+
+    def totales(self):
+        return contadores.totales('estado'), contadores.totales('zona')
+
+    def assertCoincidenConLaTabla(self):
+        actuales = self.totales()
+        contadores.reconstruir()
+        self.assertEqual(actuales, self.totales())
+
+    def test_altas_cambios_y_bajas_por_save_y_delete(self):
+        pedido = crear_pedido(self.cliente)
+        otro = crear_pedido(self.cliente, zona_entrega='Sur', estado='cancelado')
+        self.assertEqual(self.totales(), ({'cancelado': 1, 'pendiente': 1}, {'Norte': 1, 'Sur': 1}))
+
+        pedido.estado = 'cancelado'
+        pedido.zona_entrega = 'Sur'
+        pedido.save()
+        self.assertEqual(self.totales(), ({'cancelado': 2}, {'Sur': 2}))
+
+        # Un guardado con campos diferidos no cuenta lo que no leyó
+        parcial = Pedido.objects.only('pk', 'observaciones').get(pk=otro.pk)
+        parcial.observaciones = 'tocar el timbre'
+        parcial.save()
+        self.assertEqual(self.totales(), ({'cancelado': 2}, {'Sur': 2}))
+
+        otro.delete()
+        Pedido.objects.filter(pk=pedido.pk).delete()
+        self.assertEqual(self.totales(), ({}, {}))
+        self.assertCoincidenConLaTabla()
+
+    def test_transiciones_por_update_directo(self):
+        repartidor = crear_repartidor()
+        pedidos = [crear_pedido(self.cliente) for _ in range(3)]
+        transiciones.transicionar(pedidos[0], 'asignado', 'operador', repartidor_id=repartidor.pk)
+        transiciones.cambiar_estados([p.pk for p in pedidos[1:]], 'cancelado', 'operador')
+        self.assertEqual(self.totales()[0], {'asignado': 1, 'cancelado': 2})
+        # El objeto ya refleja la transición: guardarlo otra vez no la cuenta de nuevo
+        pedidos[0].observaciones = 'fragil'
+        pedidos[0].save()
+        self.assertCoincidenConLaTabla()
+
+    def test_edicion_que_cambia_zona_y_estado(self):
+        self.client.force_login(User.objects.create_user('operador', password='clave'))
+        pedido = crear_pedido(self.cliente)
+        self.client.post(reverse('editar_pedido', args=[pedido.pk]), {
+            'cliente': self.cliente.pk, 'repartidor': '', 'direccion_entrega': 'Calle 1', 'zona_entrega': 'Sur',
+            'prioridad': 'normal', 'tiempo_estimado_minutos': 30, 'observaciones': '', 'estado': 'cancelado',
+        })
+        pedido.refresh_from_db()
+        self.assertEqual((pedido.estado, pedido.zona_entrega), ('cancelado', 'Sur'))
+        self.assertEqual(self.totales(), ({'cancelado': 1}, {'Sur': 1}))
+        self.assertCoincidenConLaTabla()
+
+
+class AsignacionEnLoteTests(TestCase):
+    def setUp(self):
+        self.cliente = crear_cliente()
+        self.repartidor = crear_repartidor(capacidad_maxima=50, capacidad_entregas=50)
+
+    def asignar(self, cantidad):
+        for _ in range(cantidad):
+            crear_pedido(self.cliente)
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = asignar_pedidos_pendientes('operador')
+        return resultado, len(consultas)
+
+    def test_consultas_no_crecen_con_los_pedidos(self):
+        # La primera crea la fila del contador de asignados
+        self.asignar(1)
+        pocos, consultas_pocos = self.asignar(3)
+        muchos, consultas_muchos = self.asignar(30)
+        self.assertEqual((pocos.asignaciones, pocos.viajes, pocos.leidos), (3, 1, 3))
+        self.assertEqual((muchos.asignaciones, muchos.viajes, muchos.leidos), (30, 1, 30))
+        self.assertEqual(consultas_pocos, consultas_muchos)
+
+        self.assertFalse(Pedido.objects.filter(estado='pendiente').exists())
+        self.assertEqual(HistorialEstados.objects.filter(estado_nuevo='asignado', usuario='operador').count(), 34)
+        self.repartidor.refresh_from_db()
+        self.assertEqual(self.repartidor.capacidad_entregas, 16)
+
+    def test_todo_o_nada_en_una_transaccion(self):
+        pedidos = [crear_pedido(self.cliente).pk for _ in range(3)]
+        with mock.patch.object(HistorialEstados.objects, 'bulk_create', side_effect=OperationalError('sin disco')):
+            with self.assertRaises(OperationalError):
+                asignar_pedidos_pendientes('operador')
+        self.assertEqual(set(Pedido.objects.filter(pk__in=pedidos).values_list('estado', flat=True)), {'pendiente'})
+        self.repartidor.refresh_from_db()
+        self.assertEqual(self.repartidor.capacidad_entregas, 50)
+
+
+class EmparejamientoPorZonaTests(TestCase):
+    def setUp(self):
+        self.cliente = crear_cliente()
+
+    def test_repartidores_disponibles_de_una_zona_o_de_todas(self):
+        norte = crear_repartidor('200')
+        sur = crear_repartidor('201', zona_asignada='Sur')
+        crear_repartidor('202', disponible=False)
+        self.assertEqual(set(obtener_repartidores_disponibles()), {norte, sur})
+        self.assertEqual(list(obtener_repartidores_disponibles('Sur')), [sur])
+
+    def test_urgentes_primero_y_luego_los_mas_antiguos(self):
+        repartidor = crear_repartidor(capacidad_maxima=2, capacidad_entregas=2)
+        ahora = timezone.now()
+        viejo = crear_pedido(self.cliente, fecha_pedido=ahora - timedelta(hours=2))
+        crear_pedido(self.cliente, fecha_pedido=ahora - timedelta(hours=1))
+        urgente = crear_pedido(self.cliente, prioridad='urgente', fecha_pedido=ahora)
+        asignar_pedidos_pendientes('operador')
+        asignados = Pedido.objects.filter(repartidor=repartidor).values_list('pk', flat=True)
+        self.assertEqual(set(asignados), {urgente.pk, viejo.pk})
+
+    def test_zona_sin_repartidores_usa_una_vecina(self):
+        centro = crear_repartidor(zona_asignada='Centro', capacidad_maxima=1, capacidad_entregas=1)
+        # Norte no es vecina de Sur: su repartidor no toma el que sobra
+        crear_repartidor('201', zona_asignada='Norte')
+        for _ in range(2):
+            crear_pedido(self.cliente, zona_entrega='Sur')
+        asignar_pedidos_pendientes('operador')
+        self.assertEqual(
+            sorted(Pedido.objects.values_list('estado', 'repartidor_id')), [('asignado', centro.pk), ('pendiente', None)]
+        )
+
+
+class AutocompletadoTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('operador', password='clave'))
+
+    def textos(self, nombre_ruta, **parametros):
+        respuesta = self.client.get(reverse(nombre_ruta), parametros)
+        return [resultado['texto'].split(' - ')[0] for resultado in respuesta.json()['resultados']]
+
+    def test_limite_acotado_y_consulta_vacia(self):
+        for cedula in range(100, 125):
+            crear_cliente(str(cedula), nombres=f'Ana {cedula}')
+        self.assertEqual(self.textos('autocompletar_clientes', q=''), [])
+        self.assertEqual(len(self.textos('autocompletar_clientes', q='ana')), 10)
+        self.assertEqual(len(self.textos('autocompletar_clientes', q='ana', limite=100)), 20)
+        self.assertEqual(len(self.textos('autocompletar_clientes', q='ana', limite='x')), 10)
+
+    def test_filtros_de_repartidores(self):
+        crear_repartidor('200', nombres='Luis')
+        crear_repartidor('201', nombres='Lucas', capacidad_entregas=0)
+        crear_repartidor('202', nombres='Lucía', activo=False)
+        todos = ['Lucas Gómez', 'Lucía Gómez', 'Luis Gómez']
+        self.assertEqual(self.textos('autocompletar_repartidores', q='lu'), todos)
+        self.assertEqual(self.textos('autocompletar_repartidores', q='lu', disponibles=1), ['Luis Gómez'])
+        self.assertEqual(self.textos('autocompletar_repartidores', q='lu', activos=1), ['Lucas Gómez', 'Luis Gómez'])
+
+    def test_formulario_no_lista_todos_los_clientes(self):
+        crear_cliente(nombres='Zacarías')
+        respuesta = self.client.get(reverse('crear_pedido'))
+        self.assertContains(respuesta, reverse('autocompletar_clientes'))
+        self.assertNotContains(respuesta, 'Zacarías')
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('autocompletar_clientes'), {'q': 'zac'}).status_code, 302)
+
+
+class BenchTests(TransactionTestCase):
+    # La siembra cambia PRAGMA synchronous, que SQLite no permite dentro de una transacción
+    def test_siembra_y_mide_las_rutas(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            salida = os.path.join(carpeta, 'bench.json')
+            call_command(
+                'bench', clientes=20, repartidores=5, pedidos=60, repeticiones=2, lote=25,
+                rutas=r'^(lista_pedidos|reportes_entregas|cliente_dashboard)$', salida=salida, stderr=io.StringIO()
+            )
+            with open(salida, encoding='utf-8') as archivo:
+                resultado = json.load(archivo)
+        configuracion = resultado['configuracion']
+        self.assertEqual(
+            (configuracion['clientes'], configuracion['repartidores'], configuracion['pedidos']), (20, 5, 60)
+        )
+        self.assertEqual(set(resultado['vistas']), {'lista_pedidos', 'reportes_entregas', 'cliente_dashboard'})
+        for vista in resultado['vistas'].values():
+            self.assertEqual(vista['estado'], 200)
+            self.assertLessEqual(vista['p50_ms'], vista['p95_ms'])
+            self.assertGreater(vista['consultas'], 0)
+        # Los contadores quedan al día con lo sembrado
+        self.assertEqual(sum(contadores.totales('estado').values()), 60)
+
+    def test_percentil_por_rango_mas_cercano(self):
+        valores = list(range(1, 11))
+        self.assertEqual([metricas.percentil(valores, p) for p in (0, 50, 95, 100)], [1, 5, 10, 10])
@@ -0,0 +1,318 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from . import eta, eventos, tareas
+from .capacidad import ESTADOS_CON_CARGA, liberar_capacidad, reservar_capacidad, reservar_hasta
+from .contadores import registrar_transicion
+from .models import HistorialEstados, Pedido
+
+# Pedidos por petición de cambio en lote
+MAXIMO_LOTE = 1000
+TAMANO_LOTE = 500
+
+# Estado actual -> estados a los que puede pasar un pedido
+TRANSICIONES = {
+    'pendiente': ('asignado', 'cancelado'),
+    'asignado': ('en_camino', 'entregado', 'cancelado'),
+    'en_camino': ('entregado', 'cancelado'),
+    'entregado': (),
+    'cancelado': (),
+}
+LEGALES = frozenset((actual, nuevo) for actual, destinos in TRANSICIONES.items() for nuevo in destinos)
+ESTADOS_FINALES = tuple(estado for estado, destinos in TRANSICIONES.items() if not destinos)
+# Estados que no tienen sentido sin un repartidor ya asignado
+ESTADOS_CON_REPARTIDOR = ('asignado', 'en_camino', 'entregado')
+
+
+class TransicionInvalida(ValueError):
+    pass
+
+
+def error_transicion(pedido, nuevo_estado, repartidor_id=None):
+    """Motivo por el que `pedido` no puede pasar a `nuevo_estado`, o None si puede"""
+    if pedido.estado == nuevo_estado:
+        return f'ya está {pedido.get_estado_display().lower()}'
+    if pedido.estado in ESTADOS_FINALES:
+        return f'está {pedido.get_estado_display().lower()} y no admite cambios'
+    if (pedido.estado, nuevo_estado) not in LEGALES:
+        nombres = dict(Pedido.ESTADO_CHOICES)
+        return f'no puede pasar de {pedido.get_estado_display()} a {nombres.get(nuevo_estado, nuevo_estado)}'
+    if nuevo_estado in ESTADOS_CON_REPARTIDOR and not (repartidor_id or pedido.repartidor_id):
+        return 'no tiene repartidor asignado'
+    return None
+
+
+def libera_capacidad(estado_anterior, nuevo_estado):
+    """Al entregarse o cancelarse, el pedido deja de ocupar a su repartidor"""
+    return estado_anterior in ESTADOS_CON_CARGA and nuevo_estado in ESTADOS_FINALES
+
+
+def _cambios(pedido, nuevo_estado, ahora):
+    """Columnas que escribe la transición, además de estado y versión"""
+    cambios = {}
+    if nuevo_estado == 'asignado' and not pedido.fecha_asignacion:
+        cambios['fecha_asignacion'] = ahora
+    elif nuevo_estado == 'entregado' and not pedido.fecha_entrega_real:
+        cambios['fecha_entrega_real'] = ahora
+        cambios['tiempo_real_minutos'] = int((ahora - pedido.fecha_pedido).total_seconds() // 60)
+    return cambios
+
+
+def transicionar(pedido, nuevo_estado, usuario, repartidor_id=None):
+    """
+    Lleva `pedido` a `nuevo_estado` (y a `repartidor_id` si pasa a asignado).
+
+    Es un único UPDATE ... WHERE pedido_id = %s AND estado = <estado leído>
+    que solo escribe las columnas del cambio y sube la versión, con el
+    historial en la misma transacción: si otro proceso cambió el estado
+    entre la lectura y la escritura no se pisa nada y se lanza
+    TransicionInvalida, igual que si la transición no está en TRANSICIONES.
+    Al pasar a asignado primero reserva la capacidad del repartidor (el
+    elegido o el que ya traía el pedido); sin capacidad también lanza
+    TransicionInvalida y no cambia nada. Actualiza `pedido` en memoria.
+    """
+    if nuevo_estado != 'asignado':
+        repartidor_id = None
+    error = error_transicion(pedido, nuevo_estado, repartidor_id)
+    if error:
+        raise TransicionInvalida(error)
+    estado_anterior = pedido.estado
+    cambios = _cambios(pedido, nuevo_estado, timezone.now())
+    cambios['estado'] = nuevo_estado
+    if repartidor_id:
+        cambios['repartidor_id'] = repartidor_id
+
+    with transaction.atomic():
+        # Si el UPDATE no encuentra el pedido, la excepción revierte también la reserva
+        if nuevo_estado == 'asignado' and not reservar_capacidad(repartidor_id or pedido.repartidor_id):
+            raise TransicionInvalida('el repartidor elegido ya no tiene capacidad disponible')
+        actualizados = Pedido.objects.filter(pk=pedido.pk, estado=estado_anterior).update(
+            version=F('version') + 1, **cambios
+        )
+        if not actualizados:
+            raise TransicionInvalida('otro usuario cambió el estado del pedido; recargue e intente de nuevo')
+        HistorialEstados.objects.create(
+            pedido_id=pedido.pk,
+            estado_anterior=estado_anterior,
+            estado_nuevo=nuevo_estado,
+            usuario=usuario
+        )
+        registrar_transicion(estado_anterior, nuevo_estado, 1)
+        if pedido.repartidor_id and libera_capacidad(estado_anterior, nuevo_estado):
+            liberar_capacidad(pedido.repartidor_id)
+        for campo, valor in cambios.items():
+            setattr(pedido, campo, valor)
+        pedido.refresh_from_db(fields=['version'])
+        # El estado ya se contó: un save() posterior no debe volver a contarlo. La
+        # zona sigue siendo la guardada; si el objeto trae otra sin guardar (el
+        # formulario de edición), ese save() es el que la mueve
+        zona_guardada = getattr(pedido, '_contador_original', (None, None))[1]
+        pedido._contador_original = (nuevo_estado, zona_guardada)
+        if nuevo_estado == 'entregado':
+            # El reporte automático lo genera `manage.py worker`
+            tareas.encolar('crear_reporte', pedido_id=pedido.pk)
+            transaction.on_commit(lambda: eta.registrar_entrega(pedido))
+        eventos.publicar_pedido('estado', pedido)
+    return pedido
+
+
+def reasignar(pedido, repartidor_id):
+    """
+    Pasa un pedido asignado o en camino de su repartidor a `repartidor_id`.
+
+    Es un único UPDATE ... WHERE pedido_id = %s AND repartidor_id = <leído>
+    AND estado IN ('asignado', 'en_camino'): la capacidad del nuevo se
+    reserva y la del anterior se libera solo si ese UPDATE tocó la fila, en
+    la misma transacción. Si el pedido cambió de estado o de repartidor
+    entre la lectura y la escritura lanza TransicionInvalida.
+    """
+    if pedido.estado not in ESTADOS_CON_CARGA:
+        raise TransicionInvalida(f'está {pedido.get_estado_display().lower()} y no se puede reasignar')
+    if not repartidor_id:
+        raise TransicionInvalida(f'está {pedido.get_estado_display().lower()} y no puede quedar sin repartidor')
+    anterior_id = pedido.repartidor_id
+    if anterior_id == repartidor_id:
+        raise TransicionInvalida('ya está asignado a ese repartidor')
+
+    with transaction.atomic():
+        actualizados = Pedido.objects.filter(
+            pk=pedido.pk, repartidor_id=anterior_id, estado__in=ESTADOS_CON_CARGA
+        ).update(repartidor_id=repartidor_id, version=F('version') + 1)
+        if not actualizados:
+            raise TransicionInvalida('otro usuario cambió el pedido; recargue e intente de nuevo')
+        # Si el nuevo no tiene capacidad la excepción revierte también el UPDATE
+        if not reservar_capacidad(repartidor_id):
+            raise TransicionInvalida('el repartidor elegido ya no tiene capacidad disponible')
+        if anterior_id:
+            liberar_capacidad(anterior_id)
+        pedido.repartidor_id = repartidor_id
+        pedido.refresh_from_db(fields=['version'])
+        eventos.publicar_pedido('repartidor', pedido)
+    return pedido
+
+
+def cambiar_repartidor(pedido, repartidor_id):
+    """
+    Cambia el repartidor de un pedido en cualquier estado. Si el pedido
+    ocupa capacidad (asignado o en camino) pasa por reasignar(); si no, es
+    un UPDATE condicional sobre el estado y el repartidor leídos que no
+    toca capacidades: la reserva la hace transicionar() al asignarlo.
+    """
+    if pedido.estado in ESTADOS_CON_CARGA:
+        return reasignar(pedido, repartidor_id)
+    with transaction.atomic():
+        actualizados = Pedido.objects.filter(
+            pk=pedido.pk, estado=pedido.estado, repartidor_id=pedido.repartidor_id
+        ).update(repartidor_id=repartidor_id, version=F('version') + 1)
+        if not actualizados:
+            raise TransicionInvalida('otro usuario cambió el pedido; recargue e intente de nuevo')
+        pedido.repartidor_id = repartidor_id
+        pedido.refresh_from_db(fields=['version'])
+        eventos.publicar_pedido('repartidor', pedido)
+    return pedido
+
+
+def _actualizar(pedidos, estado_anterior, nuevo_estado, ahora):
+    """
+    UPDATE ... WHERE pedido_id IN (...) AND estado = `estado_anterior` con
+    las columnas de _cambios de cada pedido (CASE por pedido). Retorna las
+    filas actualizadas.
+    """
+    casos = defaultdict(list)
+    for pedido in pedidos:
+        for campo, valor in _cambios(pedido, nuevo_estado, ahora).items():
+            casos[campo].append(When(pk=pedido.pk, then=Value(valor)))
+    columnas = {
+        campo: Case(*cuando, default=F(campo), output_field=Pedido._meta.get_field(campo))
+        for campo, cuando in casos.items()
+    }
+    return Pedido.objects.filter(pk__in=[pedido.pk for pedido in pedidos], estado=estado_anterior).update(
+        estado=nuevo_estado, version=F('version') + 1, **columnas
+    )
+
+
+def _reservar(grupos, errores):
+    """
+    Reserva la capacidad de los repartidores de los pedidos que pasan a
+    asignado: de una vez por repartidor y, si no alcanza, pedido por pedido
+    hasta agotarla. Los que se quedan sin reserva van a `errores`. Retorna
+    los grupos con solo los pedidos reservados y {repartidor_id: reservas}.
+    """
+    por_repartidor = defaultdict(list)
+    for pedidos in grupos.values():
+        for pedido in pedidos:
+            por_repartidor[pedido.repartidor_id].append(pedido)
+
+    reservados = Counter()
+    sin_capacidad = set()
+    for repartidor_id, pedidos in por_repartidor.items():
+        cantidad = reservar_hasta(repartidor_id, len(pedidos))
+        if cantidad:
+            reservados[repartidor_id] = cantidad
+        sin_capacidad.update(pedido.pk for pedido in pedidos[cantidad:])
+    for pk in sin_capacidad:
+        errores[pk] = 'su repartidor ya no tiene capacidad disponible'
+    return {
+        estado: [pedido for pedido in pedidos if pedido.pk not in sin_capacidad]
+        for estado, pedidos in grupos.items()
+    }, reservados
+
+
+def cambiar_estados(pedido_ids, nuevo_estado, usuario):
+    """
+    Cambia el estado de varios pedidos a la vez.
+
+    Valida cada pedido por separado y aplica los válidos con un UPDATE
+    condicional por estado anterior (... WHERE pedido_id IN (...) AND
+    estado = <anterior>), como transicionar() pero agrupado. Si alguno
+    cambió entre la lectura y la escritura, ese grupo se revierte y se
+    aplica pedido por pedido, y los que ya no coinciden se informan como
+    error. Al pasar a asignado se reserva antes la capacidad de cada
+    repartidor (ver _reservar). El historial va en un bulk_create y los
+    reportes de los entregados se encolan como en transicionar(), todo en
+    una transacción.
+    Retorna una lista en el orden recibido con {'pedido_id', 'ok'} y
+    'error' para los que no se cambiaron.
+    """
+    if nuevo_estado not in dict(Pedido.ESTADO_CHOICES):
+        raise ValueError(f'Estado desconocido: {nuevo_estado}')
+    pedido_ids = list(dict.fromkeys(pedido_ids))
+    if len(pedido_ids) > MAXIMO_LOTE:
+        raise ValueError(f'Se pueden cambiar hasta {MAXIMO_LOTE} pedidos a la vez')
+
+    errores = {}
+    with transaction.atomic():
+        encontrados = Pedido.objects.select_related('repartidor').in_bulk(pedido_ids)
+        ahora = timezone.now()
+        grupos = defaultdict(list)
+        for pedido_id in pedido_ids:
+            pedido = encontrados.get(pedido_id)
+            error = 'no existe' if pedido is None else error_transicion(pedido, nuevo_estado)
+            if error:
+                errores[pedido_id] = error
+            else:
+                grupos[pedido.estado].append(pedido)
+
+        reservados = Counter()
+        if nuevo_estado == 'asignado':
+            grupos, reservados = _reservar(grupos, errores)
+
+        aplicados = []
+        for estado_anterior, pedidos in grupos.items():
+            try:
+                with transaction.atomic():
+                    if _actualizar(pedidos, estado_anterior, nuevo_estado, ahora) != len(pedidos):
+                        raise TransicionInvalida(estado_anterior)
+                aplicados.extend(pedidos)
+            except TransicionInvalida:
+                # Otro proceso cambió alguno: se revisa uno por uno cuál
+                for pedido in pedidos:
+                    if _actualizar([pedido], estado_anterior, nuevo_estado, ahora):
+                        aplicados.append(pedido)
+                    else:
+                        errores[pedido.pk] = 'otro usuario cambió el estado del pedido'
+
+        por_estado_anterior = Counter()
+        # Las reservas de los pedidos que no se pudieron cambiar se devuelven
+        liberados = reservados - Counter(pedido.repartidor_id for pedido in aplicados)
+        historial = []
+        entregados = []
+        for pedido in aplicados:
+            estado_anterior = pedido.estado
+            por_estado_anterior[estado_anterior] += 1
+            if pedido.repartidor_id and libera_capacidad(estado_anterior, nuevo_estado):
+                liberados[pedido.repartidor_id] += 1
+            historial.append(HistorialEstados(
+                pedido_id=pedido.pedido_id,
+                estado_anterior=estado_anterior,
+                estado_nuevo=nuevo_estado,
+                fecha_cambio=ahora,
+                usuario=usuario
+            ))
+            cambios = _cambios(pedido, nuevo_estado, ahora)
+            for campo, valor in cambios.items():
+                setattr(pedido, campo, valor)
+            pedido.estado = nuevo_estado
+            pedido.version += 1
+            if 'fecha_entrega_real' in cambios:
+                entregados.append(pedido)
+
+        if aplicados:
+            HistorialEstados.objects.bulk_create(historial, batch_size=TAMANO_LOTE)
+            # El reporte automático lo genera `manage.py worker`, como en transicionar()
+            tareas.encolar_varias('crear_reporte', [{'pedido_id': pedido.pk} for pedido in entregados])
+            for estado_anterior, cantidad in por_estado_anterior.items():
+                registrar_transicion(estado_anterior, nuevo_estado, cantidad)
+            for repartidor_id, cantidad in liberados.items():
+                liberar_capacidad(repartidor_id, cantidad)
+            eventos.publicar_pedidos('estado', aplicados)
+            transaction.on_commit(lambda: [eta.registrar_entrega(pedido) for pedido in entregados])
+
+    return [
+        {'pedido_id': pedido_id, 'ok': False, 'error': errores[pedido_id]} if pedido_id in errores
+        else {'pedido_id': pedido_id, 'ok': True}
+        for pedido_id in pedido_ids
+    ]
@@ -1,33 +1,35 @@
+ZONAS_VECINAS = {
+    'Norte': ['Centro', 'Este', 'Oeste'],
+    'Sur': ['Centro', 'Este', 'Oeste'],
+    'Este': ['Centro', 'Norte', 'Sur'],
+    'Oeste': ['Centro', 'Norte', 'Sur'],
+    'Centro': ['Norte', 'Sur', 'Este', 'Oeste'],
+}
+
+def normalizar_zona(zona):
+    """
+    Normaliza el nombre de una zona escrito a mano ('  norte' -> 'Norte')
+    """
+    return (zona or '').strip().capitalize()
+
 def calcular_tiempo_entrega(zona, prioridad):
     """
-    Calcula el tiempo estimado de entrega basado en zona y prioridad
+    Calcula el tiempo estimado de entrega basado en zona y prioridad,
+    aprendido de las entregas reales (ver eta.py)
     """
-    tiempos_base = {
-        'Norte': 30,
-        'Sur': 45,
-        'Este': 35,
-        'Oeste': 40,
-        'Centro': 25
-    }
-    
-    multiplicadores_prioridad = {
-        'normal': 1.0,
-        'alta': 0.8,
-        'urgente': 0.6
-    }
-    
-    tiempo_base = tiempos_base.get(zona, 30)
-    multiplicador = multiplicadores_prioridad.get(prioridad, 1.0)
-    
-    return int(tiempo_base * multiplicador)
+    from .eta import estimar
+    return estimar(zona, prioridad)
 
-def obtener_repartidores_disponibles(zona):
+def obtener_repartidores_disponibles(zona=None):
     """
-    Retorna repartidores disponibles para una zona específica
+    Retorna repartidores disponibles para una zona específica,
+    o de todas las zonas si no se indica ninguna
     """
     from .models import Repartidor
-    return Repartidor.objects.filter(
-        zona_asignada=zona,
+    repartidores = Repartidor.objects.filter(
         disponible=True,
         activo=True
-    )
\ No newline at end of file
+    )
+    if zona is not None:
+        repartidores = repartidores.filter(zona_asignada=zona)
+    return repartidores
\ No newline at end of file
@@ -0,0 +1,143 @@
+import heapq
+import re
+from collections import defaultdict
+
+from .utils import ZONAS_VECINAS, normalizar_zona
+
+# Cuadras que se consideran "cerca" dentro de la misma vía
+CUADRAS_POR_SECTOR = 5
+
+_DIRECCION = re.compile(r'^\s*([a-záéíóúñ\.]+)\s*(\d+)\s*[a-z]?\s*(?:#|no\.?|n°)?\s*(\d+)?', re.IGNORECASE)
+
+
+def clave_cercania(direccion):
+    """
+    Sector aproximado de una dirección tipo 'Carrera 45 # 12-30':
+    (vía, número de vía, grupo de CUADRAS_POR_SECTOR cuadras). Direcciones
+    que no siguen ese formato quedan en un sector propio por su texto.
+    """
+    coincidencia = _DIRECCION.match(direccion or '')
+    if not coincidencia:
+        return (' '.join((direccion or '').lower().split()), '', 0)
+    via, numero, cruce = coincidencia.groups()
+    sector = int(cruce) // CUADRAS_POR_SECTOR if cruce else 0
+    return (via.lower().rstrip('.'), numero, sector)
+
+
+class _Contenedores:
+    """
+    Repartidores de una zona agrupados por capacidad restante: {capacidad:
+    heap de ids}. El best-fit recorre las capacidades desde la pedida hacia
+    arriba, que son pocas (hasta capacidad_maxima), así que tomar y devolver
+    un repartidor no depende de cuántos repartidores tenga la zona.
+    """
+    def __init__(self):
+        self.cubetas = defaultdict(list)
+        self.total = 0
+        self.maxima = 0
+
+    def agregar(self, capacidad, repartidor_id):
+        heapq.heappush(self.cubetas[capacidad], repartidor_id)
+        self.total += capacidad
+        self.maxima = max(self.maxima, capacidad)
+
+    def tomar(self, cantidad):
+        """
+        (capacidad, id) del repartidor con la menor capacidad >= `cantidad`
+        (a igual capacidad, el de menor id) o, si ninguno alcanza, del que
+        tiene más. Lo saca de los contenedores.
+        """
+        for capacidad in range(min(cantidad, self.maxima), self.maxima + 1):
+            if self.cubetas.get(capacidad):
+                break
+        repartidor_id = heapq.heappop(self.cubetas[capacidad])
+        self.total -= capacidad
+        while self.maxima and not self.cubetas.get(self.maxima):
+            self.maxima -= 1
+        return capacidad, repartidor_id
+
+
+def _empacar(pedidos, contenedores, repartidores, viajes):
+    """
+    Best-fit decreasing: los pedidos (ya en orden de atención) se agrupan
+    por sector y cada grupo, del más grande al más pequeño, va al
+    repartidor con la menor capacidad restante que lo recibe completo (ver
+    _Contenedores). Un grupo más grande que cualquier capacidad se reparte
+    empezando por el repartidor con más espacio.
+
+    Solo se empacan tantos pedidos como capacidad haya; retorna los que
+    sobran, conservando su orden.
+    """
+    if not contenedores.total:
+        return pedidos
+    elegidos, sobrantes = pedidos[:contenedores.total], pedidos[contenedores.total:]
+
+    sectores = {}
+    for pedido in elegidos:
+        sectores.setdefault(clave_cercania(pedido.direccion_entrega), []).append(pedido)
+
+    for grupo in sorted(sectores.values(), key=len, reverse=True):
+        while grupo:
+            capacidad, repartidor_id = contenedores.tomar(len(grupo))
+            tomados, grupo = grupo[:capacidad], grupo[capacidad:]
+            viajes.setdefault(repartidor_id, []).extend(tomados)
+            capacidad -= len(tomados)
+            if capacidad:
+                contenedores.agregar(capacidad, repartidor_id)
+            repartidor = repartidores[repartidor_id]
+            repartidor.capacidad_entregas = capacidad
+            repartidor.disponible = capacidad > 0
+    return sobrantes
+
+
+def armar_viajes(pedidos, repartidores, orden=None):
+    """
+    Agrupa pedidos pendientes en viajes que respetan la capacidad de cada
+    repartidor: por zona de entrega, luego por cercanía de la dirección
+    (ver clave_cercania) y con best-fit decreasing para llenar los viajes.
+    Los pedidos que no caben en su zona se reparten entre las zonas
+    vecinas de ZONAS_VECINAS todos juntos y en orden de atención, para que
+    un pedido normal de una zona no le gane la capacidad vecina a uno
+    urgente de otra.
+
+    `orden` es la clave de atención de los pedidos (los primeros son los que
+    reciben capacidad si no alcanza para todos). Actualiza capacidad y
+    disponibilidad de los repartidores en memoria y retorna la lista de
+    viajes (repartidor, [pedidos]).
+    """
+    por_id = {}
+    contenedores = defaultdict(_Contenedores)
+    for repartidor in repartidores:
+        if repartidor.capacidad_entregas > 0:
+            por_id[repartidor.repartidor_id] = repartidor
+            contenedores[normalizar_zona(repartidor.zona_asignada)].agregar(
+                repartidor.capacidad_entregas, repartidor.repartidor_id
+            )
+
+    ordenados = sorted(pedidos, key=orden) if orden else list(pedidos)
+    por_zona = {}
+    for pedido in ordenados:
+        por_zona.setdefault(normalizar_zona(pedido.zona_entrega), []).append(pedido)
+
+    viajes = {}
+    sobrantes = []
+    for zona, pedidos_zona in por_zona.items():
+        sobrantes.extend(_empacar(pedidos_zona, contenedores[zona], por_id, viajes))
+
+    if sobrantes:
+        # Cada sobrante, en orden de atención global, toma lugar en la
+        # primera zona vecina con capacidad libre; luego se empaca cada zona
+        posicion = {id(pedido): indice for indice, pedido in enumerate(ordenados)}
+        sobrantes.sort(key=lambda pedido: posicion[id(pedido)])
+        libre = {zona: contenedores_zona.total for zona, contenedores_zona in contenedores.items()}
+        por_vecina = {}
+        for pedido in sobrantes:
+            for vecina in ZONAS_VECINAS.get(normalizar_zona(pedido.zona_entrega), ()):
+                if libre.get(vecina):
+                    libre[vecina] -= 1
+                    por_vecina.setdefault(vecina, []).append(pedido)
+                    break
+        for vecina, pedidos_vecina in por_vecina.items():
+            _empacar(pedidos_vecina, contenedores[vecina], por_id, viajes)
+
+    return [(por_id[repartidor_id], pedidos_viaje) for repartidor_id, pedidos_viaje in viajes.items()]
@@ -1,40 +1,33 @@
+import datetime
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import login, authenticate
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
+from django.urls import reverse
 from django.utils import timezone
-from django.db.models import Count, Avg, Q
-from django.http import JsonResponse
-from .models import Cliente, Repartidor, Pedido, HistorialEstados, ReporteEntregas
+from django.db import transaction
+from django.db.models import Count, Avg, Q, Exists, OuterRef
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from .models import Cliente, Repartidor, Pedido, HistorialEstados, ReporteEntregas, Tarea
+from . import busqueda, contadores, despacho, eta, eventos, geocodificacion, metricas, tareas, transiciones
+from .agregados import calcular_concurrentes
+from .archivo import buscar_pedido, buscar_reporte
+from .capacidad import ESTADOS_CON_CARGA, cargas_abiertas, reservar_capacidad
+from .paginacion import paginar, contar_aproximado
+from .exportacion import FORMATOS, FiltroInvalido, construir_consulta, generar_filas
 from django.contrib.auth.models import User
+from asgiref.sync import sync_to_async
 
 # ✅ FUNCIÓN PARA VERIFICAR SI ES CLIENTE
 def es_cliente(user):
     return hasattr(user, 'cliente')
 
-# ✅ FUNCIÓN PARA CREAR REPORTE AUTOMÁTICO
-def crear_reporte_entrega(pedido):
-    try:
-        if ReporteEntregas.objects.filter(pedido=pedido).exists():
-            return
-        hora_actual = timezone.now().time()
-        reporte = ReporteEntregas(
-            pedido=pedido,
-            repartidor=pedido.repartidor if pedido.repartidor else None,
-            fecha_reporte=timezone.now().date(),
-            hora_salida=pedido.fecha_asignacion.time() if pedido.fecha_asignacion else hora_actual,
-            hora_llegada=hora_actual,
-            hora_entrega=hora_actual,
-            tiempo_transito=30,
-            tiempo_total=pedido.tiempo_real_minutos if pedido.tiempo_real_minutos else 45,
-            estado_entrega='exitosa',
-            calificacion=5,
-            comentarios_cliente='Entrega exitosa'
-        )
-        reporte.save()
-    except Exception as e:
-        print(f"Error al crear reporte automático: {str(e)}")
+# ✅ FUNCIÓN PARA VERIFICAR SI ES PERSONAL ADMINISTRATIVO
+def es_staff(user):
+    return user.is_staff
 
 # ✅ VISTAS PÚBLICAS
 def registro_cliente(request):
@@ -98,13 +91,12 @@ def cliente_crear_pedido(request):
         try:
             direccion_entrega = request.POST.get('direccion_entrega')
             zona_entrega = request.POST.get('zona_entrega')
-            tiempo_estimado_minutos = request.POST.get('tiempo_estimado_minutos')
             observaciones = request.POST.get('observaciones')
             pedido = Pedido(
                 cliente=cliente,
                 direccion_entrega=direccion_entrega,
                 zona_entrega=zona_entrega,
-                tiempo_estimado_minutos=tiempo_estimado_minutos,
+                tiempo_estimado_minutos=eta.estimar(zona_entrega),
                 observaciones=observaciones
             )
             pedido.save()
@@ -114,11 +106,15 @@ def cliente_crear_pedido(request):
                 estado_nuevo='pendiente',
                 usuario=request.user.username
             )
+            eventos.publicar_pedido('nuevo', pedido)
             messages.success(request, f'Pedido #{pedido.pedido_id} creado exitosamente!')
             return redirect('cliente_dashboard')
         except Exception as e:
             messages.error(request, f'Error al crear pedido: {str(e)}')
-    return render(request, 'clientes/cliente_crear_pedido.html', {'cliente': cliente})
+    return render(request, 'clientes/cliente_crear_pedido.html', {
+        'cliente': cliente,
+        'tiempo_estimado': eta.estimar(cliente.zona)
+    })
 
 @login_required
 @user_passes_test(es_cliente, login_url='/login/')
@@ -145,29 +141,50 @@ def cliente_editar_perfil(request):
     return render(request, 'clientes/cliente_editar_perfil.html', {'cliente': cliente})
 
 # ✅ VISTAS PRINCIPALES DEL SISTEMA
-@login_required
-def index(request):
-    if hasattr(request.user, 'cliente'):
+def estado_sesion(user):
+    return user.is_authenticated, user.is_authenticated and es_cliente(user)
+
+# index y dashboard son asíncronas: sus agregados son independientes y se
+# calculan en paralelo (ver agregados.py). login_required no admite vistas
+# asíncronas en Django 4.2, así que la sesión se revisa a mano.
+async def index(request):
+    autenticado, cliente = await sync_to_async(estado_sesion)(request.user)
+    if not autenticado:
+        return redirect_to_login(request.get_full_path())
+    if cliente:
         return redirect('cliente_dashboard')
-    total_clientes = Cliente.objects.count()
-    total_repartidores = Repartidor.objects.filter(activo=True).count()
-    total_pedidos = Pedido.objects.count()
-    pedidos_pendientes = Pedido.objects.filter(estado='pendiente').count()
-    pedidos_recientes = Pedido.objects.select_related('cliente', 'repartidor').order_by('-fecha_pedido')[:5]
+    valores, obsoletos = await calcular_concurrentes({
+        'total_clientes': (lambda: contar_aproximado(Cliente.objects.all(), 'clientes'), 0),
+        'total_repartidores': (
+            lambda: contar_aproximado(Repartidor.objects.filter(activo=True), 'repartidores:activos'), 0
+        ),
+        'por_estado': (lambda: contadores.totales('estado'), {}),
+        'pedidos_recientes': (
+            lambda: list(Pedido.objects.select_related('cliente', 'repartidor').order_by('-fecha_pedido')[:5]),
+            []
+        ),
+    })
+    por_estado = valores['por_estado']
     context = {
-        'total_clientes': total_clientes,
-        'total_repartidores': total_repartidores,
-        'total_pedidos': total_pedidos,
-        'pedidos_pendientes': pedidos_pendientes,
-        'pedidos_recientes': pedidos_recientes,
+        'total_clientes': valores['total_clientes'],
+        'total_repartidores': valores['total_repartidores'],
+        'total_pedidos': sum(por_estado.values()),
+        'pedidos_pendientes': por_estado.get('pendiente', 0),
+        'pedidos_recientes': valores['pedidos_recientes'],
+        'datos_obsoletos': obsoletos,
     }
-    return render(request, 'index.html', context)
+    return await sync_to_async(render)(request, 'index.html', context)
 
 # ✅ VISTAS DE CLIENTES (ADMIN)
 @login_required
 def lista_clientes(request):
-    clientes = Cliente.objects.all().order_by('-fecha_registro')
-    return render(request, 'clientes/lista_clientes.html', {'clientes': clientes})
+    clientes = Cliente.objects.all()
+    pagina = paginar(request, clientes, ['-fecha_registro', '-cliente_id'])
+    return render(request, 'clientes/lista_clientes.html', {
+        'clientes': pagina.objetos,
+        'pagina': pagina,
+        'total_clientes': contar_aproximado(clientes, 'clientes'),
+    })
 
 @login_required
 def crear_cliente(request):
@@ -243,8 +260,13 @@ def eliminar_cliente(request, cliente_id):
 # ✅ VISTAS DE REPARTIDORES
 @login_required
 def lista_repartidores(request):
-    repartidores = Repartidor.objects.all().order_by('-activo', 'nombres')
-    return render(request, 'repartidores/lista_repartidores.html', {'repartidores': repartidores})
+    repartidores = Repartidor.objects.all()
+    pagina = paginar(request, repartidores, ['-activo', 'nombres', 'repartidor_id'])
+    return render(request, 'repartidores/lista_repartidores.html', {
+        'repartidores': pagina.objetos,
+        'pagina': pagina,
+        'total_repartidores': contar_aproximado(repartidores, 'repartidores'),
+    })
 
 @login_required
 def crear_repartidor(request):
@@ -256,7 +278,7 @@ def crear_repartidor(request):
             telefono = request.POST.get('telefono')
             vehiculo = request.POST.get('vehiculo')
             zona_asignada = request.POST.get('zona_asignada')
-            capacidad_entregas = request.POST.get('capacidad_entregas', 5)
+            capacidad_maxima = int(request.POST.get('capacidad_maxima') or 5)
             disponible = request.POST.get('disponible') == 'on'
             activo = request.POST.get('activo') == 'on'
             if not cedula or not nombres or not apellidos or not telefono or not zona_asignada:
@@ -272,7 +294,8 @@ def crear_repartidor(request):
                 telefono=telefono,
                 vehiculo=vehiculo,
                 zona_asignada=zona_asignada,
-                capacidad_entregas=capacidad_entregas,
+                capacidad_maxima=capacidad_maxima,
+                capacidad_entregas=capacidad_maxima,
                 disponible=disponible,
                 activo=activo
             )
@@ -294,7 +317,10 @@ def editar_repartidor(request, repartidor_id):
             repartidor.telefono = request.POST.get('telefono')
             repartidor.vehiculo = request.POST.get('vehiculo')
             repartidor.zona_asignada = request.POST.get('zona_asignada')
-            repartidor.capacidad_entregas = request.POST.get('capacidad_entregas')
+            repartidor.capacidad_maxima = int(request.POST.get('capacidad_maxima'))
+            # Lo libre se recalcula con la carga abierta en vez de editarse a mano
+            carga = cargas_abiertas([repartidor.pk]).get(repartidor.pk, 0)
+            repartidor.capacidad_entregas = max(repartidor.capacidad_maxima - carga, 0)
             repartidor.disponible = request.POST.get('disponible') == 'on'
             repartidor.activo = request.POST.get('activo') == 'on'
             repartidor.save()
@@ -316,17 +342,42 @@ def eliminar_repartidor(request, repartidor_id):
             messages.error(request, f'Error al eliminar repartidor: {str(e)}')
     return render(request, 'repartidores/eliminar_repartidor.html', {'repartidor': repartidor})
 
+@login_required
+def ubicacion_repartidor(request, repartidor_id):
+    """Recibe la última ubicación del repartidor (POST latitud, longitud)"""
+    if request.method != 'POST':
+        return HttpResponseBadRequest('Use POST con latitud y longitud')
+    try:
+        latitud = float(request.POST.get('latitud', ''))
+        longitud = float(request.POST.get('longitud', ''))
+    except ValueError:
+        return HttpResponseBadRequest('latitud y longitud deben ser números')
+    if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):
+        return HttpResponseBadRequest('Coordenadas fuera de rango')
+    if not geocodificacion.actualizar_ubicacion(repartidor_id, latitud, longitud):
+        raise Http404('Repartidor no encontrado')
+    return JsonResponse({'repartidor_id': repartidor_id, 'latitud': latitud, 'longitud': longitud})
+
 # ✅ VISTAS DE PEDIDOS
 @login_required
 def lista_pedidos(request):
     estado = request.GET.get('estado', '')
+    pedidos = Pedido.objects.select_related('cliente', 'repartidor')
     if estado:
-        pedidos = Pedido.objects.filter(estado=estado).select_related('cliente', 'repartidor').order_by('-fecha_pedido')
-    else:
-        pedidos = Pedido.objects.select_related('cliente', 'repartidor').order_by('-fecha_pedido')
+        pedidos = pedidos.filter(estado=estado)
+    pagina = paginar(request, pedidos, ['-fecha_pedido', '-pedido_id'])
+    por_estado = contadores.totales('estado')
+    total_pedidos = por_estado.get(estado, 0) if estado else sum(por_estado.values())
+    en_vivo = eventos.en_vivo()
+    avisar_asignacion_automatica(request)
     return render(request, 'pedidos/lista_pedidos.html', {
-        'pedidos': pedidos,
-        'estado_filtro': estado
+        'pedidos': pagina.objetos,
+        'pagina': pagina,
+        'total_pedidos': total_pedidos,
+        'estado_filtro': estado,
+        'eventos_en_vivo': en_vivo,
+        # Sin SSE el tablero consulta los eventos posteriores a este
+        'ultimo_evento': None if en_vivo else eventos.ultimo_evento(),
     })
 
 @login_required
@@ -341,14 +392,16 @@ def crear_pedido(request):
             prioridad = request.POST.get('prioridad', 'normal')
             tiempo_estimado_minutos = request.POST.get('tiempo_estimado_minutos')
             observaciones = request.POST.get('observaciones')
-            if not cliente_id or not direccion_entrega or not zona_entrega or not tiempo_estimado_minutos:
+            if not cliente_id or not direccion_entrega or not zona_entrega:
                 messages.error(request, 'Todos los campos marcados con * son requeridos')
-                return render(request, 'pedidos/form_pedido.html', {
-                    'clientes': Cliente.objects.all(),
-                    'repartidores': Repartidor.objects.filter(activo=True, disponible=True)
-                })
+                return render(request, 'pedidos/form_pedido.html')
+            if not tiempo_estimado_minutos:
+                tiempo_estimado_minutos = eta.estimar(zona_entrega, prioridad)
             cliente = Cliente.objects.get(pk=cliente_id)
             repartidor = Repartidor.objects.get(pk=repartidor_id) if repartidor_id else None
+            if estado in transiciones.ESTADOS_CON_REPARTIDOR and repartidor is None:
+                messages.error(request, 'Un pedido asignado, en camino o entregado necesita repartidor')
+                return render(request, 'pedidos/form_pedido.html')
             pedido = Pedido(
                 cliente=cliente,
                 repartidor=repartidor,
@@ -359,44 +412,56 @@ def crear_pedido(request):
                 tiempo_estimado_minutos=tiempo_estimado_minutos,
                 observaciones=observaciones
             )
-            pedido.save()
-            HistorialEstados.objects.create(
-                pedido=pedido,
-                estado_nuevo=estado,
-                usuario=request.user.username
-            )
+            with transaction.atomic():
+                # Un pedido que nace asignado o en camino ya ocupa a su repartidor
+                if estado in ESTADOS_CON_CARGA and not reservar_capacidad(repartidor.repartidor_id):
+                    raise transiciones.TransicionInvalida(f'{repartidor.nombres} ya no tiene capacidad disponible')
+                pedido.save()
+                HistorialEstados.objects.create(
+                    pedido=pedido,
+                    estado_nuevo=estado,
+                    usuario=request.user.username
+                )
+                eventos.publicar_pedido('nuevo', pedido)
             messages.success(request, f'Pedido #{pedido.pedido_id} creado exitosamente!')
             return redirect('lista_pedidos')
         except Exception as e:
             messages.error(request, f'Error al crear pedido: {str(e)}')
-    return render(request, 'pedidos/form_pedido.html', {
-        'clientes': Cliente.objects.all(),
-        'repartidores': Repartidor.objects.filter(activo=True, disponible=True)
-    })
+    return render(request, 'pedidos/form_pedido.html')
+
+# El repartidor y el estado no se guardan con el resto del formulario: pasan
+# por transiciones.py para reservar y liberar la capacidad de los repartidores
+CAMPOS_EDITABLES_PEDIDO = [
+    'cliente', 'direccion_entrega', 'zona_entrega', 'prioridad', 'tiempo_estimado_minutos', 'observaciones',
+]
 
 @login_required
 def editar_pedido(request, pedido_id):
-    pedido = get_object_or_404(Pedido, pk=pedido_id)
+    pedido = get_object_or_404(Pedido.objects.select_related('cliente', 'repartidor'), pk=pedido_id)
     if request.method == 'POST':
         try:
+            nuevo_estado = request.POST.get('estado')
+            repartidor_id = int(request.POST.get('repartidor') or 0) or None
             pedido.cliente_id = request.POST.get('cliente')
-            pedido.repartidor_id = request.POST.get('repartidor')
             pedido.direccion_entrega = request.POST.get('direccion_entrega')
             pedido.zona_entrega = request.POST.get('zona_entrega')
-            pedido.estado = request.POST.get('estado')
             pedido.prioridad = request.POST.get('prioridad')
             pedido.tiempo_estimado_minutos = request.POST.get('tiempo_estimado_minutos')
             pedido.observaciones = request.POST.get('observaciones')
-            pedido.save()
+            with transaction.atomic():
+                # Primero el repartidor (un asignado o en camino mueve su capacidad al
+                # nuevo) y luego el estado, por una transición legal que al asignar
+                # reserva la capacidad; el resto se guarda sin tocar estado ni fechas
+                if repartidor_id != pedido.repartidor_id:
+                    transiciones.cambiar_repartidor(pedido, repartidor_id)
+                if nuevo_estado and nuevo_estado != pedido.estado:
+                    transiciones.transicionar(pedido, nuevo_estado, request.user.username)
+                pedido.save(update_fields=CAMPOS_EDITABLES_PEDIDO)
             messages.success(request, f'Pedido #{pedido_id} actualizado exitosamente!')
             return redirect('lista_pedidos')
         except Exception as e:
             messages.error(request, f'Error al actualizar pedido: {str(e)}')
-    return render(request, 'pedidos/editar_pedido.html', {
-        'pedido': pedido,
-        'clientes': Cliente.objects.all(),
-        'repartidores': Repartidor.objects.filter(activo=True)
-    })
+    return render(request, 'pedidos/editar_pedido.html', {'pedido': pedido})
 
 @login_required
 def eliminar_pedido(request, pedido_id):
@@ -412,189 +477,244 @@ def eliminar_pedido(request, pedido_id):
 
 @login_required
 def actualizar_estado_pedido(request, pedido_id):
-    pedido = get_object_or_404(Pedido, pk=pedido_id)
-    repartidores_disponibles = Repartidor.objects.filter(activo=True, disponible=True)
+    pedido = get_object_or_404(Pedido.objects.select_related('repartidor'), pk=pedido_id)
     if request.method == 'POST':
         nuevo_estado = request.POST.get('estado')
         repartidor_id = request.POST.get('repartidor_id')
         if nuevo_estado:
-            estado_anterior = pedido.estado
-            pedido.estado = nuevo_estado
             if nuevo_estado == 'asignado' and repartidor_id:
-                repartidor = Repartidor.objects.get(pk=repartidor_id)
-                pedido.repartidor = repartidor
-                pedido.fecha_asignacion = timezone.now()
-            if nuevo_estado == 'asignado' and not pedido.fecha_asignacion:
-                pedido.fecha_asignacion = timezone.now()
-            elif nuevo_estado == 'entregado' and not pedido.fecha_entrega_real:
-                pedido.fecha_entrega_real = timezone.now()
-                if pedido.fecha_pedido and pedido.fecha_entrega_real:
-                    diferencia = pedido.fecha_entrega_real - pedido.fecha_pedido
-                    pedido.tiempo_real_minutos = int(diferencia.total_seconds() // 60)
-                crear_reporte_entrega(pedido)
-            pedido.save()
-            HistorialEstados.objects.create(
-                pedido=pedido,
-                estado_anterior=estado_anterior,
-                estado_nuevo=nuevo_estado,
-                usuario=request.user.username
-            )
+                repartidor_id = get_object_or_404(Repartidor, pk=repartidor_id).pk
+            try:
+                # Al pasar a asignado reserva la capacidad del repartidor (ver transiciones.py)
+                transiciones.transicionar(pedido, nuevo_estado, request.user.username, repartidor_id=repartidor_id)
+            except transiciones.TransicionInvalida as e:
+                messages.error(request, f'❌ Pedido #{pedido_id}: {e}')
+                return redirect('cambiar_estado_pedido', pedido_id=pedido_id)
             messages.success(request, f'✅ Estado del pedido #{pedido_id} actualizado a "{pedido.get_estado_display()}"')
             return redirect('lista_pedidos')
-    return render(request, 'pedidos/cambiar_estado.html', {
-        'pedido': pedido,
-        'repartidores_disponibles': repartidores_disponibles
-    })
+    return render(request, 'pedidos/cambiar_estado.html', {'pedido': pedido})
+
+# Errores por pedido que se listan en el mensaje del cambio en lote
+MAXIMO_ERRORES_MOSTRADOS = 10
+
+@login_required
+def cambiar_estado_lote(request):
+    """
+    Cambia el estado de los pedidos marcados en la lista (POST pedidos=id...,
+    estado). Con Accept: application/json responde el resultado de cada
+    pedido; si no, lo resume en mensajes y vuelve a la lista.
+    """
+    if request.method != 'POST':
+        return redirect('lista_pedidos')
+    quiere_json = 'application/json' in request.headers.get('Accept', '')
+    try:
+        pedido_ids = [int(valor) for valor in request.POST.getlist('pedidos')]
+    except ValueError:
+        pedido_ids = None
+    try:
+        if not pedido_ids:
+            raise ValueError('Seleccione al menos un pedido')
+        resultados = transiciones.cambiar_estados(pedido_ids, request.POST.get('estado', ''), request.user.username)
+    except ValueError as e:
+        if quiere_json:
+            return JsonResponse({'error': str(e)}, status=400)
+        messages.error(request, f'❌ {e}')
+    else:
+        if quiere_json:
+            return JsonResponse({'resultados': resultados})
+        cambiados = sum(resultado['ok'] for resultado in resultados)
+        fallidos = [resultado for resultado in resultados if not resultado['ok']]
+        if cambiados:
+            messages.success(request, f'✅ {cambiados} pedidos actualizados')
+        if fallidos:
+            detalle = ', '.join(
+                f"#{resultado['pedido_id']} ({resultado['error']})" for resultado in fallidos[:MAXIMO_ERRORES_MOSTRADOS]
+            )
+            if len(fallidos) > MAXIMO_ERRORES_MOSTRADOS:
+                detalle += f' y {len(fallidos) - MAXIMO_ERRORES_MOSTRADOS} más'
+            messages.error(request, f'❌ {len(fallidos)} pedidos sin cambiar: {detalle}')
+    filtro = request.POST.get('estado_filtro')
+    if filtro in dict(Pedido.ESTADO_CHOICES):
+        return redirect(f"{reverse('lista_pedidos')}?estado={filtro}")
+    return redirect('lista_pedidos')
 
 @login_required
 def historial_pedido(request, pedido_id):
-    pedido = get_object_or_404(Pedido, pk=pedido_id)
-    historial = HistorialEstados.objects.filter(pedido=pedido).order_by('-fecha_cambio')
+    # Los pedidos archivados se buscan en PEDIDO_ARCHIVADO con el mismo id
+    encontrado = buscar_pedido(pedido_id)
+    if encontrado is None:
+        raise Http404('Pedido no encontrado')
+    pedido, historial, archivado = encontrado
     return render(request, 'pedidos/historial_pedido.html', {
         'pedido': pedido,
-        'historial': historial
+        'historial': historial,
+        'archivado': archivado
     })
 
 # ✅ ASIGNACIÓN MANUAL DE REPARTIDORES
 @login_required
 def asignar_repartidor_pedido(request, pedido_id):
     pedido = get_object_or_404(Pedido, pk=pedido_id)
-    repartidores_disponibles = Repartidor.objects.filter(activo=True, disponible=True)
     
     if request.method == 'POST':
         repartidor_id = request.POST.get('repartidor_id')
         
         if repartidor_id:
-            repartidor = Repartidor.objects.get(pk=repartidor_id)
-            
-            # Asignar repartidor al pedido
-            pedido.repartidor = repartidor
-            pedido.estado = 'asignado'
-            pedido.fecha_asignacion = timezone.now()
-            pedido.save()
-            
-            # Reducir capacidad del repartidor
-            repartidor.capacidad_entregas -= 1
-            if repartidor.capacidad_entregas <= 0:
-                repartidor.disponible = False
-            repartidor.save()
-            
-            # Registrar en historial
-            HistorialEstados.objects.create(
-                pedido=pedido,
-                estado_anterior='pendiente',
-                estado_nuevo='asignado',
-                usuario=request.user.username
-            )
+            repartidor = get_object_or_404(Repartidor, pk=repartidor_id)
             
+            try:
+                # Reserva la capacidad del repartidor (UPDATE condicional, sin bloqueos) y, si
+                # el pedido ya no está pendiente, la reserva se revierte con la transacción
+                transiciones.transicionar(
+                    pedido, 'asignado', request.user.username, repartidor_id=repartidor.repartidor_id
+                )
+            except transiciones.TransicionInvalida as e:
+                messages.error(request, f'❌ Pedido #{pedido_id}: {e}')
+                return redirect('asignar_repartidor', pedido_id=pedido_id)
+
             messages.success(request, f'✅ Repartidor {repartidor.nombres} asignado al pedido #{pedido_id}')
             return redirect('lista_pedidos')
     
     return render(request, 'pedidos/asignar_repartidor.html', {
         'pedido': pedido,
-        'repartidores_disponibles': repartidores_disponibles
+        'repartidores_cercanos': geocodificacion.repartidores_cercanos(pedido),
+        'hay_repartidores_disponibles': Repartidor.objects.filter(activo=True, disponible=True).exists()
     })
 
 @login_required
 def reasignar_repartidor_pedido(request, pedido_id):
     pedido = get_object_or_404(Pedido, pk=pedido_id)
-    repartidores_disponibles = Repartidor.objects.filter(activo=True, disponible=True)
     
     if request.method == 'POST':
         repartidor_id = request.POST.get('repartidor_id')
         
         if repartidor_id:
-            nuevo_repartidor = Repartidor.objects.get(pk=repartidor_id)
-            repartidor_anterior = pedido.repartidor
-            
-            # Liberar capacidad del repartidor anterior
-            if repartidor_anterior:
-                repartidor_anterior.capacidad_entregas += 1
-                repartidor_anterior.disponible = True
-                repartidor_anterior.save()
-            
-            # Asignar nuevo repartidor
-            pedido.repartidor = nuevo_repartidor
-            pedido.save()
-            
-            # Reducir capacidad del nuevo repartidor
-            nuevo_repartidor.capacidad_entregas -= 1
-            if nuevo_repartidor.capacidad_entregas <= 0:
-                nuevo_repartidor.disponible = False
-            nuevo_repartidor.save()
-            
+            nuevo_repartidor = get_object_or_404(Repartidor, pk=repartidor_id)
+
+            try:
+                # UPDATE condicional sobre el repartidor y el estado leídos; la
+                # capacidad solo se mueve si el pedido seguía igual
+                transiciones.reasignar(pedido, nuevo_repartidor.repartidor_id)
+            except transiciones.TransicionInvalida as e:
+                messages.error(request, f'❌ Pedido #{pedido_id}: {e}')
+                return redirect('reasignar_repartidor', pedido_id=pedido_id)
+
             messages.success(request, f'✅ Pedido #{pedido_id} reasignado a {nuevo_repartidor.nombres}')
             return redirect('lista_pedidos')
     
     return render(request, 'pedidos/reasignar_repartidor.html', {
         'pedido': pedido,
-        'repartidores_disponibles': repartidores_disponibles
+        'hay_repartidores_disponibles': Repartidor.objects.filter(activo=True, disponible=True).exists()
     })
 
+# ✅ EVENTOS EN VIVO PARA EL TABLERO DE DESPACHO (SSE)
+def puede_ver_tablero(user):
+    return user.is_authenticated and not es_cliente(user)
+
+async def eventos_pedidos(request):
+    # login_required no admite vistas asíncronas en Django 4.2
+    if not await sync_to_async(puede_ver_tablero)(request.user):
+        return HttpResponseForbidden('Inicie sesión como operador para recibir eventos')
+    if not eventos.en_vivo():
+        raise Http404('Eventos en vivo deshabilitados: use /pedidos/eventos/recientes/')
+    try:
+        ultimo_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        ultimo_id = None
+    respuesta = StreamingHttpResponse(eventos.flujo(ultimo_id), content_type='text/event-stream')
+    respuesta['Cache-Control'] = 'no-cache'
+    respuesta['X-Accel-Buffering'] = 'no'
+    return respuesta
+
+def eventos_pedidos_recientes(request):
+    # Alternativa sin conexión abierta para servidores WSGI (ver eventos.en_vivo)
+    if not puede_ver_tablero(request.user):
+        return HttpResponseForbidden('Inicie sesión como operador para recibir eventos')
+    try:
+        desde = int(request.GET.get('desde', ''))
+    except ValueError:
+        return HttpResponseBadRequest('desde debe ser un número de evento')
+    recientes = eventos.eventos_desde(desde)
+    recargar = len(recientes) > eventos.EVENTOS_RECIENTES
+    if recargar:
+        recientes = []
+        ultimo = eventos.ultimo_evento()
+    else:
+        ultimo = recientes[-1][0] if recientes else desde
+    # Los datos ya están serializados en EVENTO_TABLERO
+    return HttpResponse(
+        f'{{"ultimo": {ultimo}, "recargar": {"true" if recargar else "false"}, '
+        f'"eventos": [{", ".join(datos for _, datos in recientes)}]}}',
+        content_type='application/json'
+    )
+
 # ✅ ASIGNACIÓN AUTOMÁTICA DE REPARTIDORES
 @login_required
 def asignar_repartidores_automaticos(request):
     if request.method == 'POST':
-        try:
-            pedidos_pendientes = Pedido.objects.filter(
-                estado='pendiente',
-                repartidor__isnull=True
-            )
-            repartidores_disponibles = Repartidor.objects.filter(
-                activo=True,
-                disponible=True
-            ).order_by('capacidad_entregas')
-            asignaciones = 0
-            for pedido in pedidos_pendientes:
-                for repartidor in repartidores_disponibles:
-                    if repartidor.capacidad_entregas > 0:
-                        pedido.repartidor = repartidor
-                        pedido.estado = 'asignado'
-                        pedido.fecha_asignacion = timezone.now()
-                        pedido.save()
-                        repartidor.capacidad_entregas -= 1
-                        if repartidor.capacidad_entregas <= 0:
-                            repartidor.disponible = False
-                        repartidor.save()
-                        HistorialEstados.objects.create(
-                            pedido=pedido,
-                            estado_anterior='pendiente',
-                            estado_nuevo='asignado',
-                            usuario=request.user.username
-                        )
-                        asignaciones += 1
-                        break
-            messages.success(request, f'✅ Se asignaron {asignaciones} pedidos a repartidores disponibles')
-            return redirect('lista_pedidos')
-        except Exception as e:
-            messages.error(request, f'❌ Error en asignación automática: {str(e)}')
+        # La asignación en lote corre en `manage.py worker`; una segunda
+        # petición mientras sigue en cola no la duplica
+        tarea = tareas.encolar_unica('asignar_automaticos', usuario=request.user.username)
+        request.session['tarea_asignacion'] = tarea.pk
+        messages.success(
+            request,
+            '✅ Asignación automática en cola: el resultado aparecerá aquí cuando el worker la termine'
+        )
     return redirect('lista_pedidos')
 
+def avisar_asignacion_automatica(request):
+    """
+    Muestra en la lista de pedidos cuántos pedidos asignó y cuánto tardó la
+    asignación automática que encoló este usuario, una vez terminada
+    """
+    tarea_id = request.session.get('tarea_asignacion')
+    if tarea_id is None:
+        return
+    tarea = Tarea.objects.filter(pk=tarea_id).only('estado', 'resultado').first()
+    if tarea is not None and tarea.estado in ('pendiente', 'en_proceso'):
+        return
+    del request.session['tarea_asignacion']
+    if tarea is None:
+        # Ya purgada por el worker
+        return
+    if tarea.estado == 'completada':
+        messages.success(request, f'✅ {tarea.resultado}')
+    else:
+        messages.error(request, '❌ La asignación automática falló; revise la cola de errores del worker')
+
 # ✅ VISTAS DE REPORTES
 @login_required
 def reportes_entregas(request):
-    reportes = ReporteEntregas.objects.select_related('pedido', 'repartidor').order_by('-fecha_reporte')
-    total_entregas = reportes.count()
-    entregas_exitosas = reportes.filter(estado_entrega='exitosa').count()
-    entregas_fallidas = reportes.filter(estado_entrega='fallida').count()
-    entregas_reprogramadas = reportes.filter(estado_entrega='reprogramada').count()
-    promedio_calificacion = reportes.filter(calificacion__isnull=False).aggregate(
-        avg_calificacion=Avg('calificacion')
-    )['avg_calificacion'] or 0
+    reportes = ReporteEntregas.objects.select_related('pedido', 'repartidor')
+    pagina = paginar(request, reportes, ['-fecha_reporte', '-reporte_id'])
+    # Todas las estadísticas en una sola consulta con agregación condicional
+    estadisticas = ReporteEntregas.objects.aggregate(
+        total_entregas=Count('pk'),
+        entregas_exitosas=Count('pk', filter=Q(estado_entrega='exitosa')),
+        entregas_fallidas=Count('pk', filter=Q(estado_entrega='fallida')),
+        entregas_reprogramadas=Count('pk', filter=Q(estado_entrega='reprogramada')),
+        promedio_calificacion=Avg('calificacion'),
+    )
+    # Anti-join NOT EXISTS: usa el índice único de REPORTE_ENTREGAS.pedido_id
     pedidos_entregados_sin_reporte = Pedido.objects.filter(
         estado='entregado'
-    ).exclude(
-        pedido_id__in=ReporteEntregas.objects.values('pedido_id')
-    ).select_related('cliente')
+    ).filter(
+        ~Exists(ReporteEntregas.objects.filter(pedido_id=OuterRef('pk')))
+    ).select_related('cliente', 'repartidor')
+    pagina_sin_reporte = paginar(
+        request, pedidos_entregados_sin_reporte, ['-fecha_pedido', '-pedido_id'], prefijo='sin_reporte_'
+    )
     context = {
-        'reportes': reportes,
-        'total_entregas': total_entregas,
-        'entregas_exitosas': entregas_exitosas,
-        'entregas_fallidas': entregas_fallidas,
-        'entregas_reprogramadas': entregas_reprogramadas,
-        'promedio_calificacion': round(promedio_calificacion, 2),
-        'pedidos_sin_reporte': pedidos_entregados_sin_reporte.count(),
-        'pedidos_entregados_sin_reporte': pedidos_entregados_sin_reporte,
+        'reportes': pagina.objetos,
+        'pagina': pagina,
+        'total_entregas': estadisticas['total_entregas'],
+        'entregas_exitosas': estadisticas['entregas_exitosas'],
+        'entregas_fallidas': estadisticas['entregas_fallidas'],
+        'entregas_reprogramadas': estadisticas['entregas_reprogramadas'],
+        'promedio_calificacion': round(estadisticas['promedio_calificacion'] or 0, 2),
+        'pedidos_sin_reporte': contar_aproximado(pedidos_entregados_sin_reporte, 'pedidos:sin_reporte'),
+        'pedidos_entregados_sin_reporte': pagina_sin_reporte.objetos,
+        'pagina_sin_reporte': pagina_sin_reporte,
     }
     return render(request, 'reportes/lista_reportes.html', context)
 
@@ -679,9 +799,13 @@ def editar_reporte(request, reporte_id):
 
 @login_required
 def detalle_reporte(request, reporte_id):
-    reporte = get_object_or_404(ReporteEntregas, pk=reporte_id)
+    encontrado = buscar_reporte(reporte_id)
+    if encontrado is None:
+        raise Http404('Reporte no encontrado')
+    reporte, archivado = encontrado
     return render(request, 'reportes/detalle_reporte.html', {
-        'reporte': reporte
+        'reporte': reporte,
+        'archivado': archivado
     })
 
 @login_required
@@ -696,20 +820,127 @@ def eliminar_reporte(request, reporte_id):
             messages.error(request, f'Error al eliminar reporte: {str(e)}')
     return render(request, 'reportes/eliminar_reporte.html', {'reporte': reporte})
 
-# ✅ DASHBOARD
+# ✅ AUTOCOMPLETADO DE CLIENTES Y REPARTIDORES
+LIMITE_AUTOCOMPLETAR = 20
+
+def _busqueda_por_prefijo(request):
+    """
+    Lee ?q= y ?limite= y retorna (q, limite). La búsqueda va contra el
+    índice de términos de busqueda.py (prefijos sin tildes y tolerancia a
+    errores de tipeo), nunca con LIKE '%q%' sobre la tabla
+    """
+    q = request.GET.get('q', '').strip()
+    try:
+        limite = min(max(int(request.GET.get('limite', 10)), 1), LIMITE_AUTOCOMPLETAR)
+    except ValueError:
+        limite = 10
+    return q, limite
+
 @login_required
-def dashboard(request):
-    pedidos_por_estado = Pedido.objects.values('estado').annotate(total=Count('estado'))
-    top_repartidores = Repartidor.objects.annotate(
-        total_entregas=Count('pedido')
-    ).filter(total_entregas__gt=0).order_by('-total_entregas')[:5]
-    hoy = timezone.now().date()
-    pedidos_hoy = Pedido.objects.filter(fecha_pedido__date=hoy).count()
-    reportes_hoy = ReporteEntregas.objects.filter(fecha_reporte=hoy).count()
+def autocompletar_clientes(request):
+    q, limite = _busqueda_por_prefijo(request)
+    resultados = []
+    if q:
+        ids = busqueda.buscar_ids(Cliente, q, limite)
+        clientes = Cliente.objects.filter(pk__in=ids).values_list('cliente_id', 'nombres', 'apellidos', 'cedula')
+        resultados = [
+            {'id': cliente_id, 'texto': f'{nombres} {apellidos} - {cedula}'}
+            for cliente_id, nombres, apellidos, cedula in sorted(clientes, key=lambda c: (c[1], c[2]))
+        ]
+    return JsonResponse({'resultados': resultados})
+
+@login_required
+def autocompletar_repartidores(request):
+    q, limite = _busqueda_por_prefijo(request)
+    resultados = []
+    if q:
+        filtra = request.GET.get('disponibles') or request.GET.get('activos')
+        # Con filtro se piden candidatos de más: parte no estará disponible
+        ids = busqueda.buscar_ids(Repartidor, q, limite * 5 if filtra else limite)
+        repartidores = Repartidor.objects.filter(pk__in=ids)
+        if request.GET.get('disponibles'):
+            repartidores = repartidores.filter(activo=True, disponible=True, capacidad_entregas__gt=0)
+        elif request.GET.get('activos'):
+            repartidores = repartidores.filter(activo=True)
+        repartidores = repartidores.values_list(
+            'repartidor_id', 'nombres', 'apellidos', 'vehiculo', 'zona_asignada', 'capacidad_entregas'
+        )[:limite]
+        resultados = [
+            {
+                'id': repartidor_id,
+                'texto': f'{nombres} {apellidos} - {vehiculo or "Sin vehículo"} - Zona: {zona} - Capacidad: {capacidad}',
+            }
+            for repartidor_id, nombres, apellidos, vehiculo, zona, capacidad in sorted(repartidores, key=lambda r: (r[1], r[2]))
+        ]
+    return JsonResponse({'resultados': resultados})
+
+# ✅ EXPORTACIÓN DE DATOS
+@login_required
+@user_passes_test(es_staff, login_url='/login/')
+def exportar_datos(request, conjunto):
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATOS:
+        return HttpResponseBadRequest('Formato no soportado (use csv o ndjson)')
+    try:
+        columnas, filas = construir_consulta(
+            conjunto,
+            desde=request.GET.get('desde'),
+            hasta=request.GET.get('hasta'),
+            zona=request.GET.get('zona'),
+            estado=request.GET.get('estado'),
+        )
+    except FiltroInvalido as e:
+        return HttpResponseBadRequest(str(e))
+    respuesta = StreamingHttpResponse(generar_filas(columnas, filas, formato), content_type=FORMATOS[formato])
+    fecha = timezone.localdate().isoformat()
+    respuesta['Content-Disposition'] = f'attachment; filename="{conjunto}_{fecha}.{formato}"'
+    return respuesta
+
+# ✅ MÉTRICAS (formato Prometheus)
+@login_required
+@user_passes_test(es_staff, login_url='/login/')
+def metricas_prometheus(request):
+    return HttpResponse(
+        metricas.exportar_prometheus() + tareas.exportar_prometheus() + despacho.exportar_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+# ✅ DASHBOARD
+async def dashboard(request):
+    autenticado, _ = await sync_to_async(estado_sesion)(request.user)
+    if not autenticado:
+        return redirect_to_login(request.get_full_path())
+    hoy = timezone.localdate()
+    # Rango sobre la columna en vez de __date para que use el índice
+    inicio_hoy = timezone.make_aware(datetime.datetime.combine(hoy, datetime.time.min))
+    valores, obsoletos = await calcular_concurrentes({
+        'por_estado': (lambda: contadores.totales('estado'), {}),
+        'por_zona': (lambda: contadores.totales('zona'), {}),
+        'top_repartidores': (
+            lambda: list(Repartidor.objects.annotate(
+                total_entregas=Count('pedido')
+            ).filter(total_entregas__gt=0).order_by('-total_entregas')[:5]),
+            []
+        ),
+        'pedidos_hoy': (
+            lambda: Pedido.objects.filter(
+                fecha_pedido__gte=inicio_hoy,
+                fecha_pedido__lt=inicio_hoy + datetime.timedelta(days=1)
+            ).count(),
+            0
+        ),
+        'reportes_hoy': (lambda: ReporteEntregas.objects.filter(fecha_reporte=hoy).count(), 0),
+    })
     context = {
-        'pedidos_por_estado': list(pedidos_por_estado),
-        'top_repartidores': top_repartidores,
-        'pedidos_hoy': pedidos_hoy,
-        'reportes_hoy': reportes_hoy,
+        'pedidos_por_estado': [
+            {'estado': estado, 'total': total} for estado, total in valores['por_estado'].items()
+        ],
+        'pedidos_por_zona': [
+            {'zona': zona, 'total': total} for zona, total in valores['por_zona'].items()
+        ],
+        'top_repartidores': valores['top_repartidores'],
+        'pedidos_hoy': valores['pedidos_hoy'],
+        'reportes_hoy': valores['reportes_hoy'],
+        'datos_obsoletos': obsoletos,
     }
-    return render(request, 'dashboard.html', context)
\ No newline at end of file
+    return await sync_to_async(render)(request, 'dashboard.html', context)
\ No newline at end of file
@@ -2,6 +2,8 @@
 ASGI config for gestion_domicilios project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn farmacia.asgi:application``) so
+the /pedidos/eventos/ stream holds a coroutine instead of a worker thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -10,5 +12,7 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 import os
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gestion_farmacia.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'farmacia.settings')
+# El tablero en vivo (SSE) solo se ofrece con este punto de entrada
+os.environ.setdefault('EVENTOS_EN_VIVO', '1')
 application = get_asgi_application()
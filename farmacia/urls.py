@@ -23,6 +23,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.index, name='index'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('metrics/', views.metricas_prometheus, name='metricas'),
     
     # URLs de autenticación
     path('login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
@@ -50,6 +51,7 @@ urlpatterns = [
         path('crear/', views.crear_repartidor, name='crear_repartidor'),
         path('editar/<int:repartidor_id>/', views.editar_repartidor, name='editar_repartidor'),
         path('eliminar/<int:repartidor_id>/', views.eliminar_repartidor, name='eliminar_repartidor'),
+        path('<int:repartidor_id>/ubicacion/', views.ubicacion_repartidor, name='ubicacion_repartidor'),
     ])),
     
     # URLs de pedidos
@@ -59,13 +61,29 @@ urlpatterns = [
         path('editar/<int:pedido_id>/', views.editar_pedido, name='editar_pedido'),
         path('eliminar/<int:pedido_id>/', views.eliminar_pedido, name='eliminar_pedido'),
         path('<int:pedido_id>/cambiar-estado/', views.actualizar_estado_pedido, name='cambiar_estado_pedido'),
+        path('cambiar-estado-lote/', views.cambiar_estado_lote, name='cambiar_estado_lote'),
         path('<int:pedido_id>/historial/', views.historial_pedido, name='historial_pedido'),
+        path('eventos/', views.eventos_pedidos, name='eventos_pedidos'),
+        path('eventos/recientes/', views.eventos_pedidos_recientes, name='eventos_pedidos_recientes'),
         path('asignar-automaticos/', views.asignar_repartidores_automaticos, name='asignar_automaticos'),
         # Nuevas URLs para asignación manual
         path('asignar-repartidor/<int:pedido_id>/', views.asignar_repartidor_pedido, name='asignar_repartidor'),
         path('reasignar-repartidor/<int:pedido_id>/', views.reasignar_repartidor_pedido, name='reasignar_repartidor'),
     ])),
     
+    # URLs de autocompletado (búsqueda por prefijo en JSON)
+    path('autocompletar/', include([
+        path('clientes/', views.autocompletar_clientes, name='autocompletar_clientes'),
+        path('repartidores/', views.autocompletar_repartidores, name='autocompletar_repartidores'),
+    ])),
+
+    # URLs de exportación (CSV / NDJSON en streaming)
+    path('exportar/', include([
+        path('pedidos/', views.exportar_datos, {'conjunto': 'pedidos'}, name='exportar_pedidos'),
+        path('historial/', views.exportar_datos, {'conjunto': 'historial'}, name='exportar_historial'),
+        path('reportes/', views.exportar_datos, {'conjunto': 'reportes'}, name='exportar_reportes'),
+    ])),
+    
     # URLs de reportes
     path('reportes/', include([
         path('', views.reportes_entregas, name='reportes_entregas'),